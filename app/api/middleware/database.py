@@ -1,20 +1,47 @@
 import os
+import time
 import asyncpg
 import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from redis import asyncio as aioredis
 
 load_dotenv(override=True)
 
+_pool: asyncpg.Pool | None = None
+_pool_loop: asyncio.AbstractEventLoop | None = None
+_redis_pool: aioredis.ConnectionPool | None = None
+_redis_pool_loop: asyncio.AbstractEventLoop | None = None
+
+pool_metrics = {
+    "acquired": 0,
+    "timeouts": 0,
+    "wait_secs_total": 0.0,
+    "wait_secs_max": 0.0,
+}
+
+def connection_kwargs() -> dict:
+    return {
+        "database": os.getenv("DATABASE"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "host": os.getenv("DB_HOST"),
+        "port": int(os.getenv("DB_PORT"))
+    }
+
+def pool_settings() -> dict:
+    return {
+        "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+        "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+        "statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100)),
+    }
+
+def acquire_timeout() -> float:
+    return float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 10))
+
 async def setup_connection() -> asyncpg.connection.Connection:
     try:
-        return await asyncpg.connect(**{
-            "database": os.getenv("DATABASE"),
-            "user": os.getenv("DB_USER"),
-            "password": os.getenv("DB_PASSWORD"),
-            "host": os.getenv("DB_HOST"),
-            "port": int(os.getenv("DB_PORT"))
-        })
+        return await asyncpg.connect(**connection_kwargs())
 
     except Exception as e:
         print(e)
@@ -22,15 +49,112 @@ async def setup_connection() -> asyncpg.connection.Connection:
         print("Error connecting to database:")
         traceback.print_exc()
         return None
-    
+
+async def create_pool() -> asyncpg.Pool:
+    global _pool, _pool_loop
+    _pool = await asyncpg.create_pool(**connection_kwargs(), **pool_settings())
+    _pool_loop = asyncio.get_running_loop()
+    return _pool
+
+async def close_pool():
+    global _pool, _pool_loop
+    if _pool is None: return
+    await _pool.close()
+    _pool = _pool_loop = None
+
+async def get_pool() -> asyncpg.Pool:
+    #? pools are bound to the loop that created them, recreate if used outside the app lifespan (tests, scripts)
+    if _pool is None or _pool_loop is not asyncio.get_running_loop():
+        if _pool is not None:
+            #? the old loop may already be closed so the pool cannot be awaited, terminate drops its sockets directly
+            _pool.terminate()
+        return await create_pool()
+    return _pool
+
+@asynccontextmanager
+async def acquire_connection():
+    pool = await get_pool()
+    start = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=acquire_timeout())
+    except asyncio.TimeoutError:
+        pool_metrics["timeouts"] += 1
+        raise
+    wait_secs = time.perf_counter() - start
+    pool_metrics["acquired"] += 1
+    pool_metrics["wait_secs_total"] += wait_secs
+    pool_metrics["wait_secs_max"] = max(pool_metrics["wait_secs_max"], wait_secs)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+async def get_connection():
+    """FastAPI dependency yielding a pooled connection for the lifetime of the request."""
+    async with acquire_connection() as conn:
+        yield conn
+
+def get_pool_stats() -> dict:
+    acquired = pool_metrics["acquired"]
+    stats = {
+        "acquired": acquired,
+        "timeouts": pool_metrics["timeouts"],
+        "wait_ms_avg": 1000 * pool_metrics["wait_secs_total"] / acquired if acquired else 0.0,
+        "wait_ms_max": 1000 * pool_metrics["wait_secs_max"],
+    }
+    if _pool is None:
+        return stats | {"size": 0, "idle": 0, "in_use": 0, "max_size": 0, "saturation": 0.0}
+
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    max_size = _pool.get_max_size()
+    return stats | {
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+        "max_size": max_size,
+        "saturation": (size - idle) / max_size,
+    }
+
+def redis_settings() -> dict:
+    return {
+        "max_connections": int(os.getenv("REDIS_MAX_CONNECTIONS", 50)),
+        "timeout": float(os.getenv("REDIS_POOL_TIMEOUT", 5)),
+        "health_check_interval": int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30)),
+    }
+
+async def create_redis_pool() -> aioredis.ConnectionPool:
+    global _redis_pool, _redis_pool_loop
+    redis_url = f"redis://{os.environ['REDIS_HOST']}:{os.environ['REDIS_PORT']}"
+    _redis_pool = aioredis.BlockingConnectionPool.from_url(
+        redis_url,
+        encoding='utf-8',
+        decode_responses=True,
+        **redis_settings()
+    )
+    _redis_pool_loop = asyncio.get_running_loop()
+    return _redis_pool
+
+async def close_redis_pool():
+    global _redis_pool, _redis_pool_loop
+    if _redis_pool is None: return
+    await _redis_pool.disconnect()
+    _redis_pool = _redis_pool_loop = None
+
+async def get_redis_pool() -> aioredis.ConnectionPool:
+    if _redis_pool is None or _redis_pool_loop is not asyncio.get_running_loop():
+        if _redis_pool is not None:
+            #? like get_pool, the old loop may be closed, its sockets are closed as far as they can be and then dropped
+            try:
+                await _redis_pool.disconnect()
+            except Exception as e:
+                print(f"previous redis pool not closed cleanly: {e}")
+        return await create_redis_pool()
+    return _redis_pool
+
 async def redis_connection():
     try:
-        redis_url = f"redis://{os.environ['REDIS_HOST']}:{os.environ['REDIS_PORT']}"
-        return await aioredis.from_url(
-            redis_url,
-            encoding='utf-8',
-            decode_responses=True
-        )
+        return aioredis.Redis(connection_pool=await get_redis_pool())
     except Exception as e:
         print(e)
         import traceback
@@ -38,8 +162,12 @@ async def redis_connection():
         traceback.print_exc()
         return None
 
+async def get_redis():
+    """FastAPI dependency returning a client backed by the worker's shared redis pool."""
+    return await redis_connection()
+
 if __name__ == "__main__":
     async def test_func():
         assert await setup_connection() != None
 
-    asyncio.run(test_func())
\ No newline at end of file
+    asyncio.run(test_func())
@@ -0,0 +1,38 @@
+import numpy as np
+
+#? chart series are cut down to max_points before they are turned into json
+#? largest triangle three buckets keeps the first and last point and the most prominent point of each bucket between,
+#? so peaks survive where plain striding would drop them
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int | None) -> np.ndarray:
+    """Indices of the points to keep, in order. Every point is kept when the series already fits."""
+    num_points = len(x)
+    if max_points is None or num_points <= max_points:
+        return np.arange(num_points)
+    if max_points < 3:
+        return np.array([0, num_points - 1][:max_points], dtype=np.int64)
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    #? max_points - 2 buckets over every point but the first and last, the last point is the final bucket's neighbour
+    edges = np.linspace(1, num_points - 1, max_points - 1).astype(np.int64)
+    edges = np.append(edges, num_points)
+
+    indices = np.empty(max_points, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = num_points - 1
+    selected = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2]
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        areas = np.abs(
+            (x[selected] - next_x) * (y[start:end] - y[selected])
+            - (x[selected] - x[start:end]) * (next_y - y[selected])
+        )
+        selected = start + int(np.argmax(areas))
+        indices[i + 1] = selected
+
+    return indices
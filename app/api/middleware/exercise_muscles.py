@@ -0,0 +1,93 @@
+import os
+import time
+
+#? per process copy of exercise_muscle_data, reloaded when update_exercises/update_muscles bump the version
+
+version_key = "exercise_muscles:version"
+notify_channel = "exercise_muscles_changed"
+
+_index = {
+    "version": None,
+    "checked_at": 0.0,
+    "stale": True,
+    "exercises": {},
+}
+_listener_conn = None
+
+def version_check_secs() -> float:
+    return float(os.getenv("MUSCLE_INDEX_CHECK_SECS", 30))
+
+async def load_muscle_index(conn, version=None) -> dict:
+    rows = await conn.fetch(
+        """
+        select exercise_id, group_id, group_name, target_id, target_name, ratio
+        from exercise_muscle_data
+        """
+    )
+
+    exercises = {}
+    for row in rows:
+        exercise = exercises.setdefault(str(row["exercise_id"]), {"group": {}, "target": []})
+        exercise["target"].append({
+            "target_id": row["target_id"],
+            "target_name": row["target_name"],
+            "group_id": row["group_id"],
+            "group_name": row["group_name"],
+            "ratio": row["ratio"],
+        })
+        #? a group is weighted by its highest target ratio
+        group = exercise["group"].get(row["group_id"])
+        if group is None or group["ratio"] < row["ratio"]:
+            exercise["group"][row["group_id"]] = {
+                "group_id": row["group_id"],
+                "group_name": row["group_name"],
+                "ratio": row["ratio"],
+            }
+
+    for exercise in exercises.values():
+        exercise["group"] = list(exercise["group"].values())
+
+    _index["exercises"] = exercises
+    _index["version"] = version
+    _index["checked_at"] = time.monotonic()
+    _index["stale"] = False
+    return exercises
+
+async def get_muscle_index(conn, r) -> dict:
+    """Returns exercise_id -> {"group": [...], "target": [...]}, reloading if the version moved."""
+    now = time.monotonic()
+    if not _index["stale"] and now - _index["checked_at"] < version_check_secs():
+        return _index["exercises"]
+
+    version = await r.get(version_key)
+    if _index["stale"] or version != _index["version"]:
+        return await load_muscle_index(conn, version)
+
+    _index["checked_at"] = now
+    return _index["exercises"]
+
+def exercise_muscles(index: dict, exercise_id) -> dict:
+    return index.get(str(exercise_id), {"group": [], "target": []})
+
+def invalidate_muscle_index(*_):
+    _index["stale"] = True
+
+async def bump_muscle_index_version(conn, r):
+    version = await r.incr(version_key)
+    await conn.execute(
+        """
+        select pg_notify($1, $2)
+        """, notify_channel, str(version)
+    )
+
+async def start_muscle_index_listener(conn):
+    global _listener_conn
+    _listener_conn = conn
+    await conn.add_listener(notify_channel, invalidate_muscle_index)
+
+async def stop_muscle_index_listener():
+    global _listener_conn
+    if _listener_conn is None: return
+    await _listener_conn.remove_listener(notify_channel, invalidate_muscle_index)
+    await _listener_conn.close()
+    _listener_conn = None
@@ -0,0 +1,75 @@
+from app.api.middleware.misc import *
+from app.api.middleware.usernames import fetch_usernames
+
+#? each friendship is one friends row stored as (least id, greatest id), see sql/friends_canonical.sql
+#? reads go through user:<id>:friends, membership is one SISMEMBER and the friend list one SMEMBERS
+#? the set caches a user's friend ids like the other user sets (see store_user_set): loaded from postgres on a miss
+#? (flush, eviction, new deploy) and deleted after commit on accept, unfriend and block
+
+def friends_key(user_id) -> str:
+    return user_set_key(user_id, "friends")
+
+async def insert_friendship(conn, user1_id, user2_id):
+    await conn.execute(
+        """
+        insert into friends
+        (user1_id, user2_id)
+        values
+        (least($1::uuid, $2::uuid), greatest($1::uuid, $2::uuid))
+        on conflict do nothing
+        """, user1_id, user2_id
+    )
+
+async def delete_friendship(conn, user1_id, user2_id):
+    await conn.execute(
+        """
+        delete
+        from friends
+        where user1_id = least($1::uuid, $2::uuid)
+        and user2_id = greatest($1::uuid, $2::uuid)
+        """, user1_id, user2_id
+    )
+
+async def invalidate_friend_sets(r, *user_ids):
+    await r.delete(*[friends_key(user_id) for user_id in user_ids])
+
+async def load_friend_ids(conn, r, user_id) -> set[str]:
+    rows = await conn.fetch(
+        """
+        select user2_id friend_id
+        from friends
+        where user1_id = $1
+        union all
+        select user1_id friend_id
+        from friends
+        where user2_id = $1
+        """, user_id
+    )
+    friend_ids = {str(row["friend_id"]) for row in rows}
+    await store_user_set(r, user_id, "friends", friend_ids)
+    return friend_ids
+
+async def fetch_friend_ids(conn, r, user_id) -> set[str]:
+    friend_ids = await r.smembers(friends_key(user_id))
+    if len(friend_ids) == 0:
+        return await load_friend_ids(conn, r, user_id)
+    return friend_ids - {user_set_marker}
+
+async def friendship_exists(conn, r, user1_id, user2_id) -> bool:
+    """One SISMEMBER against user1's friend set, which is loaded from postgres first on a miss."""
+    pipe = r.pipeline(transaction=False)
+    pipe.sismember(friends_key(user1_id), str(user2_id))
+    pipe.exists(friends_key(user1_id))
+    is_member, loaded = await pipe.execute()
+    if loaded: return bool(is_member)
+    return str(user2_id) in await load_friend_ids(conn, r, user1_id)
+
+async def fetch_friends(conn, r, user_id) -> list[dict]:
+    """Friend ids from the friend set and their usernames from user:names, in username order."""
+    usernames = await fetch_usernames(conn, r, await fetch_friend_ids(conn, r, user_id))
+    friends = [
+        {"user_id": friend_id, "username": username}
+        for friend_id, username in usernames.items()
+        if username is not None
+    ]
+    return sorted(friends, key=lambda friend: friend["username"])
@@ -1,6 +1,7 @@
 import random
-from datetime import datetime, timezone
+from datetime import datetime, timezone, date
 from typing import Literal, get_args
+from uuid import UUID
 from pydantic import Field
 from dotenv import load_dotenv
 import os
@@ -28,6 +29,22 @@ def datetime_to_timestamp_ms(dt):
 def date_to_timestamp_ms(date):
     return int(datetime.combine(date, datetime.min.time()).timestamp() * 1000)
 
+#? keyset cursors are "<started_at ms>,<id>" of the last row on the previous page
+def parse_cursor(before: str | None) -> tuple:
+    if before is None: return None, None
+    try:
+        started_at_ms, row_id = before.split(",")
+        return datetime.fromtimestamp(int(started_at_ms) / 1000, tz=timezone.utc), str(UUID(row_id))
+    except ValueError:
+        raise SafeError("invalid cursor")
+
+def next_cursor(rows, limit, id_column="id") -> str | None:
+    if limit is None or len(rows) < limit: return None
+    return row_cursor(rows[-1], id_column)
+
+def row_cursor(row, id_column="id") -> str:
+    return f"{datetime_to_timestamp_ms(row['started_at'])},{row[id_column]}"
+
 email_field = Field(pattern=r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
 password_field = Field(min_length=8, max_length=36)
 name_field = Field(min_length=0, max_length=255)
@@ -84,8 +101,84 @@ overall_column_map = {
     "duration": "duration_mins",
 }
 
-def overall_zset_name(metric):
-    return f"overall:{metric}:leaderboard"
+def overall_zset_name(metric, cohort=None):
+    if cohort is None: return f"overall:{metric}:leaderboard"
+    return f"overall:{metric}:{cohort}:leaderboard"
+
+#? bucket ends have no overlap, 18-22 holds 18 <= age < 22
+cohort_buckets = {
+    "age": [18, 22, 26, 30, 34, 38, 42, 46, 50],
+    "weight": list(range(40, 151, 10)),
+    "height": list(range(120, 221, 5)),
+    "bodyfat": list(range(5, 41, 5)),
+}
+cohort_dimensions = [
+    ("gender",),
+    ("age",),
+    ("weight",),
+    ("height",),
+    ("bodyfat",),
+    ("gender", "age"),
+    ("gender", "weight"),
+    ("gender", "height"),
+    ("gender", "bodyfat"),
+]
+#? user_id -> comma joined cohorts the user was last added to, so a move can remove the old memberships
+cohorts_key = "leaderboard:cohorts"
+
+def bucket_label(value, bounds):
+    if value < bounds[0]: return f"0-{bounds[0]}"
+    for lower, upper in zip(bounds, bounds[1:]):
+        if value < upper: return f"{lower}-{upper}"
+    return f"{bounds[-1]}+"
+
+def cohort_labels(key) -> list[str]:
+    if key == "gender": return list(get_args(gender_literal))
+    bounds = cohort_buckets[key]
+    return [f"0-{bounds[0]}"] + [f"{lower}-{upper}" for lower, upper in zip(bounds, bounds[1:])] + [f"{bounds[-1]}+"]
+
+def cohort_name(labels: dict) -> str:
+    return ":".join(f"{key}:{label}" for key, label in labels.items())
+
+def user_cohorts(user_data: dict) -> list[str]:
+    labels = {"gender": user_data["gender"]}
+    for key, bounds in cohort_buckets.items():
+        if user_data.get(key) is None: continue
+        labels[key] = bucket_label(user_data[key], bounds)
+
+    return [
+        cohort_name({key: labels[key] for key in dimension})
+        for dimension in cohort_dimensions
+        if all(key in labels for key in dimension)
+    ]
+
+#? latest body stats for every user in $1, the columns user_cohorts buckets on
+cohort_users_query = """
+    select u.id user_id, u.gender, u.date_of_birth,
+        (select weight from user_weights where user_id = u.id order by created_at desc limit 1) weight,
+        (select height from user_heights where user_id = u.id order by created_at desc limit 1) height,
+        (select bodyfat from user_bodyfats where user_id = u.id order by created_at desc limit 1) bodyfat
+    from users u
+    where u.id = any($1::uuid[])
+"""
+
+def cohort_user_data(row) -> dict:
+    return {
+        "gender": row["gender"],
+        "age": (date.today() - row["date_of_birth"]).days / 365.2425,
+        "weight": row["weight"],
+        "height": row["height"],
+        "bodyfat": row["bodyfat"],
+    }
+
+def all_cohorts() -> list[str]:
+    cohorts = []
+    for dimension in cohort_dimensions:
+        combinations = [{}]
+        for key in dimension:
+            combinations = [labels | {key: label} for labels in combinations for label in cohort_labels(key)]
+        cohorts += [cohort_name(labels) for labels in combinations]
+    return cohorts
 
 exercise_leaderboard_literal = Literal["volume", "sets", "reps", "workouts"]
 exercise_leaderboard_metrics = list(get_args(exercise_leaderboard_literal))
@@ -99,6 +192,34 @@ exercise_column_map = {
 def exercise_zset_name(exercise_id, metric):
     return f"exercise:{exercise_id}:{metric}:leaderboard"
 
+#? username autocomplete, every member has score 0 so ZRANGEBYLEX walks them in username order
+user_search_key = "user:search"
+searchable_users_key = "user:searchable"
+
+def user_search_member(user_id, username) -> str:
+    #? "<lower username>\x00<username>\x00<id>", \x00 sorts before any username character so "ab" lists before "abc"
+    return f"{username.lower()}\x00{username}\x00{user_id}"
+
+def user_set_key(user_id, name) -> str:
+    """Per user id sets kept for search, name is one of user_set_names."""
+    return f"user:{user_id}:{name}"
+
+user_set_names = ["blocked", "friends", "requested", "inbound"]
+
+#? user sets are a cache: loaded from postgres on a miss, deleted after every change, expired after USER_SET_TTL_SECS
+#? so a load that raced a delete cannot stay wrong for long
+#? a loaded set always holds the marker, so an empty relation is still a hit and a missing key never reads as empty
+user_set_marker = "-"
+
+def user_set_ttl_secs() -> int:
+    return int(os.getenv("USER_SET_TTL_SECS", 60 * 60))
+
+async def store_user_set(r, user_id, name, member_ids: set[str]):
+    pipe = r.pipeline(transaction=True)
+    pipe.sadd(user_set_key(user_id, name), user_set_marker, *member_ids)
+    pipe.expire(user_set_key(user_id, name), user_set_ttl_secs())
+    await pipe.execute()
+
 
 
 class SafeError(Exception):
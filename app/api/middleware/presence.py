@@ -0,0 +1,51 @@
+import os
+import time
+
+from app.api.middleware.misc import *
+from app.api.middleware.friend_graph import friends_key, load_friend_ids
+
+#? presence:online scores each user id with their last heartbeat, anyone quiet for PRESENCE_TTL_SECS is offline
+#? heartbeats also trim expired members, so the zset stays the size of the online population
+#? friends online is ZINTER of the cached friend set (weight 0) and presence:online, the scores left are heartbeats,
+#? the friend set's marker member is never in presence:online
+
+presence_key = "presence:online"
+
+def presence_ttl_secs() -> float:
+    return float(os.getenv("PRESENCE_TTL_SECS", 90))
+
+async def mark_online(r, user_id) -> tuple[bool, list[str]]:
+    """Records a heartbeat. Returns whether the user was not already online, and the ids that expired since the last trim."""
+    now = time.time()
+    cutoff = now - presence_ttl_secs()
+    pipe = r.pipeline(transaction=True)
+    pipe.zrangebyscore(presence_key, "-inf", cutoff)
+    pipe.zremrangebyscore(presence_key, "-inf", cutoff)
+    pipe.zadd(presence_key, {str(user_id): now})
+    expired_ids, _, num_added = await pipe.execute()
+    return num_added == 1, [expired_id for expired_id in expired_ids if expired_id != str(user_id)]
+
+async def mark_offline(r, user_id) -> bool:
+    """True when the user was online."""
+    return await r.zrem(presence_key, str(user_id)) == 1
+
+async def fetch_online_friends(conn, r, user_id) -> tuple[int, list[str]]:
+    """Number of friends and the ids of those online, most recent heartbeat first, in one round trip unless the friend set is loaded."""
+    pipe = r.pipeline(transaction=False)
+    pipe.scard(friends_key(user_id))
+    pipe.zinter({friends_key(user_id): 0, presence_key: 1}, aggregate="SUM", withscores=True)
+    num_members, online = await pipe.execute()
+    if num_members == 0:
+        num_friends = len(await load_friend_ids(conn, r, user_id))
+        if num_friends > 0:
+            online = await r.zinter({friends_key(user_id): 0, presence_key: 1}, aggregate="SUM", withscores=True)
+    else:
+        num_friends = num_members - 1
+
+    cutoff = time.time() - presence_ttl_secs()
+    online = sorted(
+        [(friend_id, last_seen) for friend_id, last_seen in online if last_seen > cutoff],
+        key=lambda item: item[1],
+        reverse=True
+    )
+    return num_friends, [friend_id for friend_id, _ in online]
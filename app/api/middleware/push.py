@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+from app.api.middleware.misc import *
+from app.api.middleware.friend_graph import fetch_friend_ids
+
+#? events for a user are published on push:user:<id>, every api worker pattern subscribes to push:user:*
+#? and forwards each message to the sockets it holds for that user, the rest are dropped
+#? publishers (routes, the workout worker) never need to know which worker a user is connected to
+
+channel_prefix = "push:user:"
+
+_sockets = {}
+_pubsub = None
+_listener_task = None
+
+def push_channel(user_id) -> str:
+    return f"{channel_prefix}{user_id}"
+
+async def publish_events(r, events: list[tuple]):
+    """Publishes (user_id, event) pairs in one pipeline."""
+    if len(events) == 0: return
+    pipe = r.pipeline(transaction=False)
+    for user_id, event in events:
+        pipe.publish(push_channel(user_id), json.dumps(event))
+    await pipe.execute()
+
+async def publish_event(r, user_id, event: dict):
+    await publish_events(r, [(user_id, event)])
+
+async def publish_to_friends(conn, r, user_id, event: dict):
+    friend_ids = await fetch_friend_ids(conn, r, user_id)
+    await publish_events(r, [(friend_id, event) for friend_id in friend_ids])
+
+def add_socket(user_id, websocket):
+    _sockets.setdefault(str(user_id), set()).add(websocket)
+
+def remove_socket(user_id, websocket):
+    sockets = _sockets.get(str(user_id))
+    if sockets is None: return
+    sockets.discard(websocket)
+    if len(sockets) == 0:
+        del _sockets[str(user_id)]
+
+async def forward_events():
+    while True:
+        try:
+            async for message in _pubsub.listen():
+                if message["type"] != "pmessage": continue
+                user_id = message["channel"][len(channel_prefix):]
+                for websocket in list(_sockets.get(user_id, [])):
+                    try:
+                        await websocket.send_text(message["data"])
+                    except Exception:
+                        remove_socket(user_id, websocket)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            #? redis went away, listen() resubscribes once it can reconnect
+            print(f"push listener: {e}")
+            await asyncio.sleep(1)
+
+async def start_push_listener(r):
+    global _pubsub, _listener_task
+    _pubsub = r.pubsub()
+    await _pubsub.psubscribe(f"{channel_prefix}*")
+    _listener_task = asyncio.create_task(forward_events())
+
+async def stop_push_listener():
+    global _pubsub, _listener_task
+    if _listener_task is None: return
+    _listener_task.cancel()
+    try:
+        await _listener_task
+    except asyncio.CancelledError:
+        pass
+    await _pubsub.aclose()
+    _pubsub = None
+    _listener_task = None
@@ -0,0 +1,96 @@
+import os
+import inspect
+import orjson
+from fastapi.responses import StreamingResponse
+
+from app.api.middleware.database import acquire_connection
+from app.api.middleware.misc import row_cursor
+
+#? large payloads are encoded piece by piece so a request never holds the whole body in memory
+#? dicts are walked key by key, (async) iterators become arrays written one element at a time,
+#? zero-arg callables are evaluated when their key is reached, anything else goes straight to orjson
+
+def stream_chunk_bytes() -> int:
+    return int(os.getenv("STREAM_CHUNK_BYTES", 64 * 1024))
+
+def stream_json(value) -> StreamingResponse:
+    return StreamingResponse(buffered_chunks(json_chunks(value)), media_type="application/json")
+
+async def buffered_chunks(chunks):
+    chunk_bytes = stream_chunk_bytes()
+    buffer = bytearray()
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            if len(buffer) < chunk_bytes: continue
+            yield bytes(buffer)
+            buffer.clear()
+        if len(buffer) > 0:
+            yield bytes(buffer)
+    except Exception as e:
+        #? headers are already sent, the client sees a truncated body
+        print(str(e))
+        raise e
+
+async def json_chunks(value):
+    if callable(value):
+        value = value()
+        if inspect.isawaitable(value):
+            value = await value
+
+    if isinstance(value, dict):
+        yield b"{"
+        for i, (key, item) in enumerate(value.items()):
+            if i > 0: yield b","
+            yield orjson.dumps(str(key)) + b":"
+            async for chunk in json_chunks(item):
+                yield chunk
+        yield b"}"
+    elif hasattr(value, "__aiter__") or inspect.isgenerator(value):
+        yield b"["
+        first = True
+        async for item in aiterate(value):
+            if not first: yield b","
+            first = False
+            yield orjson.dumps(item, option=orjson.OPT_NON_STR_KEYS)
+        yield b"]"
+    else:
+        yield orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+async def aiterate(items):
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+async def cursor_rows(query, *args, prefetch=None):
+    """Rows of a server side cursor on a connection of its own.
+
+    Request connections are released before a streamed body is sent, so a cursor read while streaming needs its own.
+    """
+    async with acquire_connection() as conn:
+        async with conn.transaction():
+            async for row in conn.cursor(query, *args, prefetch=prefetch or stream_cursor_prefetch()):
+                yield row
+
+def stream_cursor_prefetch() -> int:
+    return int(os.getenv("STREAM_CURSOR_PREFETCH", 500))
+
+class StreamedPage:
+    """Counts rows as they are streamed so the next cursor can be written after them."""
+
+    def __init__(self, limit, id_column="id"):
+        self.limit = limit
+        self.id_column = id_column
+        self.num_rows = 0
+        self.last_row = None
+
+    def track(self, row):
+        self.num_rows += 1
+        self.last_row = row
+
+    def next_cursor(self) -> str | None:
+        if self.limit is None or self.num_rows < self.limit: return None
+        return row_cursor(self.last_row, self.id_column)
@@ -0,0 +1,129 @@
+from redis.exceptions import RedisError
+
+from app.api.middleware.misc import *
+from app.api.middleware.database import acquire_connection
+from app.api.middleware.friend_graph import *
+
+#? /users/search is answered from redis, postgres stays the source of truth
+#? user:search holds every username and user:searchable the ids whose searchable permission is public, both written
+#? after the postgres commit like cache_username and rebuilt by sync_redis
+#? user:<id>:blocked|requested|inbound|friends are the searcher's own relations, cached by store_user_set: a missing
+#? set is loaded from postgres before filtering, never read as empty, so a lost write cannot unhide a blocked user
+
+async def index_username(r, user_id, username):
+    await r.zadd(user_search_key, {user_search_member(user_id, username): 0})
+
+async def cache_searchable(r, user_id, permission_value):
+    if permission_value == "public":
+        await r.sadd(searchable_users_key, str(user_id))
+    else:
+        await r.srem(searchable_users_key, str(user_id))
+
+async def after_commit(*writes):
+    """Awaits redis writes that follow a postgres commit. The change is already stored, so a redis failure is logged
+    instead of raised, a missing set reloads on its next read and a lost push event is not replayed."""
+    for write in writes:
+        try:
+            await write
+        except RedisError as e:
+            print(f"redis write after commit failed: {e}")
+
+#? sets are deleted rather than edited, an sadd on an evicted key would leave a partial set that looks loaded
+
+async def invalidate_blocked(r, victim_id):
+    await r.delete(user_set_key(victim_id, "blocked"))
+
+async def invalidate_requests(r, requestor_id, target_id):
+    await r.delete(user_set_key(requestor_id, "requested"), user_set_key(target_id, "inbound"))
+
+async def invalidate_unfriend(r, user1_id, user2_id):
+    """Mirrors unfriend_user, which drops the friendship and requests both ways."""
+    await r.delete(*[
+        user_set_key(user_id, name)
+        for user_id in [user1_id, user2_id]
+        for name in ["friends", "requested", "inbound"]
+    ])
+
+relation_queries = {
+    "blocked": """
+        select blocked_id member_id
+        from blocked_users
+        where victim_id = $1
+    """,
+    "requested": """
+        select target_id member_id
+        from friend_requests
+        where requestor_id = $1
+    """,
+    "inbound": """
+        select requestor_id member_id
+        from friend_requests
+        where target_id = $1
+    """,
+}
+
+async def load_relation_ids(conn, r, user_id, name) -> set[str]:
+    if name == "friends":
+        return await load_friend_ids(conn, r, user_id)
+    member_ids = {str(row["member_id"]) for row in await conn.fetch(relation_queries[name], user_id)}
+    await store_user_set(r, user_id, name, member_ids)
+    return member_ids
+
+def prefix_lex_range(username: str) -> tuple[bytes, bytes]:
+    prefix = username.strip().lower().encode("utf-8")
+    #? 0xff never appears in utf-8 so it bounds every member starting with the prefix
+    return b"[" + prefix, b"[" + prefix + b"\xff"
+
+async def search_users(r, user_id, username, limit=50) -> list[dict]:
+    """Matches in username order, skipping the searcher, friends, blocked and private users.
+
+    Members are read in batches until limit matches are found, so heavily filtered prefixes cost extra round trips.
+    """
+    user_id = str(user_id)
+    lex_min, lex_max = prefix_lex_range(username)
+    batch_size = limit * 2
+
+    pipe = r.pipeline(transaction=False)
+    for name in user_set_names:
+        pipe.smembers(user_set_key(user_id, name))
+    pipe.zrangebylex(user_search_key, lex_min, lex_max, start=0, num=batch_size)
+    *relation_sets, members = await pipe.execute()
+    relations = {name: members - {user_set_marker} for name, members in zip(user_set_names, relation_sets)}
+    missing = [name for name, members in zip(user_set_names, relation_sets) if len(members) == 0]
+    if len(missing) > 0:
+        #? only a cache miss touches postgres
+        async with acquire_connection() as conn:
+            for name in missing:
+                relations[name] = await load_relation_ids(conn, r, user_id, name)
+
+    matches = []
+    offset = 0
+    while True:
+        offset += len(members)
+        candidates = []
+        for member in members:
+            _, candidate_username, candidate_id = member.split("\x00")
+            if candidate_id == user_id: continue
+            if candidate_id in relations["blocked"] or candidate_id in relations["friends"]: continue
+            candidates.append((candidate_id, candidate_username))
+
+        searchable = await r.smismember(searchable_users_key, [candidate_id for candidate_id, _ in candidates]) if len(candidates) > 0 else []
+        for (candidate_id, candidate_username), is_searchable in zip(candidates, searchable):
+            if not is_searchable: continue
+            #? requests both ways only exist when two sends raced, accepting the inbound one settles it
+            if candidate_id in relations["inbound"]:
+                relation = "inbound"
+            elif candidate_id in relations["requested"]:
+                relation = "requested"
+            else:
+                relation = "none"
+
+            matches.append({
+                "id": candidate_id,
+                "username": candidate_username,
+                "relation": relation
+            })
+            if len(matches) == limit: return matches
+
+        if len(members) < batch_size: return matches
+        members = await r.zrangebylex(user_search_key, lex_min, lex_max, start=offset, num=batch_size)
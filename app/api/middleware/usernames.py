@@ -0,0 +1,28 @@
+#? user_id -> username, written on register and backfilled from postgres on a miss
+
+usernames_key = "user:names"
+
+async def cache_username(r, user_id, username):
+    await r.hset(usernames_key, str(user_id), username)
+
+async def fetch_usernames(conn, r, user_ids) -> dict:
+    """One HMGET for every id, plus at most one query for ids the hash has not seen."""
+    user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+    if len(user_ids) == 0: return {}
+
+    usernames = dict(zip(user_ids, await r.hmget(usernames_key, user_ids)))
+    missing_ids = [user_id for user_id, username in usernames.items() if username is None]
+    if len(missing_ids) == 0: return usernames
+
+    rows = await conn.fetch(
+        """
+        select id, username
+        from users
+        where id = any($1::uuid[])
+        """, missing_ids
+    )
+    found = {str(row["id"]): row["username"] for row in rows}
+    if len(found) > 0:
+        await r.hset(usernames_key, mapping=found)
+
+    return usernames | found
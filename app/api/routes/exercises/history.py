@@ -1,11 +1,15 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from fastapi.responses import JSONResponse
 from datetime import datetime, timezone
 from fastapi.security import HTTPBearer
 from copy import deepcopy
-import math
+from functools import lru_cache
+from typing import Optional
+import numpy as np
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
+from app.api.middleware.streaming import stream_json, cursor_rows, StreamedPage
+from app.api.middleware.downsample import lttb_indices
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import *
@@ -13,52 +17,83 @@ from app.api.middleware.misc import *
 router = APIRouter()
 security = HTTPBearer()
 
+#? pages are whole workouts, every graph covers the workouts on the page
+#? max_points caps the per set and per rep series, each is downsampled before it is built into points
+#? n rep maxes come from user_rep_maxes and always cover the whole history, not just the page
+#? history is streamed workout by workout straight off the cursor, each workout is added to the running aggregates
+#? as it passes and the rows are dropped, the aggregate graphs follow once every row has been read
 @router.get("/history")
-async def exercise_history(exercise_id: str, credentials: dict = Depends(verify_token)):
+async def exercise_history(
+    exercise_id: str,
+    before: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    max_points: int = Query(default=500, ge=2),
+    credentials: dict = Depends(verify_token),
+    conn = Depends(get_connection)
+):
     try:
-        conn = await setup_connection()
-
-        rows = await conn.fetch(
-            """
-            select w.id workout_id, wsd.reps, wsd.weight, wsd.num_sets, wsd.order_index set_order_index, w.started_at
-            from workout_set_data wsd
-            inner join workout_exercises we
-            on wsd.workout_exercise_id = we.id
-            inner join workouts w
-            on we.workout_id = w.id
-            where w.user_id = $1
-            and we.exercise_id = $2
-            order by w.started_at desc, we.order_index, wsd.order_index
-            """, credentials["user_id"], exercise_id 
-        )
-
-        n_rep_max_all_time = build_n_rep_max_all_time(rows)
-        n_rep_max_history = build_n_rep_max_history(rows)
-        volume_workout = build_volume_workout(rows)
-        volume_timespan = build_volume_timespan(rows)
-        history = build_history(rows)
-        reps_sets_weight = build_reps_sets_weight(rows)
+        before_started_at, before_id = parse_cursor(before)
+        rep_max_rows, rep_max_day_rows = await fetch_rep_maxes(conn, credentials["user_id"], exercise_id)
+        aggregates = HistoryAggregates()
+        page = StreamedPage(limit, "workout_id")
+
+        async def history():
+            workout_rows = []
+            async for row in cursor_rows(
+                """
+                with page as (
+                    select distinct w.id, w.started_at
+                    from workouts w
+                    inner join workout_exercises we
+                    on we.workout_id = w.id
+                    where w.user_id = $1
+                    and we.exercise_id = $2
+                    and ($3::timestamptz is null or (w.started_at, w.id) < ($3, $4::uuid))
+                    order by w.started_at desc, w.id desc
+                    limit $5
+                )
+                select w.id workout_id, wsd.reps, wsd.weight, wsd.num_sets, wsd.order_index set_order_index, w.started_at
+                from page w
+                inner join workout_exercises we
+                on we.workout_id = w.id
+                inner join workout_set_data wsd
+                on wsd.workout_exercise_id = we.id
+                where we.exercise_id = $2
+                order by w.started_at desc, w.id desc, we.order_index, wsd.order_index
+                """, credentials["user_id"], exercise_id, before_started_at, before_id, limit
+            ):
+                if len(workout_rows) > 0 and workout_rows[-1]["workout_id"] != row["workout_id"]:
+                    page.track(workout_rows[-1])
+                    aggregates.add_workout(workout_rows)
+                    yield build_history_item(workout_rows, max_points)
+                    workout_rows = []
+                workout_rows.append(row)
+
+            if len(workout_rows) > 0:
+                page.track(workout_rows[-1])
+                aggregates.add_workout(workout_rows)
+                yield build_history_item(workout_rows, max_points)
+
+        #? the callables below run once history has been streamed, by then every workout has been added
+        return stream_json({
+            "history": history(),
+            "reps_sets_weight": lambda: reps_sets_weight_points(aggregates, max_points),
+            "n_rep_max": {
+                "all_time": build_n_rep_max_all_time(rep_max_rows),
+                "history": build_n_rep_max_history(rep_max_day_rows)
+            },
+            "volume": lambda: {
+                "workout": build_volume_workout(aggregates),
+                "timespan": build_volume_timespan(aggregates)
+            },
+            "next": page.next_cursor
+        })
 
     except SafeError as e:
         raise e
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
-
-    return {
-        "n_rep_max": {
-            "all_time": n_rep_max_all_time,
-            "history": n_rep_max_history
-        },
-        "volume": {
-            "workout": volume_workout,
-            "timespan": volume_timespan
-        },
-        "history": history,
-        "reps_sets_weight": reps_sets_weight
-    }
 
 emptyBaseData = {
     "graph": [],
@@ -68,108 +103,134 @@ emptyBaseData = {
     }
 }
 
-def build_n_rep_max_all_time(rows):
-    n_rep_max_all_time_data = {}
-    for row in rows:
-        curr_max = n_rep_max_all_time_data.get(row["reps"], {"weight": -math.inf})["weight"]
-        if row["weight"] <= curr_max: continue
-        n_rep_max_all_time_data[row["reps"]] = {
-            "weight": row["weight"],
-            "timestamp": datetime_to_timestamp_ms(row["started_at"])
-        }
-
-    n_rep_max_all_time_data = dict(sorted(n_rep_max_all_time_data.items()))
+#####################################################
+### Aggregates
+
+#? rows arrive ordered by started_at desc, so workout order is already newest first
+#? only what the aggregate graphs need is kept: one volume per workout and one run per set row (reps of a single weight),
+#? the graphs are built from them with vectorised ops
+
+class HistoryAggregates:
+    """Running per page totals, filled in workout by workout as the rows stream past."""
+
+    def __init__(self):
+        self.workout_timestamps = []
+        self.workout_volumes = []
+        self.run_reps = []
+        self.run_weights = []
+        self.run_sets = []
+
+    def add_workout(self, workout_rows):
+        self.workout_timestamps.append(datetime_to_timestamp_ms(workout_rows[0]["started_at"]))
+        self.workout_volumes.append(sum(row["reps"] * row["weight"] * row["num_sets"] for row in workout_rows))
+        for row in workout_rows:
+            self.run_reps.append(row["reps"])
+            self.run_weights.append(row["weight"])
+            self.run_sets.append(row["num_sets"])
+
+    def volume_per_workout(self) -> tuple[np.ndarray, np.ndarray]:
+        return np.array(self.workout_timestamps, dtype=np.int64), np.array(self.workout_volumes, dtype=np.float64)
+
+    def runs(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return (
+            np.array(self.run_reps, dtype=np.int64),
+            np.array(self.run_weights, dtype=np.float64),
+            np.array(self.run_sets, dtype=np.int64),
+        )
 
+#####################################################
+### Graphs
+
+async def fetch_rep_maxes(conn, user_id, exercise_id) -> tuple[list, list]:
+    rep_max_rows = await conn.fetch(
+        """
+        select reps, weight, achieved_at
+        from user_rep_maxes
+        where user_id = $1
+        and exercise_id = $2
+        order by reps
+        """, user_id, exercise_id
+    )
+    rep_max_day_rows = await conn.fetch(
+        """
+        select reps, weight, achieved_at
+        from user_rep_max_days
+        where user_id = $1
+        and exercise_id = $2
+        order by reps, day desc
+        """, user_id, exercise_id
+    )
+    return rep_max_rows, rep_max_day_rows
+
+def build_n_rep_max_all_time(rep_max_rows):
     n_rep_max_all_time = deepcopy(emptyBaseData)
     n_rep_max_all_time["table"]["headers"] = ["rep", "weight", "date"]
-    for rep, data in n_rep_max_all_time_data.items():
+    for row in rep_max_rows:
         n_rep_max_all_time["graph"].append({
-            "x": rep,
-            "y": data["weight"]
+            "x": row["reps"],
+            "y": row["weight"]
         })
         n_rep_max_all_time["table"]["rows"].append({
-            "rep": rep,
-            "weight": data["weight"],
-            "date": timestamp_ms_to_date_str(data["timestamp"])
+            "rep": row["reps"],
+            "weight": row["weight"],
+            "date": timestamp_ms_to_date_str(datetime_to_timestamp_ms(row["achieved_at"]))
         })
 
     return n_rep_max_all_time 
 
-def build_n_rep_max_history(rows):
-    n_rep_max_history_data = {}
-    for row in rows:
-        if row["reps"] not in n_rep_max_history_data.keys():
-            n_rep_max_history_data[row["reps"]] = {}
-        timestamp = datetime_to_timestamp_ms(row["started_at"])
-        curr_weight = n_rep_max_history_data[row["reps"]].get(timestamp, -math.inf)
-        if curr_weight >= row["weight"]: continue
-        n_rep_max_history_data[row["reps"]][timestamp] = row["weight"]
-
-    n_rep_max_history_data = dict(sorted(n_rep_max_history_data.items()))
-
+def build_n_rep_max_history(rep_max_day_rows):
+    """One point per day, at the time of that day's best set."""
     n_rep_max_history = {}
-    for rep, data in n_rep_max_history_data.items():
-        temp_history = deepcopy(emptyBaseData)
-        temp_history["table"]["headers"] = ["weight", "date"]
-
-        for timestamp, weight in data.items():
-            temp_history["graph"].append({
-                "x": timestamp,
-                "y": weight
-            })
-            temp_history["table"]["rows"].append({
-                "weight": weight,
-                "date": timestamp
-            })
-
-        temp_history["graph"] = sort_timeseries(temp_history["graph"], "x")
-        temp_history["table"]["rows"] = sort_timeseries(temp_history["table"]["rows"], "date", True)
-
-        n_rep_max_history[rep] = temp_history
+    for row in rep_max_day_rows:
+        if row["reps"] not in n_rep_max_history:
+            n_rep_max_history[row["reps"]] = deepcopy(emptyBaseData)
+            n_rep_max_history[row["reps"]]["table"]["headers"] = ["weight", "date"]
+
+        timestamp = datetime_to_timestamp_ms(row["achieved_at"])
+        n_rep_max_history[row["reps"]]["graph"].append({
+            "x": timestamp,
+            "y": row["weight"]
+        })
+        n_rep_max_history[row["reps"]]["table"]["rows"].append({
+            "weight": row["weight"],
+            "date": timestamp_ms_to_date_str(timestamp)
+        })
 
     return n_rep_max_history
 
-def build_volume_workout(rows):
-    volume_data = volume_per_workout(rows)
+def build_volume_workout(aggregates):
+    timestamps, volumes = aggregates.volume_per_workout()
 
     volume = deepcopy(emptyBaseData)
     volume["table"]["headers"] = ["volume", "date"]
-    for data in volume_data.values():
+    for timestamp, workout_volume in zip(timestamps.tolist(), volumes.tolist()):
         volume["graph"].append({
-            "x": data["timestamp"],
-            "y": data["volume"]
+            "x": timestamp,
+            "y": workout_volume
         })
         volume["table"]["rows"].append({
-            "volume": data["volume"],
-            "date": data["timestamp"]
+            "volume": workout_volume,
+            "date": timestamp_ms_to_date_str(timestamp)
         })
 
-    volume["graph"] = sort_timeseries(volume["graph"], "x")
-    volume["table"]["rows"] = sort_timeseries(volume["table"]["rows"], "date", True)
-
     return volume
 
-def build_volume_timespan(rows):
-    volume_data = volume_per_workout(rows)
+def build_volume_timespan(aggregates):
+    timestamps, volumes = aggregates.volume_per_workout()
 
-    timespan_data = {}    
+    volume_timespan = {}
     now_ms = datetime.now(tz=timezone.utc).timestamp() * 1000
     for timespan in ["week","month","3_months","6_months","year"]:  
         timespan_ms = timespan_to_ms(timespan)
-        bucket_data = {}
-        for workout_data in volume_data.values():
-            bucket = int((now_ms - workout_data["timestamp"]) / timespan_ms)
-            if bucket not in bucket_data:
-                bucket_data[bucket] = 0
-            bucket_data[bucket] += workout_data["volume"]
-        timespan_data[timespan] = dict(sorted(bucket_data.items()))
+        buckets, bucket_index = np.unique(
+            np.trunc((now_ms - timestamps) / timespan_ms).astype(np.int64),
+            return_inverse=True
+        )
+        bucket_volumes = np.bincount(bucket_index, weights=volumes, minlength=len(buckets))
 
-    volume_timespan = {}
-    for timespan, bucket_data in timespan_data.items():
-        timespan_ms = timespan_to_ms(timespan)
         temp_data = deepcopy(emptyBaseData)
         temp_data["table"]["headers"] = ["volume", "dates"]
-        for bucket, volume in bucket_data.items():
+        for bucket, volume in zip(buckets.tolist(), bucket_volumes.tolist()):
             upper_timestamp = now_ms - bucket * timespan_ms
             lower_timestamp = now_ms - (bucket + 1) * timespan_ms
 
@@ -186,17 +247,6 @@ def build_volume_timespan(rows):
 
     return volume_timespan
 
-def volume_per_workout(rows):
-    volume_data = {}
-    for row in rows:
-        if row["workout_id"] not in volume_data:
-            volume_data[row["workout_id"]] = {
-                "volume": 0,
-                "timestamp": datetime_to_timestamp_ms(row["started_at"])
-            }
-        volume_data[row["workout_id"]]["volume"] += row["reps"] * row["weight"] * row["num_sets"]
-    return volume_data
-
 def timespan_to_ms(timespan):
     day_ms = 24 * 60 * 60 * 1000
     week_ms = 7 * day_ms
@@ -219,80 +269,77 @@ def timespan_to_ms(timespan):
         case _:
             raise Exception(f"unknown timespan '{timespan}'")
 
-def build_history(rows):
-    history_data = {}
-    for row in rows:
-        if row["workout_id"] not in history_data:
-            history_data[row["workout_id"]] = {
-                "graph": {
-                    "weight_per_set": [],
-                    "volume_per_set": [],
-                    "weight_per_rep": [],
-                },
-                "table": {
-                    "headers": ["reps", "weight", "sets"],
-                    "rows": []
-                },
-                "started_at": date_to_timestamp_ms(row["started_at"]),
-            }
-
-        graph = history_data[row["workout_id"]]["graph"]
-        prev_set_idx = 0 if len(graph["weight_per_set"]) == 0 else graph["weight_per_set"][-1]["x"]
-        for i in range(row["num_sets"]):
-            graph["weight_per_set"].append({
-                "x": prev_set_idx + i + 1,
-                "y": row["weight"]
-            })
-
-            graph["volume_per_set"].append({
-                "x": prev_set_idx + i + 1,
-                "y": row["reps"] * row["weight"] * row["num_sets"]
-            })
+def build_history_item(workout_rows, max_points=None):
+    """History of one workout, its rows in set order."""
+    #? series are built by list repetition, a workout is too small for numpy to pay off
+    set_weights = []
+    set_volumes = []
+    rep_weights = []
+    for row in workout_rows:
+        set_weights += [row["weight"]] * row["num_sets"]
+        set_volumes += [row["reps"] * row["weight"] * row["num_sets"]] * row["num_sets"]
+        rep_weights += [row["weight"]] * (row["reps"] * row["num_sets"])
 
-            prev_rep_idx = 0 if len(graph["weight_per_rep"]) == 0 else graph["weight_per_rep"][-1]["x"]
-            for j in range(row["reps"]):
-                graph["weight_per_rep"].append({
-                    "x": prev_rep_idx + j + 1,
-                    "y": row["weight"]
-                })
-        
-        history_data[row["workout_id"]]["table"]["rows"].append({
-            "reps": row["reps"],
-            "weight": row["weight"],
-            "sets": row["num_sets"]
-        })
-    
-    return sorted(history_data.values(), key=lambda e: e["started_at"], reverse=True)
-
-def build_reps_sets_weight(rows):
-    points = []
-    reps = 0
-    num_sets = 0
-    for row in rows:
-        for _ in range(row["num_sets"]):
-            for _ in range(row["reps"]):
-                points.append({
-                    "x": reps,
-                    "y": row["weight"],
-                    "z": num_sets
-                })
-                reps += 1
-            num_sets += 1
-    # for row in rows:
-    #     points.append({
-    #         "x": row["reps"],
-    #         "y": row["weight"],
-    #         "z": row["num_sets"]
-    #     })
-    return points
-
-def sort_timeseries(data, key, convert_timestamp=False):
-    series = sorted(data, key=lambda e: e[key], reverse=True)
-    if not convert_timestamp: return series
-    for elem in series:
-        elem[key] = timestamp_ms_to_date_str(elem[key])
-    return series
+    return {
+        "graph": {
+            "weight_per_set": series_points(set_weights, max_points),
+            "volume_per_set": series_points(set_volumes, max_points),
+            "weight_per_rep": series_points(rep_weights, max_points),
+        },
+        "table": {
+            "headers": ["reps", "weight", "sets"],
+            "rows": [
+                {
+                    "reps": row["reps"],
+                    "weight": row["weight"],
+                    "sets": row["num_sets"]
+                }
+                for row in workout_rows
+            ]
+        },
+        "started_at": date_to_timestamp_ms(workout_rows[0]["started_at"]),
+    }
 
+def series_points(values: list, max_points=None) -> list[dict]:
+    if max_points is None or len(values) <= max_points:
+        return [{"x": x, "y": y} for x, y in enumerate(values, start=1)]
+
+    x = np.arange(1, len(values) + 1)
+    y = np.array(values, dtype=np.float64)
+    indices = lttb_indices(x, y, max_points)
+    return [{"x": x, "y": y} for x, y in zip(x[indices].tolist(), y[indices].tolist())]
+
+def reps_sets_weight_points(aggregates, max_points=None):
+    """One point per rep, x counts reps and z counts sets across the page, yielded one at a time."""
+    reps, weights, num_sets = aggregates.runs()
+    run_lengths = reps * num_sets
+    first_reps = np.cumsum(run_lengths) - run_lengths
+    first_sets = np.cumsum(num_sets) - num_sets
+
+    if max_points is None or run_lengths.sum() <= max_points:
+        for run_reps, weight, first_rep, first_set, run_length in zip(
+            reps.tolist(), weights.tolist(), first_reps.tolist(), first_sets.tolist(), run_lengths.tolist()
+        ):
+            for i in range(run_length):
+                yield {"x": first_rep + i, "y": weight, "z": first_set + i // run_reps}
+        return
+
+    #? every rep of a run has the same weight, so the first and last rep of each run describe the series exactly
+    #? and the per rep series is never expanded, LTTB only chooses between run ends
+    keep = run_lengths > 0
+    x = np.column_stack((first_reps[keep], first_reps[keep] + run_lengths[keep] - 1)).ravel()
+    y = np.repeat(weights[keep], 2)
+    z = np.column_stack((first_sets[keep], first_sets[keep] + num_sets[keep] - 1)).ravel()
+    #? a single rep run starts and ends on the same rep
+    distinct = np.diff(x, prepend=-1) > 0
+    x, y, z = x[distinct], y[distinct], z[distinct]
+
+    indices = lttb_indices(x, y, max_points)
+    for x, y, z in zip(x[indices].tolist(), y[indices].tolist(), z[indices].tolist()):
+        yield {"x": x, "y": y, "z": z}
+
+#? a history repeats the same few hundred workout timestamps across every table
+@lru_cache(maxsize=4096)
 def timestamp_ms_to_date_str(timestamp_ms):
     return datetime.fromtimestamp(timestamp_ms / 1000).strftime("%d/%m/%Y")
 
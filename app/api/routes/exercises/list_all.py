@@ -1,71 +1,118 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi import Request, Response
 from fastapi.responses import JSONResponse
 from datetime import datetime, timezone
 from fastapi.security import HTTPBearer
+from fastapi.encoders import jsonable_encoder
+import hashlib
+import json
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection, get_redis
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import *
+from app.api.middleware.exercise_muscles import get_muscle_index, exercise_muscles
 
 router = APIRouter()
 security = HTTPBearer()
 
+#? the global catalogue is built once per muscle index version, only custom exercises and frequency are per user
+_catalogue = {
+    "muscle_index": None,
+    "rows": [],
+    "ratios": {},
+}
+
 @router.get("/list/all")
-async def exercises_list_all(credentials: dict = Depends(verify_token)):
+async def exercises_list_all(request: Request, credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
-
         user_id = credentials["user_id"]
-        exercise_rows = await fetch_base_exercise_rows(conn, user_id)
+        muscle_index = await get_muscle_index(conn, r)
+        catalogue = await get_catalogue(conn, muscle_index)
 
-        exercises = []
-        for exercise_row in exercise_rows:
-            exercise_id = str(exercise_row["id"])
-            variation_rows = await fetch_variation_rows(conn, user_id, exercise_row["id"])
-
-            variations = []
-            for variation_row in variation_rows:
-                variations.append({
-                    "id": str(variation_row["id"]),
-                    "name": variation_row["name"],
-                    "is_body_weight": variation_row["is_body_weight"],
-                    "muscle_data": await fetch_exercise_muscle_data(conn, variation_row),
-                    "description": variation_row["description"],
-                    "weight_type": variation_row["weight_type"],
-                    "is_custom": variation_row["is_custom"],
-                    "frequency": await fetch_exercise_frequency(conn, variation_row["id"], user_id),
-                })
-                if variation_row["is_body_weight"]:
-                    variations[-1]["ratios"] = await fetch_bodyweight_ratios(conn, str(variation_row["id"]))
-
-            exercises.append({
-                "id": exercise_id,
-                "name": exercise_row["name"],
-                "is_body_weight": exercise_row["is_body_weight"],
-                "muscle_data": await fetch_exercise_muscle_data(conn, exercise_row),
-                "description": exercise_row["description"],
-                "weight_type": exercise_row["weight_type"],
-                "is_custom": exercise_row["is_custom"],
-                "frequency": await fetch_exercise_frequency(conn, exercise_row["id"], user_id),
-                "variations": variations
-            })
-            if exercise_row["is_body_weight"]:
-                exercises[-1]["ratios"] = await fetch_bodyweight_ratios(conn, exercise_id)
+        custom_rows = await conn.fetch(
+            """
+            select *
+            from exercises
+            where user_id = $1
+            """, user_id
+        )
+        ratios = catalogue["ratios"] | await fetch_bodyweight_ratios(
+            conn, [row["id"] for row in custom_rows if row["is_body_weight"]]
+        )
+        frequencies = await fetch_exercise_frequencies(conn, user_id)
+
+        items = {}
+        for row in catalogue["rows"] + list(custom_rows):
+            items[str(row["id"])] = exercise_item(row, muscle_index, ratios, frequencies)
 
+        exercises = []
+        for row in catalogue["rows"] + list(custom_rows):
+            item = items[str(row["id"])]
+            if row["parent_id"] is None:
+                exercises.append(item)
+            elif str(row["parent_id"]) in items:
+                items[str(row["parent_id"])]["variations"].append(item)
+
+        for exercise in exercises:
+            exercise["variations"].sort(key=lambda e: e["name"].lower())
+            for variation in exercise["variations"]:
+                del variation["variations"]
         exercises.sort(key=lambda e: e["name"].lower())
 
-        return {
+        content, etag = encode_with_etag({
             "exercises": exercises
-        }
+        })
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return JSONResponse(content=content, headers={"ETag": etag})
 
     except SafeError as e:
         raise e
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
+
+def encode_with_etag(content: dict) -> tuple[dict, str]:
+    """Json safe content (uuid ids, numeric volumes) and the etag of exactly that body."""
+    content = jsonable_encoder(content)
+    etag = '"' + hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest() + '"'
+    return content, etag
+
+async def get_catalogue(conn, muscle_index) -> dict:
+    #? update_exercises bumps the muscle index version, a new index means the catalogue may have changed too
+    if _catalogue["muscle_index"] is muscle_index: return _catalogue
+
+    rows = await conn.fetch(
+        """
+        select *
+        from exercises
+        where user_id is null
+        """
+    )
+    _catalogue["rows"] = list(rows)
+    _catalogue["ratios"] = await fetch_bodyweight_ratios(
+        conn, [row["id"] for row in rows if row["is_body_weight"]]
+    )
+    _catalogue["muscle_index"] = muscle_index
+    return _catalogue
+
+def exercise_item(row, muscle_index, ratios, frequencies) -> dict:
+    exercise_id = str(row["id"])
+    item = {
+        "id": exercise_id,
+        "name": row["name"],
+        "is_body_weight": row["is_body_weight"],
+        "muscle_data": exercise_muscle_data(muscle_index, exercise_id),
+        "description": row["description"],
+        "weight_type": row["weight_type"],
+        "is_custom": row["user_id"] is not None,
+        "frequency": frequencies.get(exercise_id, {}),
+        "variations": [],
+    }
+    if row["is_body_weight"]:
+        item["ratios"] = ratios.get(exercise_id, {})
+    return item
 
 async def fetch_base_exercise_rows(conn, user_id):
     return await conn.fetch(
@@ -95,80 +142,59 @@ async def fetch_variation_rows(conn, user_id, parent_id):
         """, user_id, parent_id
     )
 
-async def fetch_exercise_muscle_data(conn, exercise_row):
-    muscle_group_rows = await conn.fetch(
-        """
-        select distinct emd.group_id, emd.group_name
-        from exercise_muscle_data emd
-        where emd.exercise_id = $1
-        """, exercise_row["id"]
-    )
-
-    muscle_data = []
-    for muscle_group_row in muscle_group_rows:
-        muscle_target_rows = await conn.fetch(
-            """
-            select emd.target_id, emd.target_name, emd.ratio
-            from exercise_muscle_data emd
-            where emd.exercise_id = $1
-            and emd.group_id = $2
-            """, exercise_row["id"], muscle_group_row["group_id"]
-        )
-
-        target_data = []
-        for muscle_target_row in muscle_target_rows:
-            target_data.append({
-                "target_id": muscle_target_row["target_id"],
-                "target_name": muscle_target_row["target_name"],
-                "ratio": muscle_target_row["ratio"],
-            })
-
-        muscle_data.append({
-            "group_id": muscle_group_row["group_id"],
-            "group_name": muscle_group_row["group_name"],
-            "targets": target_data
+def exercise_muscle_data(muscle_index, exercise_id):
+    muscle_data = {}
+    for target_row in exercise_muscles(muscle_index, exercise_id)["target"]:
+        group = muscle_data.setdefault(target_row["group_id"], {
+            "group_id": target_row["group_id"],
+            "group_name": target_row["group_name"],
+            "targets": []
         })
+        group["targets"].append({
+            "target_id": target_row["target_id"],
+            "target_name": target_row["target_name"],
+            "ratio": target_row["ratio"],
+        })
+    return list(muscle_data.values())
 
-    return muscle_data
-
-async def fetch_exercise_frequency(conn, exercise_id, user_id):
+async def fetch_exercise_frequencies(conn, user_id):
     history_rows = await conn.fetch(
         """
-        select workout_id, sum(reps * weight * num_sets) as volume, started_at
+        select exercise_id, sum(reps * weight * num_sets) as volume, started_at
         from exercise_history
-        where exercise_id = $1
-        and user_id = $2
+        where user_id = $1
         and started_at at time zone 'utc' >= (now() at time zone 'utc' - interval '28 days')
-        group by workout_id, started_at
-        order by started_at desc
-        """, exercise_id, user_id
+        group by exercise_id, workout_id, started_at
+        """, user_id
     )
     
-    days_past_volume = {}
+    frequencies = {}
     for history_row in history_rows:
         days_past = get_days_past(history_row["started_at"])
         if days_past == 0 or days_past > 28: continue
         
+        days_past_volume = frequencies.setdefault(str(history_row["exercise_id"]), {})
         if days_past not in days_past_volume.keys():
             days_past_volume[days_past] = 0
         days_past_volume[days_past] += history_row["volume"]
 
-    return days_past_volume
+    return frequencies
 
 def get_days_past(started_at):
     now = datetime.now(timezone.utc)
     return abs(now - started_at.astimezone(timezone.utc)).days
 
-async def fetch_bodyweight_ratios(conn, exercise_id):
+async def fetch_bodyweight_ratios(conn, exercise_ids):
+    if len(exercise_ids) == 0: return {}
     rows = await conn.fetch(
         """
-        select ratio, gender
+        select exercise_id, ratio, gender
         from bodyweight_exercise_ratios
-        where exercise_id = $1
-        """, exercise_id
+        where exercise_id = any($1::uuid[])
+        """, exercise_ids
     )
 
     ratios = {}
     for row in rows:
-        ratios[row["gender"]] = row["ratio"]
-    return ratios
\ No newline at end of file
+        ratios.setdefault(str(row["exercise_id"]), {})[row["gender"]] = row["ratio"]
+    return ratios
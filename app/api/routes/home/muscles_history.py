@@ -5,7 +5,7 @@ from fastapi.security import HTTPBearer
 from copy import deepcopy
 import math
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import *
@@ -15,30 +15,10 @@ from app.api.routes.muscles import get_muscle_maps
 router = APIRouter()
 security = HTTPBearer()
 
+#? each window sums the user's daily rollups (sql/user_muscle_days.sql), rows are muscles x windows not sets x targets
 @router.get("/muscles-history")
-async def muscles_history(credentials: dict = Depends(verify_token)):
+async def muscles_history(credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
     try:
-        conn = await setup_connection()
-
-        rows = await conn.fetch(
-            """
-            select w.started_at, we.exercise_id, wsd.reps, wsd.weight, wsd.num_sets, mgt.group_name, mgt.target_name, emt.ratio
-            from workouts w
-            inner join workout_exercises we
-            on we.workout_id = w.id
-            inner join workout_set_data wsd
-            on wsd.workout_exercise_id = we.id
-            inner join exercise_muscle_targets emt
-            on emt.exercise_id = we.exercise_id
-            left join muscle_groups_targets mgt
-            on mgt.target_id = emt.muscle_target_id
-            where w.user_id = $1
-            order by mgt.group_name, mgt.target_name
-            """,
-            credentials["user_id"],
-        )
-        print(f"Fetched {len(rows)} exercise history rows")
-
         empty = {
             "volume": 0,
             "sets": 0,
@@ -55,48 +35,61 @@ async def muscles_history(credentials: dict = Depends(verify_token)):
         utc_now = datetime.now(tz=timezone.utc)
 
         data = {}
-        added_exercise_groups = {}
         all_spans = list(timespans.keys()) + ["all"]
         for span in all_spans:
             data[span] = {}
-            added_exercise_groups[span] = {}
-
-        for row in rows:
-            spans = []
-            for key, delta in timespans.items():
-                spans.append(key)
-                if row["started_at"] >= utc_now - delta: break
-            else:
-                spans.append("all")
-
-            volume = row["reps"] * row["weight"] * row["num_sets"]
 
-            for span in spans:
-                group = row["group_name"]
-                if group not in data[span]:
-                    data[span][group] = deepcopy(empty) | {
-                        "targets": {}
-                    }
-
-                exercise_id = row["exercise_id"]
-                if exercise_id not in added_exercise_groups[span]:
-                    added_exercise_groups[span][exercise_id] = []
-
-                if group not in added_exercise_groups[span][exercise_id]:
-                    data[span][group]["volume"] += volume
-                    data[span][group]["sets"] += row["num_sets"]
-                    data[span][group]["reps"] += row["reps"]
-                    added_exercise_groups[span][exercise_id] = group
+        #? span_index is the shortest window a day falls in, every longer window includes it too
+        rows = await conn.fetch(
+            """
+            select mg.name group_name, null target_name, d.span_index,
+                sum(d.volume) volume, sum(d.num_sets) num_sets, sum(d.reps) reps
+            from (
+                select *, (select count(*) from unnest($2::date[]) span_start where day < span_start) span_index
+                from user_muscle_group_days
+                where user_id = $1
+            ) d
+            inner join muscle_groups mg
+            on mg.id = d.muscle_group_id
+            group by mg.name, d.span_index
+            union all
+            select mgt.group_name, mgt.target_name, d.span_index,
+                sum(d.volume), sum(d.num_sets), sum(d.reps)
+            from (
+                select *, (select count(*) from unnest($2::date[]) span_start where day < span_start) span_index
+                from user_muscle_target_days
+                where user_id = $1
+            ) d
+            inner join muscle_groups_targets mgt
+            on mgt.target_id = d.muscle_target_id
+            group by mgt.group_name, mgt.target_name, d.span_index
+            order by target_name nulls first
+            """,
+            credentials["user_id"],
+            [(utc_now - delta).date() for delta in timespans.values()],
+        )
 
-                target = row["target_name"]
-                if target not in data[span][group]["targets"]:
-                    data[span][group]["targets"][target] = deepcopy(empty)
+        for row in rows:
+            for span in all_spans[row["span_index"]:]:
+                group_data = data[span].setdefault(row["group_name"], deepcopy(empty) | {
+                    "targets": {}
+                })
+                if row["target_name"] is None:
+                    muscle_data = group_data
+                else:
+                    muscle_data = group_data["targets"].setdefault(row["target_name"], deepcopy(empty))
+
+                muscle_data["volume"] += row["volume"]
+                muscle_data["sets"] += row["num_sets"]
+                muscle_data["reps"] += row["reps"]
 
-                data[span][group]["targets"][target]["volume"] += volume
-                data[span][group]["targets"][target]["sets"] += row["num_sets"]
-                data[span][group]["targets"][target]["reps"] += row["reps"]
+        for span in all_spans:
+            data[span] = {
+                group: group_data | {"targets": dict(sorted(group_data["targets"].items()))}
+                for group, group_data in sorted(data[span].items())
+            }
     
-        # muscle_maps = await get_muscle_maps()
+        # muscle_maps = await get_muscle_maps(conn)
         # group_to_targets = muscle_maps["group_to_targets"]
 
         # for span, group_data in data.items():
@@ -118,6 +111,4 @@ async def muscles_history(credentials: dict = Depends(verify_token)):
         raise e
     except Exception as e:
         print(str(e))
-        raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
\ No newline at end of file
+        raise Exception('uncaught error')
\ No newline at end of file
@@ -5,32 +5,24 @@ from fastapi.security import HTTPBearer
 from copy import deepcopy
 import math
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection, get_redis
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import *
 from app.api.routes.exercises.list_all import get_days_past
 from app.api.routes.muscles import get_muscle_maps
+from app.api.middleware.presence import fetch_online_friends
+from app.api.middleware.usernames import fetch_usernames
 
 router = APIRouter()
 security = HTTPBearer()
 
+#? presence and friend sets both live in redis, usernames come from the user:names hash
 @router.get("/online-friends")
-async def online_friends(credentials: dict = Depends(verify_token)):
+async def online_friends(credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
-        
-        has_friends = await conn.fetchval(
-            """
-            select exists (
-                select 1
-                from friends
-                where user1_id = $1
-                or user2_id = $1
-            )
-            """, credentials["user_id"]
-        )
-        if not has_friends:
+        num_friends, online_ids = await fetch_online_friends(conn, r, credentials["user_id"])
+        if num_friends == 0:
             return {
                 "data": {
                     "has_friends": False,
@@ -40,52 +32,18 @@ async def online_friends(credentials: dict = Depends(verify_token)):
 
         return_count = 8
 
-        rows = await conn.fetch(
-            """
-            select u.username
-            from online_users of
-            inner join users u
-            on of.user_id = u.id
-            where of.is_online = true
-            and user_id in (
-                select user1_id
-                from friends
-                where user2_id = $1
-                union
-                select user2_id
-                from friends
-                where user1_id = $1
-            )
-            limit $2
-            """, credentials["user_id"], return_count
-        )
-
-        num_friends = await conn.fetchval(
-            """
-            select count(*)
-            from online_users of
-            where of.is_online = true
-            and user_id in (
-                select user1_id
-                from friends
-                where user2_id = $1
-                union
-                select user2_id
-                from friends
-                where user1_id = $1
-            )
-            """, credentials["user_id"]
-        )
-        
-        online_friends = []
-        for row in rows:
-            online_friends.append(str(row["username"]))
+        usernames = await fetch_usernames(conn, r, online_ids[:return_count])
+        online_friends = [
+            usernames[friend_id]
+            for friend_id in online_ids[:return_count]
+            if usernames[friend_id] is not None
+        ]
 
         return {
             "data": {
                 "has_friends": True,
                 "online_friends": online_friends,
-                "more_online_friends": num_friends > return_count
+                "more_online_friends": len(online_ids) > return_count
             }
         }
 
@@ -94,5 +52,3 @@ async def online_friends(credentials: dict = Depends(verify_token)):
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
\ No newline at end of file
@@ -5,7 +5,7 @@ from fastapi.security import HTTPBearer
 from copy import deepcopy
 import math
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import *
@@ -16,10 +16,8 @@ router = APIRouter()
 security = HTTPBearer()
 
 @router.get("/volume-frequency")
-async def volume_frequency(credentials: dict = Depends(verify_token)):
+async def volume_frequency(credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
     try:
-        conn = await setup_connection()
-        
         rows = await conn.fetch(
             """
             select w.started_at, pws.volume
@@ -48,6 +46,4 @@ async def volume_frequency(credentials: dict = Depends(verify_token)):
         raise e
     except Exception as e:
         print(str(e))
-        raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
\ No newline at end of file
+        raise Exception('uncaught error')
\ No newline at end of file
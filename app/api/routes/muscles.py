@@ -8,7 +8,7 @@ from datetime import datetime, timedelta, timezone
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import random
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import SafeError
@@ -17,19 +17,17 @@ router = APIRouter()
 security = HTTPBearer()
 
 @router.get("/muscles/get_maps")
-async def muscles_get_maps_route(credentials: dict = Depends(verify_token)):
+async def muscles_get_maps_route(credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
     try:
-        return await get_muscle_maps()
+        return await get_muscle_maps(conn)
     except SafeError as e:
         raise e
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
 
-async def get_muscle_maps():
+async def get_muscle_maps(conn):
     try:
-        conn = await setup_connection()
-
         rows = await conn.fetch(
             """
             select group_name, target_name
@@ -56,6 +54,4 @@ async def get_muscle_maps():
 
     except Exception as e:
         print(e)
-        raise HTTPException(status_code=500, detail="Uncaught exception")
-    finally:
-        if conn: await conn.close()
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Uncaught exception")
\ No newline at end of file
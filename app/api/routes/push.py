@@ -0,0 +1,47 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials
+from typing import Optional
+import asyncio
+import time
+
+from app.api.routes.auth import verify_token
+from app.api.middleware.push import add_socket, remove_socket
+
+router = APIRouter()
+
+#? server to app events, sent as json text frames:
+#? {"type": "friend_request", "user_id": ..., "status": "requested" | "accepted"}
+#? {"type": "presence", "user_id": ..., "online": bool}
+#? {"type": "rank", "metric": ..., "rank": int, "previous_rank": int | None}
+
+async def socket_credentials(websocket: WebSocket, token: Optional[str]) -> dict | None:
+    """Bearer token from the Authorization header, or ?token= for clients that cannot set headers."""
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer "):]
+    if token is None: return None
+    try:
+        return await verify_token(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+    except HTTPException:
+        return None
+
+@router.websocket("/ws")
+async def push_socket(websocket: WebSocket, token: Optional[str] = None):
+    credentials = await socket_credentials(websocket, token)
+    if credentials is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    user_id = credentials["user_id"]
+    add_socket(user_id, websocket)
+    try:
+        #? nothing is expected from the app, reading only notices the disconnect and the token expiring
+        while True:
+            await asyncio.wait_for(websocket.receive_text(), timeout=max(credentials["exp"] - time.time(), 0))
+    except asyncio.TimeoutError:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="token expired")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        remove_socket(user_id, websocket)
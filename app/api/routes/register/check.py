@@ -10,7 +10,7 @@ from datetime import date
 import bcrypt
 import traceback
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token, verify_temp_token
 from app.api.routes.users.get_data import fetch_user_data
@@ -19,10 +19,8 @@ from app.api.middleware.misc import *
 router = APIRouter()
 
 @router.get("/check/username")
-async def valid_username(username: str):
+async def valid_username(username: str, conn = Depends(get_connection)):
     try:
-        conn = await setup_connection()
-
         exists = await conn.fetchval(
             """
             select exists (
@@ -42,15 +40,11 @@ async def valid_username(username: str):
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 
 @router.get("/check/email")
-async def valid_username(email: str):
+async def valid_username(email: str, conn = Depends(get_connection)):
     try:
-        conn = await setup_connection()
-
         exists = await conn.fetchval(
             """
             select exists (
@@ -69,6 +63,4 @@ async def valid_username(email: str):
         raise e
     except Exception as e:
         print(str(e))
-        raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
\ No newline at end of file
+        raise Exception('uncaught error')
\ No newline at end of file
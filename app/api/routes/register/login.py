@@ -10,7 +10,7 @@ from datetime import date
 import bcrypt
 import traceback
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token, verify_temp_token
 from app.api.routes.register.validate import send_validation_email
@@ -20,12 +20,12 @@ from app.api.middleware.misc import *
 router = APIRouter()
 
 @router.get("/login")
-async def login(send_email: bool = True, credentials: dict = Depends(verify_token)):
-    return await login_user(send_email, credentials)
+async def login(send_email: bool = True, credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
+    return await login_user(conn, send_email, credentials)
 
-async def login_user(send_email, credentials):
+async def login_user(conn, send_email, credentials):
     try:
-        account_state = await fetch_account_state(credentials["user_id"])
+        account_state = await fetch_account_state(conn, credentials["user_id"])
         token = None
         user_data = None
         if account_state == "good":
@@ -34,9 +34,9 @@ async def login_user(send_email, credentials):
                 credentials["user_id"],
                 days=30
             )
-            user_data = await fetch_user_data(credentials["user_id"])
+            user_data = await fetch_user_data(conn, credentials["user_id"])
         elif account_state == "unverified":
-            await send_validation_email(credentials["email"], credentials["user_id"], send_email)
+            await send_validation_email(conn, credentials["email"], credentials["user_id"], send_email)
             token = generate_token(
                 credentials["email"],
                 credentials["user_id"],
@@ -56,10 +56,8 @@ async def login_user(send_email, credentials):
         print(str(e))
         raise Exception('uncaught error')
 
-async def fetch_account_state(user_id):
+async def fetch_account_state(conn, user_id):
     try:
-        conn = await setup_connection()
-
         is_verified = await conn.fetchval(
             """
             select is_verified
@@ -77,6 +75,4 @@ async def fetch_account_state(user_id):
         
     except Exception as e:
         print(e)
-        raise SafeError('error fetching account state')
-    finally:
-        if conn: await conn.close()
\ No newline at end of file
+        raise SafeError('error fetching account state')
\ No newline at end of file
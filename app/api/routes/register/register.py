@@ -11,13 +11,15 @@ import bcrypt
 import traceback
 from typing import Optional
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection, get_redis
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token, verify_temp_token
 from app.api.routes.register.validate import send_validation_email
 from app.api.routes.users.get_data import fetch_user_data
 from app.api.middleware.misc import *
 from app.api.routes.users.permissions import permission_keys
+from app.api.middleware.usernames import cache_username
+from app.api.middleware.user_search import index_username
 
 router = APIRouter()
 
@@ -48,12 +50,11 @@ class Register(BaseModel):
 
 # todo: add to workout_totals, workout_muscle_group/target_totals
 @router.post("/new")
-async def register(req: Register):
+async def register(req: Register, conn = Depends(get_connection), r = Depends(get_redis)):
     req_json = json.loads(req.model_dump_json())
     
-    conn = tx = None
+    tx = None
     try:
-        conn = await setup_connection()
         tx = conn.transaction()
         await tx.start()
 
@@ -108,8 +109,10 @@ async def register(req: Register):
         await new_user_permissions(conn, user_id)
         
         await tx.commit()
+        await cache_username(r, user_id, req.username)
+        await index_username(r, user_id, req.username)
 
-        await send_validation_email(req.email, user_id, req.send_email)
+        await send_validation_email(conn, req.email, user_id, req.send_email)
 
         return {
             "status": "success",
@@ -130,8 +133,6 @@ async def register(req: Register):
         traceback.print_exc()
         if tx: await tx.rollback()
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 async def new_workout_totals(conn, user_id):
     return await conn.fetchrow(
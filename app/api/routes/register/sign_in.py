@@ -10,7 +10,7 @@ from datetime import date
 import bcrypt
 import traceback
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token, verify_temp_token
 from app.api.routes.register.validate import send_validation_email
@@ -25,10 +25,8 @@ class SignIn(BaseModel):
     send_email: bool = True
 
 @router.post("/sign-in")
-async def sign_in(req: SignIn):
+async def sign_in(req: SignIn, conn = Depends(get_connection)):
     try:
-        conn = await setup_connection()
-
         row = await conn.fetchrow(
             """
             select id, password, is_verified
@@ -42,7 +40,7 @@ async def sign_in(req: SignIn):
             status = "none"
         elif bcrypt.checkpw(req.password.encode('utf-8'), row['password'].encode('utf-8')):
             if req.email.strip().lower() == "app@review.com":
-                return await sign_in_reviewer(req.email, row["id"])
+                return await sign_in_reviewer(conn, req.email, row["id"])
             status = "good"
             temp_token = generate_token(
                 req.email,
@@ -50,7 +48,7 @@ async def sign_in(req: SignIn):
                 minutes=15,
                 is_temp=True
             )
-            await send_validation_email(req.email, row["id"], send_email=req.send_email)   
+            await send_validation_email(conn, req.email, row["id"], send_email=req.send_email)   
         else:
             status = "incorrect-password"
 
@@ -64,10 +62,8 @@ async def sign_in(req: SignIn):
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
-async def sign_in_reviewer(email: str, user_id: str):
+async def sign_in_reviewer(conn, email: str, user_id: str):
     return {
         "status": "reviewer",
         "auth_token": generate_token(
@@ -75,5 +71,5 @@ async def sign_in_reviewer(email: str, user_id: str):
             user_id,
             days=30,
         ),
-        "user_data": await fetch_user_data(user_id)
+        "user_data": await fetch_user_data(conn, user_id)
     }
\ No newline at end of file
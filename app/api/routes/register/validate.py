@@ -15,7 +15,7 @@ from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 import random
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token, verify_temp_token
 from app.api.routes.users.get_data import fetch_user_data
@@ -24,9 +24,9 @@ from app.api.middleware.misc import *
 router = APIRouter()
 
 @router.get("/validate/resend")
-async def resend_validation_email(send_email: bool = True, credentials: dict = Depends(verify_temp_token)):
+async def resend_validation_email(send_email: bool = True, credentials: dict = Depends(verify_temp_token), conn = Depends(get_connection)):
     try:
-        await send_validation_email(credentials["email"], credentials["user_id"], send_email)
+        await send_validation_email(conn, credentials["email"], credentials["user_id"], send_email)
     except SafeError as e:
         raise e
     except Exception as e:
@@ -34,12 +34,10 @@ async def resend_validation_email(send_email: bool = True, credentials: dict = D
         raise Exception('uncaught error')
     return {}
 
-async def send_validation_email(email: str, user_id: str, send_email: bool = True):
+async def send_validation_email(conn, email: str, user_id: str, send_email: bool = True):
     code = str(random.randint(100000,999999))
 
     try:
-        conn = await setup_connection()
-        
         user_exists = await conn.fetchval(
             """
             select exists (
@@ -69,8 +67,6 @@ async def send_validation_email(email: str, user_id: str, send_email: bool = Tru
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
     if not send_email: return
 
@@ -98,10 +94,8 @@ async def send_validation_email(email: str, user_id: str, send_email: bool = Tru
     ).execute()
 
 @router.get("/validate/receive")
-async def validate_user(code: str, credentials: dict = Depends(verify_temp_token)):
+async def validate_user(code: str, credentials: dict = Depends(verify_temp_token), conn = Depends(get_connection)):
     try:
-        conn = await setup_connection()
-
         is_verified = await conn.fetchval(
             """
             select is_verified
@@ -157,8 +151,6 @@ async def validate_user(code: str, credentials: dict = Depends(verify_temp_token
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
     return {
         "status": "verified",
@@ -167,7 +159,7 @@ async def validate_user(code: str, credentials: dict = Depends(verify_temp_token
             credentials["user_id"],
             days=30
         ),
-        "user_data": await fetch_user_data(credentials["user_id"])
+        "user_data": await fetch_user_data(conn, credentials["user_id"])
     }
 
 # @router.get("/validate/check")
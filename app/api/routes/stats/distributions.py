@@ -2,7 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import *
@@ -13,13 +13,11 @@ router = APIRouter()
 security = HTTPBearer()
 
 @router.get("/distributions")
-async def stats_distributions(credentials: dict = Depends(verify_token)):
+async def stats_distributions(credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
     user_id = credentials["user_id"]
     try:
-        conn = await setup_connection()
-
         distributions = {}
-        muscle_maps = await get_muscle_maps()
+        muscle_maps = await get_muscle_maps(conn)
 
         group_rows = await fetch_workout_muscle_group_rows(conn, user_id)
 
@@ -83,8 +81,6 @@ async def stats_distributions(credentials: dict = Depends(verify_token)):
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 async def fetch_workout_muscle_group_rows(conn, user_id):
     return await conn.fetch(
@@ -2,19 +2,18 @@ from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection, get_redis
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import *
+from app.api.middleware.exercise_muscles import get_muscle_index, exercise_muscles
 
 router = APIRouter()
 security = HTTPBearer()
 
 @router.get("/favourites")
-async def stats_favourites(credentials: dict = Depends(verify_token)):
+async def stats_favourites(credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
-
         exercise_name_rows = await conn.fetch(
             """
             select *
@@ -33,6 +32,7 @@ async def stats_favourites(credentials: dict = Depends(verify_token)):
                 "variation_name": row["variant_name"]
             }
 
+        muscle_index = await get_muscle_index(conn, r)
         total_rows = await conn.fetch(
             """
             select *
@@ -52,7 +52,7 @@ async def stats_favourites(credentials: dict = Depends(verify_token)):
                     "num_sets": total_row["num_sets"],
                     "reps": total_row["reps"],
                     "counter": total_row["counter"],
-                    "groups": await getExerciseGroups(conn, exercise_id)
+                    "groups": getExerciseGroups(muscle_index, exercise_id)
                 })
                 variation_name = name_map[exercise_id]["variation_name"]
                 if variation_name is None: continue
@@ -69,19 +69,10 @@ async def stats_favourites(credentials: dict = Depends(verify_token)):
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
-
-async def getExerciseGroups(conn, exercise_id):
-    rows = await conn.fetch(
-        """
-        select distinct mgt.group_name
-        from exercise_muscle_targets emt
-        inner join muscle_groups_targets mgt 
-        on emt.muscle_target_id = mgt.target_id 
-        where emt.exercise_id = $1
-        and emt.ratio >= 7
-        """, exercise_id
-    )
 
-    return [row["group_name"] for row in rows]
\ No newline at end of file
+def getExerciseGroups(muscle_index, exercise_id):
+    return [
+        group_row["group_name"]
+        for group_row in exercise_muscles(muscle_index, exercise_id)["group"]
+        if group_row["ratio"] >= 7
+    ]
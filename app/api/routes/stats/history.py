@@ -1,228 +1,161 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer
+from typing import Optional
+import json
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import *
+from app.api.middleware.exercise_muscles import exercise_muscles
+from app.api.middleware.streaming import stream_json, cursor_rows, StreamedPage
 
 router = APIRouter()
 security = HTTPBearer()
 
+#? each workout is summarised once by workout_worker into workout_summaries, zero stats are filled in on read
+#? summaries are read through a cursor and streamed one at a time
 @router.get("/history")
-async def stats_history(credentials: dict = Depends(verify_token)):
+async def stats_history(
+    before: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    credentials: dict = Depends(verify_token),
+    conn = Depends(get_connection)
+):
     try:
-        conn = await setup_connection()
-
-        workout_rows = await conn.fetch(
-            """
-            select *
-            from workouts
-            where user_id = $1
-            order by started_at desc
-            """, credentials["user_id"]
-        )
-        if workout_rows is None: workout_rows = []
-
+        before_started_at, before_id = parse_cursor(before)
         muscle_rows = await conn.fetch(
             """
-            select group_id, group_name, target_id, target_name
+            select group_name, target_name
             from muscle_groups_targets
             """
         )
-        group_id_2_name_map = {
-            row["group_id"]: row["group_name"] for row in muscle_rows
-        }
-        target_id_2_name_map = {
-            row["target_id"]: row["target_name"] for row in muscle_rows
-        }
-        target_2_group_name_map = {
-            row["target_name"]: row["group_name"] for row in muscle_rows
-        }
-
-        stats = []
-        for workout_row in workout_rows:
-            stats.append({
-                "metadata": await stats_history_metadata(conn, workout_row, group_id_2_name_map),
-                "workout_stats": await stats_history_workout(conn, workout_row),
-                "workout_muscle_stats": await stats_history_workout_muscle(conn, workout_row, group_id_2_name_map, target_id_2_name_map, target_2_group_name_map),
-                "replay": await stats_history_workout_replay(conn, workout_row)
-            })
 
-        return {
-            "stats": stats
-        }
+        page = StreamedPage(limit, "workout_id")
+        async def stats():
+            async for summary_row in cursor_rows(
+                """
+                select workout_id, started_at, summary
+                from workout_summaries
+                where user_id = $1
+                and ($2::timestamptz is null or (started_at, workout_id) < ($2, $3::uuid))
+                order by started_at desc, workout_id desc
+                limit $4
+                """, credentials["user_id"], before_started_at, before_id, limit
+            ):
+                page.track(summary_row)
+                summary = json.loads(summary_row["summary"])
+                summary["workout_muscle_stats"] = fill_workout_muscle_stats(summary["workout_muscle_stats"], muscle_rows)
+                yield summary
+
+        return stream_json({
+            "stats": stats(),
+            "next": page.next_cursor
+        })
 
     except SafeError as e:
         raise e
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
-async def stats_history_metadata(conn, workout_row, group_id_2_name_map):
-    top_group_rows = await conn.fetch(
-        """
-        select *
-        from previous_workout_muscle_group_stats
-        where workout_id = $1
-        and volume <> 0
-        order by volume desc
-        limit 3
-        """, workout_row["id"]
-    )
-
-    return {
-        "started_at": date_to_timestamp_ms(workout_row["started_at"]),
-        "duration": workout_row["duration_secs"],
-        "top_groups": [group_id_2_name_map[row["muscle_group_id"]] for row in top_group_rows]
+def fill_workout_muscle_stats(workout_muscle_stats, muscle_rows):
+    empty = {
+        "volume": 0,
+        "num_sets": 0,
+        "reps": 0,
     }
+    for row in muscle_rows:
+        group_stats = workout_muscle_stats.setdefault(row["group_name"], empty | {"targets": {}})
+        if row["target_name"] is None: continue
+        group_stats["targets"].setdefault(row["target_name"], dict(empty))
 
-async def stats_history_workout(conn, workout_row):
-    prev_stats_row = await conn.fetchrow(
-        """
-        select *
-        from previous_workout_stats
-        where workout_id = $1
-        """, workout_row["id"]
-    )
-
-    if prev_stats_row is None:
-        return {
-            "volume": 0,
-            "num_sets": 0,
-            "reps": 0,
-            "num_exercises": 0
-        }
+    for group_name in workout_muscle_stats:
+        workout_muscle_stats[group_name]["targets"] = dict(sorted(workout_muscle_stats[group_name]["targets"].items()))
+    return dict(sorted(workout_muscle_stats.items()))
 
-    return {
-        "volume": prev_stats_row["volume"],
-        "num_sets": prev_stats_row["num_sets"],
-        "reps": prev_stats_row["reps"],
-        "num_exercises": prev_stats_row["num_exercises"]
-    }
+def build_workout_summary(workout, totals, muscle_index, exercise_names) -> dict:
+    """The /stats/history item for one workout, minus muscles it did not touch."""
+    group_names = {}
+    target_names = {}
+    for exercise in workout["exercises"]:
+        for target_row in exercise_muscles(muscle_index, exercise.id)["target"]:
+            group_names[target_row["group_id"]] = target_row["group_name"]
+            target_names[target_row["target_id"]] = (target_row["group_name"], target_row["target_name"])
 
-async def stats_history_workout_muscle(conn, workout_row, group_id_2_name_map, target_id_2_name_map, target_2_group_name_map):
     workout_muscle_stats = {}
-
-    prev_group_stats_rows = await conn.fetch(
-        """
-        select *
-        from previous_workout_muscle_group_stats 
-        where workout_id = $1
-        """, workout_row["id"]
-    )
-    for group_stats_row in prev_group_stats_rows:
-        group_name = group_id_2_name_map[group_stats_row["muscle_group_id"]]
-        workout_muscle_stats[group_name] = {
-            "volume": group_stats_row["volume"],
-            "num_sets": group_stats_row["num_sets"],
-            "reps": group_stats_row["reps"],
-            "targets": {}
-        }
-
-    for group_name in group_id_2_name_map.values():
-        if group_name in workout_muscle_stats: continue
-        workout_muscle_stats[group_name] = {
-            "volume": 0,
-            "num_sets": 0,
-            "reps": 0,
+    for group_id, group_totals in totals["group"].items():
+        workout_muscle_stats[group_names[group_id]] = {
+            "volume": group_totals["volume"],
+            "num_sets": group_totals["num_sets"],
+            "reps": group_totals["reps"],
             "targets": {}
         }
-
-    prev_target_stats_rows = await conn.fetch(
-        """
-        select *
-        from previous_workout_muscle_target_stats 
-        where workout_id = $1
-        """, workout_row["id"]
-    )
-    for target_stats_row in prev_target_stats_rows:
-        target_name = target_id_2_name_map[target_stats_row["muscle_target_id"]]
-        group_name = target_2_group_name_map[target_name]
-        workout_muscle_stats[group_name]["targets"][target_name] = {
-            "volume": target_stats_row["volume"],
-            "num_sets": target_stats_row["num_sets"],
-            "reps": target_stats_row["reps"],
-        }
-
-    for target_name, group_name in target_2_group_name_map.items():
-        if target_name in workout_muscle_stats[group_name]["targets"]: continue
+    for target_id, target_totals in totals["target"].items():
+        group_name, target_name = target_names[target_id]
         workout_muscle_stats[group_name]["targets"][target_name] = {
-            "volume": 0,
-            "num_sets": 0,
-            "reps": 0,
+            "volume": target_totals["volume"],
+            "num_sets": target_totals["num_sets"],
+            "reps": target_totals["reps"],
         }
 
-    for group_name in workout_muscle_stats:
-        workout_muscle_stats[group_name]["targets"] = dict(sorted(workout_muscle_stats[group_name]["targets"].items()))
+    top_groups = sorted(
+        [(group_id, group_totals) for group_id, group_totals in totals["group"].items() if group_totals["volume"] != 0],
+        key=lambda item: item[1]["volume"],
+        reverse=True
+    )[:3]
 
-    workout_muscle_stats = dict(sorted(workout_muscle_stats.items()))
-    return workout_muscle_stats
-
-async def stats_history_workout_replay(conn, workout_row):
     replay = []
-
-    workout_exercise_rows = await conn.fetch(
-        """
-        select *
-        from workout_exercises
-        where workout_id = $1
-        order by order_index
-        """, workout_row["id"]
-    )
-
-    for workout_exercise_row in workout_exercise_rows:
-        set_data = []
-
-        set_data_rows = await conn.fetch(
-            """
-            select *
-            from workout_set_data
-            where workout_exercise_id = $1
-            order by order_index
-            """, workout_exercise_row["id"]
-        )
-        for set_data_row in set_data_rows:
-            set_data.append({
-                "reps": set_data_row["reps"],
-                "weight": set_data_row["weight"],
-                "num_sets": set_data_row["num_sets"],
-                "class": set_data_row["set_class"],
-            })
-
-        temp_row = await conn.fetchrow(
-            """
-            select *
-            from exercises
-            where id = $1
-            """, workout_exercise_row["exercise_id"]
-        )
-        if temp_row is None:
-            exercise_name = "exercise not found"
-            variation_name = None
-        elif temp_row["parent_id"] is None:
-            exercise_name = temp_row["name"]
-            variation_name = None
-        else:
-            variation_name = temp_row["name"]
-            exercise_name = await conn.fetchval(
-                """
-                select name
-                from exercises
-                where id = $1
-                """, temp_row["parent_id"]
-            )
-            if exercise_name is None:
-                exercise_name = "exercise not found"
-
+    for workout_exercise_id, exercise in zip(workout["workout_exercise_ids"], workout["exercises"]):
+        exercise_name, variation_name = exercise_names.get(exercise.id, ("exercise not found", None))
         replay.append({
-            "exercise_id": workout_exercise_row["id"],
+            "exercise_id": str(workout_exercise_id),
             "exercise_name": exercise_name,
             "variation_name": variation_name,
-            "set_data": set_data
+            "set_data": [
+                {
+                    "reps": set_data.reps,
+                    "weight": set_data.weight,
+                    "num_sets": set_data.num_sets,
+                    "class": set_data.set_class,
+                }
+                for set_data in exercise.set_data
+            ]
         })
 
-    return replay
\ No newline at end of file
+    return {
+        "metadata": {
+            "started_at": date_to_timestamp_ms(workout["started_at"]),
+            "duration": workout["duration_secs"],
+            "top_groups": [group_names[group_id] for group_id, _ in top_groups]
+        },
+        "workout_stats": {
+            "volume": totals["workout"]["volume"],
+            "num_sets": totals["workout"]["num_sets"],
+            "reps": totals["workout"]["reps"],
+            "num_exercises": totals["workout"]["num_exercises"]
+        },
+        "workout_muscle_stats": workout_muscle_stats,
+        "replay": replay
+    }
+
+async def fetch_exercise_names(conn, exercise_ids) -> dict:
+    """exercise_id -> (exercise_name, variation_name), variations are named after their parent."""
+    rows = await conn.fetch(
+        """
+        select e.id, e.name, e.parent_id, p.name parent_name
+        from exercises e
+        left join exercises p
+        on p.id = e.parent_id
+        where e.id = any($1::uuid[])
+        """, list(exercise_ids)
+    )
+
+    exercise_names = {}
+    for row in rows:
+        if row["parent_id"] is None:
+            exercise_names[str(row["id"])] = (row["name"], None)
+        else:
+            exercise_names[str(row["id"])] = (row["parent_name"] or "exercise not found", row["name"])
+    return exercise_names
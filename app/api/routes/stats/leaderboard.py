@@ -1,14 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer
-import random
 from typing import Optional
-from uuid import uuid4
+import hashlib
+import json
+import os
 
-from app.api.middleware.database import setup_connection, redis_connection
+from app.api.middleware.database import get_connection, get_redis
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import *
+from app.api.middleware.usernames import fetch_usernames
 from app.api.routes.exercises.list_all import fetch_base_exercise_rows, fetch_variation_rows
 
 router = APIRouter()
@@ -20,16 +22,22 @@ async def stats_leaderboards_overall(
     side_num: int,
     num_rank_points: int,
     metric: overall_leaderboard_literal,
-    credentials: dict = Depends(verify_token)
+    gender: Optional[gender_literal] = None,
+    age: Optional[str] = None,
+    weight: Optional[str] = None,
+    height: Optional[str] = None,
+    bodyfat: Optional[str] = None,
+    credentials: dict = Depends(verify_token),
+    conn = Depends(get_connection),
+    r = Depends(get_redis)
 ):
     try:
-        conn = r = None
-        conn = await setup_connection()
-        r = await redis_connection()
 
         user_id = credentials["user_id"]
-        zset = overall_zset_name(metric)
-        if not await zset_exists(r, zset):
+        cohort = request_cohort(gender=gender, age=age, weight=weight, height=height, bodyfat=bodyfat)
+        zset = overall_zset_name(metric, cohort)
+        #? cohort zsets are only written by workout saves and sync_redis, a missing one is just empty
+        if cohort is None and not await zset_exists(r, zset):
             await sync_overall_zset(conn, r, zset, metric)
 
         return {
@@ -49,9 +57,6 @@ async def stats_leaderboards_overall(
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
-        if r: await r.close()
 
 async def sync_overall_zset(conn, r, zset, metric):
     await r.delete(zset)
@@ -69,10 +74,8 @@ async def sync_overall_zset(conn, r, zset, metric):
         })
 
 @router.get("/exercises-meta")
-async def stats_exercises(credentials: dict = Depends(verify_token)):
+async def stats_exercises(credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
     try:
-        conn = await setup_connection()
-
         user_id = credentials["user_id"]
         exercises = {}
         exercise_rows = await fetch_base_exercise_rows(conn, user_id)
@@ -109,8 +112,6 @@ async def stats_exercises(credentials: dict = Depends(verify_token)):
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 @router.get("/leaderboard/exercise/{exercise_id}/{metric}")
 async def stats_leaderboards_overall(
@@ -119,12 +120,11 @@ async def stats_leaderboards_overall(
     num_rank_points: int,
     exercise_id: str,
     metric: exercise_leaderboard_literal,
-    credentials: dict = Depends(verify_token)
+    credentials: dict = Depends(verify_token),
+    conn = Depends(get_connection),
+    r = Depends(get_redis)
 ):
     try:
-        conn = r = None
-        conn = await setup_connection()
-        r = await redis_connection()
 
         user_id = credentials["user_id"]
         zset = exercise_zset_name(exercise_id, metric)
@@ -148,9 +148,6 @@ async def stats_leaderboards_overall(
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
-        if r: await r.close()
 
 async def sync_exercise_zset(conn, r, zset, exercise_id, metric):
     await r.delete(zset)
@@ -183,51 +180,36 @@ async def stats_exercise_record(
     height_max: Optional[float] = None,
     user_weight_min: Optional[float] = None,
     user_weight_max: Optional[float] = None,
-    credentials: dict = Depends(verify_token)
+    credentials: dict = Depends(verify_token),
+    conn = Depends(get_connection),
+    r = Depends(get_redis)
 ):
     try:
-        conn = r = None
-        conn = await setup_connection()
-        r = await redis_connection()
-
-        query =  """
-            select *
-            from exercise_records
-            where exercise_id = $1
-            and reps = $2
-        """
-        if age_min != None:
-            query += f"\nand age >= {age_min}"
-        if age_max != None:
-            query += f"\nand age <= {age_max}"
-
-        rows = await conn.fetch(
-           query,
-           exercise_id,
-           reps
-        )
-
-        zset = str(uuid4())
-        for row in rows:
-            await r.zadd(
-                zset,
-                {str(row["user_id"]): row["weight"]}
-            )
 
-        leaderboard = await leaderboard_data(
-            conn, 
-            r, 
-            credentials["user_id"], 
-            zset, 
-            top_num, 
-            side_num, 
-            num_rank_points
-        )
-
-        await r.delete(zset)
+        filters = {
+            "gender": gender,
+            "age_min": age_min,
+            "age_max": age_max,
+            "ped_status": ped_status,
+            "height_min": height_min,
+            "height_max": height_max,
+            "user_weight_min": user_weight_min,
+            "user_weight_max": user_weight_max,
+        }
+        zset = record_zset_name(exercise_id, reps, filters)
+        if not await zset_exists(r, zset, record_empty_key(zset)):
+            await cache_record_zset(conn, r, zset, exercise_id, reps, filters)
 
         return {
-            "leaderboard": leaderboard
+            "leaderboard": await leaderboard_data(
+                conn, 
+                r, 
+                credentials["user_id"], 
+                zset, 
+                top_num, 
+                side_num, 
+                num_rank_points
+            )
         }   
 
     except SafeError as e:
@@ -235,15 +217,78 @@ async def stats_exercise_record(
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
-        if r: await r.close()
+
+def record_cache_ttl_secs() -> int:
+    return int(os.getenv("RECORD_CACHE_TTL_SECS", 60))
+
+def record_zset_name(exercise_id, reps, filters: dict) -> str:
+    #? only set filters are hashed, so the same view always lands on the same key
+    normalized = json.dumps({key: value for key, value in filters.items() if value is not None}, sort_keys=True)
+    filter_hash = hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+    return f"record:{exercise_id}:{reps}:{filter_hash}:leaderboard"
+
+def record_empty_key(zset) -> str:
+    return f"{zset}:empty"
+
+async def cache_record_zset(conn, r, zset, exercise_id, reps, filters: dict):
+    #? a user keeps one entry, their best weight across records matching the filters
+    rows = await conn.fetch(
+        """
+        select er.user_id, max(er.weight) weight
+        from exercise_records er
+        inner join users u
+        on u.id = er.user_id
+        where er.exercise_id = $1
+        and er.reps = $2
+        and ($3::user_gender is null or u.gender = $3)
+        and ($4::real is null or er.age >= $4)
+        and ($5::real is null or er.age <= $5)
+        and ($6::ped_status_type is null or er.ped_status = $6)
+        and ($7::real is null or er.height >= $7)
+        and ($8::real is null or er.height <= $8)
+        and ($9::real is null or er.user_weight >= $9)
+        and ($10::real is null or er.user_weight <= $10)
+        group by er.user_id
+        """,
+        exercise_id,
+        reps,
+        filters["gender"],
+        filters["age_min"],
+        filters["age_max"],
+        filters["ped_status"],
+        filters["height_min"],
+        filters["height_max"],
+        filters["user_weight_min"],
+        filters["user_weight_max"],
+    )
+    #? a zset cannot be stored empty, a marker with the same ttl stops an empty view re-running the query
+    if len(rows) == 0:
+        await r.set(record_empty_key(zset), "-", ex=record_cache_ttl_secs())
+        return
+
+    pipe = r.pipeline(transaction=True)
+    pipe.delete(zset, record_empty_key(zset))
+    pipe.zadd(zset, {str(row["user_id"]): row["weight"] for row in rows})
+    pipe.expire(zset, record_cache_ttl_secs())
+    await pipe.execute()
 
 #####################################################
 ### Helpers
 
-async def zset_exists(r, zset_key) -> bool:
-    return await r.exists(zset_key)
+def request_cohort(**labels) -> str | None:
+    labels = {key: label for key, label in labels.items() if label is not None}
+    if len(labels) == 0: return None
+
+    if tuple(labels.keys()) not in cohort_dimensions:
+        raise SafeError(f"unsupported cohort: {', '.join(labels.keys())}")
+    for key, label in labels.items():
+        if label in cohort_labels(key): continue
+        raise SafeError(f"unknown {key} bucket: {label}")
+
+    return cohort_name(labels)
+
+async def zset_exists(r, *zset_keys) -> bool:
+    return await r.exists(*zset_keys) > 0
 
 async def leaderboard_data(conn, r, user_id, zset, top_num, side_num, num_rank_points):
     count = await r.zcard(zset)
@@ -254,21 +299,22 @@ async def leaderboard_data(conn, r, user_id, zset, top_num, side_num, num_rank_p
     if user_rank == None or user_rank <= top_num + side_num:
         fracture = None
         top = await r.zrevrange(zset, 0, top_num + 2 * side_num, withscores=True)
-        leaderboard = await leaderboard_items(conn, top, 0)
+        sections = [(top, 0)]
     elif user_rank >= count - side_num - 1:
         fracture = top_num
         top = await r.zrevrange(zset, 0, top_num - 1, withscores=True)
-        top_ranks =  await leaderboard_items(conn, top, 0)
         sides = await r.zrevrange(zset, max_rank - 2 * side_num, max_rank, withscores=True)
-        side_ranks = await leaderboard_items(conn, sides, user_rank - side_num)
-        leaderboard = top_ranks + side_ranks
+        sections = [(top, 0), (sides, user_rank - side_num)]
     else:
         fracture = top_num
         top = await r.zrevrange(zset, 0, top_num - 1, withscores=True)
-        top_ranks =  await leaderboard_items(conn, top, 0)
         sides = await r.zrevrange(zset, user_rank - side_num, user_rank + side_num, withscores=True)
-        side_ranks = await leaderboard_items(conn, sides, user_rank - side_num)
-        leaderboard = top_ranks + side_ranks
+        sections = [(top, 0), (sides, user_rank - side_num)]
+
+    usernames = await fetch_usernames(conn, r, [item[0] for items, _ in sections for item in items])
+    leaderboard = []
+    for items, start_rank in sections:
+        leaderboard += leaderboard_items(usernames, items, start_rank)
 
     adjusted_user_rank = user_rank + 1 if user_rank != None else None
     return {
@@ -277,53 +323,48 @@ async def leaderboard_data(conn, r, user_id, zset, top_num, side_num, num_rank_p
         "user_rank": adjusted_user_rank,
         "max_rank": max_rank + 1,
         "friend_ids": [],
-        "rank_data": await fetch_rank_data(r, user_id, zset, num_rank_points)
+        "rank_data": await fetch_rank_data(r, user_id, zset, num_rank_points, count, user_rank)
     }
 
-async def leaderboard_items(conn, items, start_rank):
+def leaderboard_items(usernames, items, start_rank):
     leaderboard = []
-    for i, items in enumerate(items):
-        username = await conn.fetchval(
-            """
-            select username
-            from users
-            where id = $1
-            """, items[0]
-        ),
+    for i, item in enumerate(items):
+        username = usernames.get(item[0])
         leaderboard.append({
-            "user_id": items[0],
+            "user_id": item[0],
             "username": username if username else "",
             "rank": i + start_rank + 1,
-            "value": items[1]
+            "value": item[1]
         })
     return leaderboard
 
-async def fetch_rank_data(r, user_id, zset, num_rank_points):
-    rank_data = []
-    user_value = None
-    for item in await r.zrange(zset, 0, -1, withscores=True):
-        rank_data.append({
-            "user_id": item[0],
-            "value": item[1],
-            "showVerticalLine": True if item[0] == user_id else False
-        })
-        if item[0] == user_id:
-            user_value = item[1]
-
-    if len(rank_data) <= num_rank_points: return rank_data
+#? evenly spaced quantiles read by index, never the whole zset
+#? count and the user's rank come from leaderboard_data, so the points are one pipeline of single index ZRANGEs
+async def fetch_rank_data(r, user_id, zset, num_rank_points, count, user_rank):
+    positions = rank_positions(count, num_rank_points)
+    if user_rank is not None:
+        #? user_rank is ZREVRANK, the points are read in ascending order
+        user_index = count - 1 - user_rank
+        if user_index not in positions:
+            positions = sorted(positions + [user_index])
+    if len(positions) == 0: return []
+
+    pipe = r.pipeline(transaction=False)
+    for position in positions:
+        pipe.zrange(zset, position, position, withscores=True)
 
-    rank_data = random.sample(rank_data, 50)
-    if user_value is None: return rank_data
-
-    for item in rank_data:
-        if item["user_id"] != user_id: continue
-        break
-    else:
-        rank_data.append({
-            "user_id": user_id,
-            "value": user_value,
-            "showVerticalLine": True
-        })
-        rank_data = sorted(rank_data, lambda e: e["value"])
-
-    return rank_data
\ No newline at end of file
+    rank_data = []
+    for items in await pipe.execute():
+        for item in items:
+            rank_data.append({
+                "user_id": item[0],
+                "value": item[1],
+                "showVerticalLine": True if item[0] == user_id else False
+            })
+    return rank_data
+
+def rank_positions(count, num_rank_points) -> list[int]:
+    if count <= num_rank_points: return list(range(count))
+    if num_rank_points <= 1: return [count - 1] if num_rank_points == 1 else []
+    step = (count - 1) / (num_rank_points - 1)
+    return sorted({round(i * step) for i in range(num_rank_points)})
@@ -2,7 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import *
@@ -12,10 +12,8 @@ router = APIRouter()
 security = HTTPBearer()
 
 @router.get("/workout_totals") 
-async def stats_workout_totals(credentials: dict = Depends(verify_token)):
+async def stats_workout_totals(credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
     try:
-        conn = await setup_connection()
-
         row = await conn.fetchrow(
             """
             select *
@@ -42,6 +40,4 @@ async def stats_workout_totals(credentials: dict = Depends(verify_token)):
         raise e
     except Exception as e:
         print(str(e))
-        raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
\ No newline at end of file
+        raise Exception('uncaught error')
\ No newline at end of file
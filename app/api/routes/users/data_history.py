@@ -5,22 +5,20 @@ from typing import Annotated, Optional
 import json
 
 from app.api.routes.auth import verify_token
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.misc import *
 from app.api.routes.exercises.history import timestamp_ms_to_date_str
 
 router = APIRouter()
 
 @router.get("/data/get/history")
-async def users_data_get_history(credentials: dict = Depends(verify_token)):
+async def users_data_get_history(credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
     return {
-        "data_history": await data_history(credentials["user_id"])
+        "data_history": await data_history(conn, credentials["user_id"])
     }
 
-async def data_history(user_id: str):
+async def data_history(conn, user_id: str):
     try:
-        conn = await setup_connection()
-
         history = {}
         for key, data_map in user_data_tables_map.items():
             if data_map["table"] == "users": continue
@@ -64,8 +62,6 @@ async def data_history(user_id: str):
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 def get_table_header(key: str) -> str:
     match key:
@@ -6,9 +6,12 @@ import json
 from datetime import datetime, timezone
 
 from app.api.routes.auth import verify_token
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection, get_redis
 from app.api.middleware.misc import *
 from app.api.routes.users.permissions import get_permission_values
+from app.api.middleware.user_search import *
+from app.api.middleware.push import publish_event
+from app.api.middleware.friend_graph import *
 
 router = APIRouter()
 
@@ -24,28 +27,10 @@ router = APIRouter()
 #   look at friends stats?
 
 @router.get("/friends/all")
-async def users_friends_all(credentials: dict = Depends(verify_token)):
+async def users_friends_all(credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
-
-        friends = await conn.fetch(
-            """
-            select f.user1_id user_id, u.username
-            from friends f
-            inner join users u
-            on u.id = f.user1_id
-            where f.user2_id = $1
-            union
-            select f.user2_id user_id, u.username
-            from friends f
-            inner join users u
-            on u.id = f.user2_id
-            where f.user1_id = $1
-            """, credentials["user_id"]
-        )
-
         return {
-            "friends": friends
+            "friends": await fetch_friends(conn, r, credentials["user_id"])
         }
 
     except SafeError as e:
@@ -53,14 +38,10 @@ async def users_friends_all(credentials: dict = Depends(verify_token)):
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 @router.get("/blocked/all")
-async def users_friends_all(credentials: dict = Depends(verify_token)):
+async def users_friends_all(credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
     try:
-        conn = await setup_connection()
-
         blocked = await conn.fetch(
             """
             select b.blocked_id user_id, username
@@ -80,93 +61,13 @@ async def users_friends_all(credentials: dict = Depends(verify_token)):
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
+#? answered from redis, see app/api/middleware/user_search.py
 @router.get("/search")
-async def users_search(username: str, credentials: dict = Depends(verify_token)):
+async def users_search(username: str, credentials: dict = Depends(verify_token), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
-
-        rows = await conn.fetch(
-            """
-            select *
-            from users
-            where id != $1
-            and username ilike $2 || '%'
-            and id not in (
-                select blocked_id
-                from blocked_users
-                where victim_id = $1
-            )
-            and id not in (
-                select user_id
-                from user_permissions
-                where permission_key = 'searchable'
-                and permission_value = 'private'
-            )
-            order by username
-            limit 50
-            """,
-            credentials["user_id"],
-            username.strip()
-        )
-
-        matches = []
-        for row in rows:
-            is_friend = await conn.fetchval(
-                """
-                select exists (
-                    select 1
-                    from friends
-                    where (user1_id = $1 and user2_id = $2)
-                    or (user1_id = $2 and user2_id = $1)
-                )    
-                """, credentials["user_id"], row["id"]
-            )
-            if is_friend: continue
-            
-            requested = await conn.fetchval(
-                """
-                select exists (
-                    select 1
-                    from friend_requests
-                    where requestor_id = $1
-                    and target_id = $2
-                )    
-                """, credentials["user_id"], row["id"]
-            )
-
-            inbound = await  conn.fetchval(
-                """
-                select exists (
-                    select 1
-                    from friend_requests
-                    where requestor_id = $1
-                    and target_id = $2
-                )    
-                """, row["id"], credentials["user_id"] 
-            )
-
-            if requested and inbound:
-                await add_friend(row["id"], credentials["user_id"])
-                continue
-
-            if requested: 
-                relation = "requested"
-            elif inbound:
-                relation = "inbound"
-            else:
-                relation = "none"
-
-            matches.append({
-                "id": row["id"],
-                "username": row["username"],
-                "relation": relation
-            })
-
         return {
-            "matches": matches
+            "matches": await search_users(r, credentials["user_id"], username)
         }
 
     except SafeError as e:
@@ -174,14 +75,10 @@ async def users_search(username: str, credentials: dict = Depends(verify_token))
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 @router.get("/request/all")
-async def users_request_all(credentials: dict = Depends(verify_token)):
+async def users_request_all(credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
     try:
-        conn = await setup_connection()
-
         inbound = await conn.fetch(
             """
             select fr.requestor_id id, u.username, request_state
@@ -214,17 +111,13 @@ async def users_request_all(credentials: dict = Depends(verify_token)):
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 class RequestAdd(BaseModel):
     target_id: str
 
 @router.post("/request/send")
-async def users_request_add(req: RequestAdd, credentials: dict = Depends(verify_token)):
+async def users_request_add(req: RequestAdd, credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
-
         permission = await conn.fetchval(
             """
             select permission_value
@@ -251,8 +144,11 @@ async def users_request_add(req: RequestAdd, credentials: dict = Depends(verify_
             credentials["user_id"],
         )
         if incoming_exists: 
+            result = await add_friend(conn, r, credentials["user_id"], req.target_id)
+            if result == "added":
+                await after_commit(publish_event(r, req.target_id, friend_request_event(credentials["user_id"], "accepted")))
             return {
-                "status": await add_friend(credentials["user_id"], req.target_id)
+                "status": result
             }
 
         await conn.execute(
@@ -270,6 +166,10 @@ async def users_request_add(req: RequestAdd, credentials: dict = Depends(verify_
             req.target_id,
             datetime.now(tz=timezone.utc).replace(tzinfo=None),
         )
+        await after_commit(
+            invalidate_requests(r, credentials["user_id"], req.target_id),
+            publish_event(r, req.target_id, friend_request_event(credentials["user_id"], "requested"))
+        )
 
         return {
             "status": "requested"
@@ -280,17 +180,20 @@ async def users_request_add(req: RequestAdd, credentials: dict = Depends(verify_
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
+
+def friend_request_event(user_id, request_state: str) -> dict:
+    return {
+        "type": "friend_request",
+        "user_id": str(user_id),
+        "status": request_state
+    }
 
 class RequestCancel(BaseModel):
     target_id: str
 
 @router.post("/request/cancel")
-async def users_request_add(req: RequestCancel, credentials: dict = Depends(verify_token)):
+async def users_request_add(req: RequestCancel, credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
-
         await conn.execute(
             """
             delete
@@ -299,6 +202,7 @@ async def users_request_add(req: RequestCancel, credentials: dict = Depends(veri
             and target_id = $2
             """, credentials["user_id"], req.target_id
         )
+        await after_commit(invalidate_requests(r, credentials["user_id"], req.target_id))
 
         return {
             "status": "cancelled"
@@ -309,17 +213,13 @@ async def users_request_add(req: RequestCancel, credentials: dict = Depends(veri
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 class RequestDeny(BaseModel):
     requestor_id: str
 
 @router.post("/request/deny")
-async def users_request_add(req: RequestDeny, credentials: dict = Depends(verify_token)):
+async def users_request_add(req: RequestDeny, credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
     try:
-        conn = await setup_connection()
-
         exists = await conn.fetchval(
             """
             select exists (
@@ -358,17 +258,13 @@ async def users_request_add(req: RequestDeny, credentials: dict = Depends(verify
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 class RequestAccept(BaseModel):
     requestor_id: str
 
 @router.post("/request/accept")
-async def users_request_add(req: RequestAccept, credentials: dict = Depends(verify_token)):
+async def users_request_add(req: RequestAccept, credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
-
         exists = await conn.fetchval(
             """
             select exists (
@@ -384,7 +280,9 @@ async def users_request_add(req: RequestAccept, credentials: dict = Depends(veri
                 "status": "no-request"
             }
         
-        result = await add_friend(req.requestor_id, credentials["user_id"])
+        result = await add_friend(conn, r, req.requestor_id, credentials["user_id"])
+        if result == "added":
+            await after_commit(publish_event(r, req.requestor_id, friend_request_event(credentials["user_id"], "accepted")))
         status = "accepted" if result == "added" else result
 
         return {
@@ -396,8 +294,6 @@ async def users_request_add(req: RequestAccept, credentials: dict = Depends(veri
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 # class AddFriend(BaseModel):
 #     user1_id: str
@@ -409,9 +305,8 @@ async def users_request_add(req: RequestAccept, credentials: dict = Depends(veri
 #         "status": await add_friend(req.user1_id, req.user2_id)
 #     }
 
-async def add_friend(user1_id, user2_id):
+async def add_friend(conn, r, user1_id, user2_id):
     try:
-        conn = await setup_connection()
         tx = conn.transaction()
         await tx.start()
 
@@ -440,38 +335,22 @@ async def add_friend(user1_id, user2_id):
                 user2_id
             )
             await tx.commit()
+            await after_commit(invalidate_unfriend(r, user1_id, user2_id))
             return "blocked" 
 
-        exists = await conn.fetchval(
-            """
-            select exists (
-                select 1
-                from friends
-                where (
-                    user1_id = $1 and user2_id = $2
-                ) or (
-                    user1_id = $2 and user2_id = $1
-                )
-            )
-            """, user1_id, user2_id
-        )
+        exists = await friendship_exists(conn, r, user1_id, user2_id)
         if exists: 
             await accept_request(conn, user1_id, user2_id)
             await tx.commit()
+            await after_commit(invalidate_friend_sets(r, user1_id, user2_id))
             return "existing"
         
-        await conn.execute(
-            """
-            insert into friends
-            (user1_id, user2_id)
-            values
-            ($1, $2)
-            """, user1_id, user2_id
-        )
+        await insert_friendship(conn, user1_id, user2_id)
 
         await accept_request(conn, user1_id, user2_id)
 
         await tx.commit()
+        await after_commit(invalidate_friend_sets(r, user1_id, user2_id))
 
         return "added"
 
@@ -482,8 +361,6 @@ async def add_friend(user1_id, user2_id):
         print(str(e))
         if tx: await tx.rollback()
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 async def accept_request(conn, user1_id, user2_id):
     await conn.execute(
@@ -518,15 +395,15 @@ class UnfriendUser(BaseModel):
     target_id: str
 
 @router.post("/friends/unfriend")
-async def users_friends_unfriend(req: UnfriendUser, credentials: dict = Depends(verify_token)):
+async def users_friends_unfriend(req: UnfriendUser, credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
         tx = conn.transaction()
         await tx.start()
 
         await unfriend_user(conn, req.target_id, credentials["user_id"])
 
         await tx.commit()
+        await after_commit(invalidate_unfriend(r, req.target_id, credentials["user_id"]))
 
         return {
             "status": "success"
@@ -539,20 +416,9 @@ async def users_friends_unfriend(req: UnfriendUser, credentials: dict = Depends(
         print(str(e))
         if tx: await tx.rollback()
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 async def unfriend_user(conn, target_id, user_id):
-    await conn.execute(
-        """
-        delete
-        from friends
-        where (user1_id = $1 and user2_id = $2)
-        or (user1_id = $2 and user2_id = $1)
-        """,
-        target_id,
-        user_id
-    )
+    await delete_friendship(conn, target_id, user_id)
 
     await conn.execute(
         """
@@ -569,9 +435,8 @@ class BlockUser(BaseModel):
     target_id: str
 
 @router.post("/friends/block")
-async def users_friends_block(req: BlockUser, credentials: dict = Depends(verify_token)):
+async def users_friends_block(req: BlockUser, credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
         tx = conn.transaction()
         await tx.start()
 
@@ -589,6 +454,10 @@ async def users_friends_block(req: BlockUser, credentials: dict = Depends(verify
         )
 
         await tx.commit()
+        await after_commit(
+            invalidate_unfriend(r, req.target_id, credentials["user_id"]),
+            invalidate_blocked(r, credentials["user_id"])
+        )
 
         return {
             "status": "success"
@@ -601,16 +470,13 @@ async def users_friends_block(req: BlockUser, credentials: dict = Depends(verify
         print(str(e))
         if tx: await tx.rollback()
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 class UnblockUser(BaseModel):
     target_id: str
 
 @router.post("/friends/unblock")
-async def users_friends_block(req: UnblockUser, credentials: dict = Depends(verify_token)):
+async def users_friends_block(req: UnblockUser, credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
         tx = conn.transaction()
         await tx.start()
 
@@ -626,6 +492,7 @@ async def users_friends_block(req: UnblockUser, credentials: dict = Depends(veri
         )
 
         await tx.commit()
+        await after_commit(invalidate_blocked(r, credentials["user_id"]))
 
         return {
             "status": "success"
@@ -637,6 +504,4 @@ async def users_friends_block(req: UnblockUser, credentials: dict = Depends(veri
     except Exception as e:
         print(str(e))
         if tx: await tx.rollback()
-        raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
\ No newline at end of file
+        raise Exception('uncaught error')
\ No newline at end of file
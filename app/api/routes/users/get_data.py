@@ -6,16 +6,16 @@ import json
 from datetime import date
 
 from app.api.routes.auth import verify_token
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.misc import *
 
 router = APIRouter()
 
 @router.get("/data/get")
-async def users_data(credentials: dict = Depends(verify_token)):
+async def users_data(credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
     try:
         return {
-            "user_data": await fetch_user_data(credentials["user_id"])
+            "user_data": await fetch_user_data(conn, credentials["user_id"])
         }
     except SafeError as e:
         raise e
@@ -23,10 +23,8 @@ async def users_data(credentials: dict = Depends(verify_token)):
         print(str(e))
         raise Exception('uncaught error')
 
-async def fetch_user_data(user_id: str) -> dict | None:
+async def fetch_user_data(conn, user_id: str) -> dict | None:
     try:
-        conn = await setup_connection()
-
         row = await conn.fetchrow(
             """
             select distinct on (u.id) u.*, w.weight, h.height, p.ped_status, g.goal_status
@@ -61,6 +59,4 @@ async def fetch_user_data(user_id: str) -> dict | None:
         }
 
     except Exception as e:
-        raise e
-    finally:
-        if conn: await conn.close()
\ No newline at end of file
+        raise e
\ No newline at end of file
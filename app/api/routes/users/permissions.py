@@ -5,8 +5,9 @@ from typing import Annotated, Optional
 import json
 
 from app.api.routes.auth import verify_token
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection, get_redis
 from app.api.middleware.misc import *
+from app.api.middleware.user_search import cache_searchable
 
 router = APIRouter()
 
@@ -31,10 +32,8 @@ def get_permission_values(key: str):
     return ["friends", "private"]
 
 @router.get("/permissions/get")
-async def users_friends_block(credentials: dict = Depends(verify_token)):
+async def users_friends_block(credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
-
         rows = await conn.fetch(
             """
             select *
@@ -58,6 +57,7 @@ async def users_friends_block(credentials: dict = Depends(verify_token)):
                     ($1, $2, 'private')
                     """, credentials["user_id"], key
                 )
+                if key == "searchable": await cache_searchable(r, credentials["user_id"], "private")
             elif permissions[key] not in get_permission_values(key):
                 permissions[key] = "private"
                 await conn.execute(
@@ -68,6 +68,7 @@ async def users_friends_block(credentials: dict = Depends(verify_token)):
                     and permission_key = $2
                     """, credentials["user_id"], key
                 )
+                if key == "searchable": await cache_searchable(r, credentials["user_id"], "private")
 
         return {
             "permissions": permissions
@@ -78,18 +79,14 @@ async def users_friends_block(credentials: dict = Depends(verify_token)):
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
 class PermissionsUpdate(BaseModel):
     key: str
     value: str
 
 @router.post("/permissions/update")
-async def users_friends_block(req: PermissionsUpdate, credentials: dict = Depends(verify_token)):
+async def users_friends_block(req: PermissionsUpdate, credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
     try:
-        conn = await setup_connection()
-
         if req.value not in get_permission_values(req.key):
             raise SafeError(f"value '{req.value}' not allowed for key '{req.key}'")
         
@@ -104,6 +101,8 @@ async def users_friends_block(req: PermissionsUpdate, credentials: dict = Depend
             credentials["user_id"],
             req.key
         )
+        if req.key == "searchable":
+            await cache_searchable(r, credentials["user_id"], req.value)
 
         return {
             "status": "success"
@@ -114,6 +113,4 @@ async def users_friends_block(req: PermissionsUpdate, credentials: dict = Depend
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, HTTPException, Depends
+
+from app.api.routes.auth import verify_token
+from app.api.middleware.database import get_connection, get_redis
+from app.api.middleware.misc import *
+from app.api.middleware.presence import *
+from app.api.middleware.push import publish_to_friends
+
+router = APIRouter()
+
+#? the app sends a heartbeat at least every PRESENCE_TTL_SECS while it is in the foreground,
+#? and goes offline explicitly when backgrounded so friends don't wait out the ttl
+
+@router.post("/presence/heartbeat")
+async def users_presence_heartbeat(credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
+    try:
+        came_online, expired_ids = await mark_online(r, credentials["user_id"])
+        if came_online:
+            await publish_to_friends(conn, r, credentials["user_id"], presence_event(credentials["user_id"], True))
+        #? users whose heartbeats lapsed are only noticed here, tell their friends too
+        for expired_id in expired_ids:
+            await publish_to_friends(conn, r, expired_id, presence_event(expired_id, False))
+
+        return {
+            "status": "online",
+            "ttl_secs": presence_ttl_secs()
+        }
+
+    except SafeError as e:
+        raise e
+    except Exception as e:
+        print(str(e))
+        raise Exception('uncaught error')
+
+@router.post("/presence/offline")
+async def users_presence_offline(credentials: dict = Depends(verify_token), conn = Depends(get_connection), r = Depends(get_redis)):
+    try:
+        if await mark_offline(r, credentials["user_id"]):
+            await publish_to_friends(conn, r, credentials["user_id"], presence_event(credentials["user_id"], False))
+
+        return {
+            "status": "offline"
+        }
+
+    except SafeError as e:
+        raise e
+    except Exception as e:
+        print(str(e))
+        raise Exception('uncaught error')
+
+def presence_event(user_id, online: bool) -> dict:
+    return {
+        "type": "presence",
+        "user_id": str(user_id),
+        "online": online
+    }
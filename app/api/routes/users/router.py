@@ -5,6 +5,7 @@ from app.api.routes.users import get_data
 from app.api.routes.users import update_data
 from app.api.routes.users import friends
 from app.api.routes.users import permissions
+from app.api.routes.users import presence
 
 router = APIRouter(prefix="/users")
 
@@ -12,4 +13,5 @@ router.include_router(data_history.router)
 router.include_router(get_data.router)
 router.include_router(update_data.router)
 router.include_router(friends.router)
-router.include_router(permissions.router)
\ No newline at end of file
+router.include_router(permissions.router)
+router.include_router(presence.router)
\ No newline at end of file
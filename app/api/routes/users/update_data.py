@@ -6,7 +6,7 @@ import json
 from datetime import datetime, timezone
 
 from app.api.routes.auth import verify_token
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.misc import *
 from app.api.routes.users.data_history import data_history
 
@@ -23,12 +23,10 @@ class Update(BaseModel):
     bodyfat: Optional[Annotated[float, bodyfat_field]] = None
 
 @router.post("/data/update")
-async def users_weight(req: Update, credentials: dict = Depends(verify_token)):
+async def users_weight(req: Update, credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
     req_json = json.loads(req.model_dump_json())
 
     try:
-        conn = await setup_connection()
-
         for key, value in req_json.items():
             if value is None: continue
             data_map = user_data_tables_map[key]
@@ -43,13 +41,11 @@ async def users_weight(req: Update, credentials: dict = Depends(verify_token)):
 
         return {
             "status": "good",
-            "data_history": await data_history(credentials["user_id"])
+            "data_history": await data_history(conn, credentials["user_id"])
         }
 
     except SafeError as e:
         raise e
     except Exception as e:
         print(str(e))
-        raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
\ No newline at end of file
+        raise Exception('uncaught error')
\ No newline at end of file
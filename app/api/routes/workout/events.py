@@ -0,0 +1,222 @@
+import os
+import json
+import traceback
+
+from app.api.middleware.misc import *
+from app.api.middleware.exercise_muscles import get_muscle_index
+from app.api.routes.users.get_data import fetch_user_data
+from app.api.routes.workout.save import *
+from app.api.routes.stats.history import build_workout_summary, fetch_exercise_names
+
+#? derives every total, record and leaderboard from the raw workouts /workout/save leaves in workout_events
+#? events are claimed with skip locked and marked processed in the same transaction, so each workout is applied once
+
+def worker_settings() -> dict:
+    return {
+        "batch_size": int(os.getenv("WORKOUT_EVENTS_BATCH_SIZE", 100)),
+        "poll_secs": float(os.getenv("WORKOUT_EVENTS_POLL_SECS", 1)),
+        "max_attempts": int(os.getenv("WORKOUT_EVENTS_MAX_ATTEMPTS", 5)),
+    }
+
+async def process_workout_events(conn, r, batch_size: int) -> int:
+    """Processes one batch of pending events, returns how many were claimed."""
+    settings = worker_settings()
+    tx = conn.transaction()
+    await tx.start()
+    try:
+        event_rows = await conn.fetch(
+            """
+            select id, workout_id, user_id
+            from workout_events
+            where processed_at is null
+            and attempts < $2
+            order by created_at
+            limit $1
+            for update skip locked
+            """, batch_size, settings["max_attempts"]
+        )
+        if len(event_rows) == 0:
+            await tx.commit()
+            return 0
+
+        try:
+            async with conn.transaction():
+                updates, exercise_ids, cohorts = await apply_workout_events(conn, r, event_rows)
+        except Exception as e:
+            #? one bad workout should not hold back the rest of the batch
+            print(f"workout event batch failed, retrying one at a time: {e}")
+            updates, exercise_ids, cohorts = [], {}, {}
+            for event_row in event_rows:
+                try:
+                    async with conn.transaction():
+                        event_updates, event_exercise_ids, event_cohorts = await apply_workout_events(conn, r, [event_row])
+                    updates.extend(event_updates)
+                    exercise_ids.update(event_exercise_ids)
+                    cohorts.update(event_cohorts)
+                except Exception as e:
+                    traceback.print_exc()
+                    await conn.execute(
+                        """
+                        update workout_events
+                        set attempts = attempts + 1,
+                            last_error = $2
+                        where id = $1
+                        """, event_row["id"], str(e)
+                    )
+
+        await tx.commit()
+        tx = None
+
+    except Exception as e:
+        if tx: await tx.rollback()
+        raise e
+
+    if len(updates) > 0:
+        await publish_leaderboard_updates(conn, r, updates, exercise_ids, cohorts)
+    return len(event_rows)
+
+async def apply_workout_events(conn, r, event_rows) -> tuple[list[tuple], dict[str, list], dict[str, list]]:
+    workout_ids = [row["workout_id"] for row in event_rows]
+    workouts = await fetch_workouts(conn, workout_ids)
+    muscle_index = await get_muscle_index(conn, r)
+
+    exercise_names = await fetch_exercise_names(
+        conn, {exercise.id for workout in workouts.values() for exercise in workout["exercises"]}
+    )
+
+    user_totals = {}
+    summaries = []
+    for event_row in event_rows:
+        user_id = str(event_row["user_id"])
+        workout = workouts[event_row["workout_id"]]
+        totals = build_totals(workout["exercises"], muscle_index, workout["duration_secs"])
+
+        if user_id not in user_totals:
+            user_totals[user_id] = {
+                "user_data": await fetch_user_data(conn, user_id),
+                "totals": empty_totals(),
+            }
+        merge_totals(user_totals[user_id]["totals"], totals)
+
+        #? records compare against the rows earlier workouts in the batch just wrote
+        await update_exercise_records(conn, user_id, workout["exercises"], user_totals[user_id]["user_data"])
+        await update_user_rep_maxes(conn, user_id, workout["exercises"], workout["started_at"])
+        await update_muscle_days(conn, user_id, build_muscle_day_totals(workout["exercises"], muscle_index), workout["started_at"])
+        await update_previous_stats(conn, event_row["workout_id"], totals)
+        summaries.append((
+            event_row["workout_id"],
+            user_id,
+            workout["started_at"],
+            json.dumps(build_workout_summary(workout, totals, muscle_index, exercise_names)),
+        ))
+
+    await conn.executemany(
+        """
+        insert into workout_summaries
+        (workout_id, user_id, started_at, summary)
+        values
+        ($1, $2, $3, $4::jsonb)
+        on conflict (workout_id) do update
+        set summary = excluded.summary
+        """, summaries
+    )
+
+    cohort_rows = await conn.fetch(cohort_users_query, list(user_totals.keys()))
+    cohorts = {str(row["user_id"]): user_cohorts(cohort_user_data(row)) for row in cohort_rows}
+
+    updates = []
+    exercise_ids = {}
+    for user_id, user in user_totals.items():
+        totals = user["totals"]
+        await update_exercise_totals(conn, user_id, totals)
+        await update_workout_totals(conn, user_id, totals)
+        await update_muscle_totals(conn, user_id, totals)
+        exercise_rows = await update_exercise_leaderboards(conn, user_id, totals)
+        overall_row = await update_overall_leaderboard(conn, user_id, totals)
+
+        updates.extend(leaderboard_updates(user_id, overall_row, exercise_rows, cohorts[user_id]))
+        exercise_ids[user_id] = list(totals["exercise"].keys())
+
+    await conn.execute(
+        """
+        update workout_events
+        set processed_at = now() at time zone 'utc'
+        where id = any($1)
+        """, [row["id"] for row in event_rows]
+    )
+    return updates, exercise_ids, cohorts
+
+async def fetch_workouts(conn, workout_ids) -> dict:
+    rows = await conn.fetch(
+        """
+        select w.id workout_id, w.started_at, w.duration_secs, we.id workout_exercise_id, we.exercise_id,
+            we.order_index exercise_index, wsd.reps, wsd.weight, wsd.num_sets, wsd.set_class
+        from workouts w
+        left join workout_exercises we
+        on we.workout_id = w.id
+        left join workout_set_data wsd
+        on wsd.workout_exercise_id = we.id
+        where w.id = any($1::uuid[])
+        order by w.id, we.order_index, wsd.order_index
+        """, workout_ids
+    )
+
+    workouts = {}
+    for row in rows:
+        workout = workouts.setdefault(row["workout_id"], {
+            "started_at": row["started_at"],
+            "duration_secs": row["duration_secs"],
+            "exercises": {},
+            "workout_exercise_ids": {},
+        })
+        if row["exercise_id"] is None: continue
+        exercise = workout["exercises"].setdefault(
+            row["exercise_index"],
+            Exercise(id=str(row["exercise_id"]), set_data=[])
+        )
+        workout["workout_exercise_ids"][row["exercise_index"]] = row["workout_exercise_id"]
+        if row["reps"] is None: continue
+        exercise.set_data.append(SetData(
+            reps=row["reps"],
+            weight=row["weight"],
+            num_sets=row["num_sets"],
+            set_class=row["set_class"],
+        ))
+
+    for workout in workouts.values():
+        workout["exercises"] = list(workout["exercises"].values())
+        workout["workout_exercise_ids"] = list(workout["workout_exercise_ids"].values())
+    return workouts
+
+def empty_totals() -> dict:
+    return {
+        "workout": {
+            "volume": 0,
+            "num_sets": 0,
+            "reps": 0,
+            "num_exercises": 0,
+            "num_workouts": 0,
+            "duration": 0,
+            "duration_mins": 0,
+        },
+        "exercise": {},
+        "group": {},
+        "target": {}
+    }
+
+def merge_totals(into: dict, totals: dict):
+    for key, value in totals["workout"].items():
+        into["workout"][key] += value
+
+    for key in ["exercise", "group", "target"]:
+        for total_id, total in totals[key].items():
+            if total_id not in into[key]:
+                into[key][total_id] = dict(total)
+                continue
+            for column, value in total.items():
+                into[key][total_id][column] += value
+
+async def drain_workout_events(conn, r):
+    batch_size = worker_settings()["batch_size"]
+    while await process_workout_events(conn, r, batch_size) > 0:
+        pass
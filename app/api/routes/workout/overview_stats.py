@@ -1,7 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from fastapi.responses import JSONResponse
+from typing import Optional
 
-from app.api.middleware.database import setup_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import *
@@ -9,101 +10,96 @@ from app.api.middleware.misc import *
 router = APIRouter()
 
 @router.get("/overview/stats")
-async def workout_overview_stats(credentials: dict = Depends(verify_token)):
-    workouts = []
-
+async def workout_overview_stats(
+    before: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    credentials: dict = Depends(verify_token),
+    conn = Depends(get_connection)
+):
     try:
-        conn = await setup_connection()
-
-        workout_rows = await conn.fetch(
-            """
-            select *
-            from workouts
-            where user_id = $1
-            order by started_at desc
-            """, credentials["user_id"]
+        before_started_at, before_id = parse_cursor(before)
+        rows = await conn.fetch(
+            overview_stats_query, credentials["user_id"], before_started_at, before_id, limit
         )
-
-        for workout_row in workout_rows:
-            totals = {
-                "volume": 0,
-                "num_sets":  0,
-                "reps": 0,
-            }
-            muscles = {}
-
-            total_rows = await conn.fetch(
-                """
-                select wsd.reps, wsd.weight, wsd.num_sets
-                from workout_set_data wsd
-                inner join workout_exercises we
-                on wsd.workout_exercise_id = we.id
-                where we.workout_id = $1
-                """, workout_row["id"]
-            )
-
-            for total_row in total_rows:
-                totals["volume"] += total_row["reps"] * total_row["weight"] * total_row["num_sets"]
-                totals["num_sets"] += total_row["num_sets"]
-                totals["reps"] += total_row["reps"]
-
-            muscle_data_list = await conn.fetch(
-                """
-                select emt.ratio, mt.name target_name, mg.name group_name, wsd.reps, wsd.weight, wsd.num_sets
-                from exercises e
-                inner join exercise_muscle_targets emt
-                on emt.exercise_id = e.id
-                inner join muscle_targets mt
-                on emt.muscle_target_id = mt.id
-                inner join muscle_groups mg
-                on mt.muscle_group_id = mg.id
-                inner join workout_exercises we
-                on we.exercise_id = e.id
-                inner join workout_set_data wsd
-                on wsd.workout_exercise_id = we.id
-                where we.workout_id = $1
-                """, workout_row["id"]
-            )
-
-            for muscle_data in muscle_data_list:
-                group = muscle_data["group_name"]
-                target = muscle_data["target_name"]
-                if group not in muscles.keys():
-                    muscles[group] = {}
-                if target not in muscles[group].keys():
-                    muscles[group][target] = {
-                        "volume": 0,
-                        "num_sets": 0,
-                        "reps": 0
-                    }
-                muscles[group][target]["volume"] += (muscle_data["ratio"] / 10) * muscle_data["reps"] * muscle_data["weight"] * muscle_data["num_sets"]
-                muscles[group][target]["num_sets"] += muscle_data["num_sets"]
-                muscles[group][target]["reps"] += muscle_data["reps"]
-
-            num_exercises = await conn.fetchval(
-                """
-                select count(*)
-                from workout_exercises we
-                where we.workout_id = $1
-                """, workout_row["id"]
-            )
-
-            workouts.append({
-                "started_at": datetime_to_timestamp_ms(workout_row["started_at"]),
-                "duration": workout_row["duration_secs"],
-                "num_exercises": num_exercises,
-                "totals": totals,
-                "muscles": muscles
-            })
+        workout_rows = [row for row in rows if row["group_name"] is None]
+        workouts = assemble_overview_stats(rows)
 
     except SafeError as e:
         raise e
     except Exception as e:
         print(str(e))
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
 
     return {
-        "workouts": workouts
-    }
\ No newline at end of file
+        "workouts": list(workouts.values()),
+        "next": next_cursor(workout_rows, limit, "workout_id")
+    }
+
+#? one row per workout (group_name is null) followed by one row per workout, group and target
+overview_stats_query = """
+    with page as (
+        select id, started_at, duration_secs
+        from workouts
+        where user_id = $1
+        and ($2::timestamptz is null or (started_at, id) < ($2, $3::uuid))
+        order by started_at desc, id desc
+        limit $4
+    ),
+    sets as (
+        select we.workout_id, we.exercise_id, wsd.reps, wsd.num_sets,
+            wsd.reps * wsd.weight::float8 * wsd.num_sets volume
+        from page p
+        inner join workout_exercises we
+        on we.workout_id = p.id
+        inner join workout_set_data wsd
+        on wsd.workout_exercise_id = we.id
+    )
+    select p.id workout_id, p.started_at, p.duration_secs, null group_name, null target_name,
+        (
+            select count(*)
+            from workout_exercises we
+            where we.workout_id = p.id
+        ) num_exercises,
+        coalesce(sum(s.volume), 0) volume,
+        coalesce(sum(s.num_sets), 0) num_sets,
+        coalesce(sum(s.reps), 0) reps
+    from page p
+    left join sets s
+    on s.workout_id = p.id
+    group by p.id, p.started_at, p.duration_secs
+    union all
+    select s.workout_id, null, null, emd.group_name, emd.target_name, null,
+        sum(emd.ratio / 10.0 * s.volume),
+        sum(s.num_sets),
+        sum(s.reps)
+    from sets s
+    inner join exercise_muscle_data emd
+    on emd.exercise_id = s.exercise_id
+    group by s.workout_id, emd.group_name, emd.target_name
+    order by started_at desc nulls last, workout_id desc
+"""
+
+def assemble_overview_stats(rows) -> dict:
+    workouts = {}
+    for row in rows:
+        if row["group_name"] is None:
+            workouts[row["workout_id"]] = {
+                "started_at": datetime_to_timestamp_ms(row["started_at"]),
+                "duration": row["duration_secs"],
+                "num_exercises": row["num_exercises"],
+                "totals": {
+                    "volume": row["volume"],
+                    "num_sets": row["num_sets"],
+                    "reps": row["reps"],
+                },
+                "muscles": {}
+            }
+            continue
+
+        muscles = workouts[row["workout_id"]]["muscles"]
+        muscles.setdefault(row["group_name"], {})[row["target_name"]] = {
+            "volume": row["volume"],
+            "num_sets": row["num_sets"],
+            "reps": row["reps"]
+        }
+    return workouts
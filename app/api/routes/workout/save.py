@@ -5,13 +5,17 @@ from typing import List, Literal
 from datetime import datetime, timezone
 from copy import deepcopy
 import traceback
+import asyncio
 import json
+import os
+from redis.exceptions import RedisError
 
-from app.api.middleware.database import setup_connection, redis_connection
+from app.api.middleware.database import get_connection
 from app.api.middleware.auth_token import *
 from app.api.routes.auth import verify_token
 from app.api.middleware.misc import *
-from app.api.routes.users.get_data import fetch_user_data
+from app.api.middleware.exercise_muscles import exercise_muscles
+from app.api.middleware.push import publish_events
 
 router = APIRouter()
 
@@ -30,17 +34,16 @@ class WorkoutSave(BaseModel):
     start_time: int #? timestamp ms
     duration: int #? ms
 
-# todo update redis with new leaderboard data
 #? bodyweight determined on the client
-@router.post("/save") 
-async def workout_save(req: WorkoutSave, credentials: dict = Depends(verify_token)):
-    conn = tx = None
+#? only the raw workout is written here, totals/records/leaderboards are derived by workout_worker from workout_events
+@router.post("/save")
+async def workout_save(req: WorkoutSave, credentials: dict = Depends(verify_token), conn = Depends(get_connection)):
+    tx = None
     try:
         user_id = credentials["user_id"]
 
         if len(req.exercises) == 0: return
-
-        conn = await setup_connection()
+        check_set_weights(req.exercises)
         tx = conn.transaction()
         await tx.start()
 
@@ -55,30 +58,18 @@ async def workout_save(req: WorkoutSave, credentials: dict = Depends(verify_toke
             """, user_id, start_time, req.duration / 1000
         )
 
-        totals = {
-            "workout": {
-                "volume": 0,
-                "num_sets": 0,
-                "reps": 0,
-            },
-            "group": {},
-            "target": {}
-        }
-
-        user_data = await fetch_user_data(user_id)
-
-        for i, exercise in enumerate(req.exercises):
-            await save_exercise(conn, workout_id, exercise, i)
-            await process_exercise(conn, user_id, exercise, totals)
-            await update_exercise_records(conn, user_id, exercise, user_data)
-
-        await update_workout_totals(conn, user_id, totals, req)
-        await update_muscle_totals(conn, user_id, totals)
-        await update_previous_stats(conn, workout_id, totals, req)
-        await update_overall_leaderboard(conn, user_id, totals, req)
+        await save_exercises(conn, workout_id, req.exercises)
+        await conn.execute(
+            """
+            insert into workout_events
+            (workout_id, user_id)
+            values
+            ($1, $2)
+            """, workout_id, user_id
+        )
 
         await tx.commit()
-    
+
     except SafeError as e:
         if tx: await tx.rollback()
         raise e
@@ -87,106 +78,98 @@ async def workout_save(req: WorkoutSave, credentials: dict = Depends(verify_toke
         if tx: await tx.rollback()
         traceback.print_exc()
         raise Exception('uncaught error')
-    finally:
-        if conn: await conn.close()
     return {}
 
-async def save_exercise(conn, workout_id, exercise: Exercise, index): 
-    workout_exercise_id = await conn.fetchval(
+def check_set_weights(exercises: List[Exercise]):
+    #? the worker multiplies by weight, a set without one would only fail after the save returned
+    for exercise in exercises:
+        for set_data in exercise.set_data:
+            if set_data.weight is not None: continue
+            raise SafeError(f"missing weight for exercise {exercise.id}")
+
+async def save_exercises(conn, workout_id, exercises: List[Exercise]):
+    workout_exercise_rows = await conn.fetch(
         """
         insert into workout_exercises
         (workout_id, exercise_id, order_index)
-        values
-        ($1, $2, $3)
-        returning id
-        """, workout_id, exercise.id, index
+        select $1, *
+        from unnest($2::uuid[], $3::int[])
+        returning id, order_index
+        """,
+        workout_id,
+        [exercise.id for exercise in exercises],
+        list(range(len(exercises)))
     )
+    workout_exercise_ids = {
+        row["order_index"]: row["id"] for row in workout_exercise_rows
+    }
 
-    for j, set_data in enumerate(exercise.set_data):
-        await save_set_data(conn, workout_exercise_id, set_data, j)
+    columns = {
+        "workout_exercise_id": [],
+        "order_index": [],
+        "reps": [],
+        "weight": [],
+        "num_sets": [],
+        "set_class": [],
+    }
+    for i, exercise in enumerate(exercises):
+        for j, set_data in enumerate(exercise.set_data):
+            columns["workout_exercise_id"].append(workout_exercise_ids[i])
+            columns["order_index"].append(j)
+            columns["reps"].append(set_data.reps)
+            columns["weight"].append(set_data.weight)
+            columns["num_sets"].append(set_data.num_sets)
+            columns["set_class"].append(set_data.set_class)
 
-async def save_set_data(conn, workout_exercise_id, set_data: SetData, index):
     await conn.execute(
         """
         insert into workout_set_data
         (workout_exercise_id, order_index, reps, weight, num_sets, set_class)
-        values
-        ($1, $2, $3, $4, $5, $6)
-        """, workout_exercise_id, index, set_data.reps, set_data.weight, set_data.num_sets, set_data.set_class
-    )
-
-async def process_exercise(conn, user_id, exercise: Exercise, totals):
-    group_rows = await conn.fetch(
-        """
-        select distinct on (group_id) ratio, group_id
-        from exercise_muscle_data
-        where exercise_id = $1
-        order by group_id, ratio desc
-        """, exercise.id
-    )
-
-    target_rows = await conn.fetch(
-        """
-        select ratio, target_id
-        from exercise_muscle_data
-        where exercise_id = $1
-        """, exercise.id
+        select *
+        from unnest($1::uuid[], $2::int[], $3::int[], $4::real[], $5::int[], $6::set_class_type[])
+        """, *columns.values()
     )
 
-    exercise_totals = {
-        "volume": 0,
-        "num_sets": 0,
-        "reps": 0,
+def build_totals(exercises: List[Exercise], muscle_index: dict, duration_secs: float) -> dict:
+    totals = {
+        "workout": {
+            "volume": 0,
+            "num_sets": 0,
+            "reps": 0,
+            "num_exercises": len(exercises),
+            "num_workouts": 1,
+            "duration": duration_secs,
+            "duration_mins": duration_secs / 60,
+        },
+        "exercise": {},
+        "group": {},
+        "target": {}
     }
 
-    for set_data in exercise.set_data:
-        process_exercise_sets(set_data, totals, exercise_totals, group_rows, target_rows)
+    for exercise in exercises:
+        rows = exercise_muscles(muscle_index, exercise.id)
 
-    for group_row in group_rows:
-        totals["group"][group_row["group_id"]]["counter"] += 1
+        if exercise.id not in totals["exercise"]:
+            totals["exercise"][exercise.id] = {
+                "volume": 0,
+                "num_sets": 0,
+                "reps": 0,
+                "counter": 0,
+                "num_workouts": 1,
+            }
+        exercise_totals = totals["exercise"][exercise.id]
+        exercise_totals["counter"] += 1
 
-    for target_row in target_rows:
-        totals["target"][target_row["target_id"]]["counter"] += 1
+        for set_data in exercise.set_data:
+            process_exercise_sets(set_data, totals, exercise_totals, rows["group"], rows["target"])
 
-    current_exercise_totals = await conn.fetchrow(
-        """
-        select *
-        from exercise_totals
-        where user_id = $1
-        and exercise_id = $2
-        """, user_id, exercise.id
-    )
-    if current_exercise_totals is None:
-        current_exercise_totals = await conn.fetchrow(
-            """
-            insert into exercise_totals
-            (user_id, exercise_id, volume, num_sets, reps, counter)
-            values
-            ($1, $2, 0.0, 0, 0, 0)
-            returning *
-            """, user_id, exercise.id
-        )
-    
-    await conn.execute(
-        """
-        update exercise_totals
-        set 
-            volume = $1,
-            num_sets = $2,
-            reps = $3,
-            counter = $4
-        where user_id = $5
-        and exercise_id = $6
-        """,
-        current_exercise_totals["volume"] + exercise_totals["volume"],
-        current_exercise_totals["num_sets"] + exercise_totals["num_sets"],
-        current_exercise_totals["reps"] + exercise_totals["reps"],
-        current_exercise_totals["counter"] + 1,
-        user_id,
-        exercise.id
-    )
+        for group_row in rows["group"]:
+            totals["group"][group_row["group_id"]]["counter"] += 1
 
-    await update_exercise_leaderboards(conn, user_id, exercise, exercise_totals)
+        for target_row in rows["target"]:
+            totals["target"][target_row["target_id"]]["counter"] += 1
+
+    return totals
 
 def process_exercise_sets(set_data, totals, exercise_totals, group_rows, target_rows):
     empty_totals = {
@@ -220,13 +203,60 @@ def process_exercise_sets(set_data, totals, exercise_totals, group_rows, target_
         totals["target"][target_row["target_id"]]["num_sets"] += set_data.num_sets
         totals["target"][target_row["target_id"]]["reps"] += set_data.reps
 
-async def update_exercise_records(conn, user_id, exercise, user_data):
+#? /home/muscles-history counts the full set volume against each muscle, a set counts once per group however many of its targets it hits
+def build_muscle_day_totals(exercises: List[Exercise], muscle_index: dict) -> dict:
+    day_totals = {
+        "group": {},
+        "target": {}
+    }
+    for exercise in exercises:
+        rows = exercise_muscles(muscle_index, exercise.id)
+        for set_data in exercise.set_data:
+            volume = set_data.reps * set_data.weight * set_data.num_sets
+            for key, muscle_rows in [("group", rows["group"]), ("target", rows["target"])]:
+                for muscle_row in muscle_rows:
+                    muscle_totals = day_totals[key].setdefault(muscle_row[f"{key}_id"], {
+                        "volume": 0,
+                        "num_sets": 0,
+                        "reps": 0
+                    })
+                    muscle_totals["volume"] += volume
+                    muscle_totals["num_sets"] += set_data.num_sets
+                    muscle_totals["reps"] += set_data.reps
+    return day_totals
+
+def totals_columns(totals: dict, keys: list[str]) -> list[list]:
+    return [list(totals.keys())] + [
+        [total[key] for total in totals.values()] for key in keys
+    ]
+
+async def update_exercise_totals(conn, user_id, totals):
+    await conn.execute(
+        """
+        insert into exercise_totals
+        (user_id, exercise_id, volume, num_sets, reps, counter)
+        select $1, *
+        from unnest($2::uuid[], $3::real[], $4::int[], $5::int[], $6::int[])
+        on conflict (user_id, exercise_id) do update
+        set
+            volume = exercise_totals.volume + excluded.volume,
+            num_sets = exercise_totals.num_sets + excluded.num_sets,
+            reps = exercise_totals.reps + excluded.reps,
+            counter = exercise_totals.counter + excluded.counter
+        """,
+        user_id,
+        *totals_columns(totals["exercise"], ["volume", "num_sets", "reps", "counter"])
+    )
+
+async def update_exercise_records(conn, user_id, exercises: List[Exercise], user_data):
     temp_maxes = {}
-    for set_data in exercise.set_data:
-        temp_max = temp_maxes.get(set_data.reps, 0)
-        if set_data.weight <= temp_max: continue
-        temp_maxes[set_data.reps] = set_data.weight
-    
+    for exercise in exercises:
+        exercise_maxes = temp_maxes.setdefault(exercise.id, {})
+        for set_data in exercise.set_data:
+            temp_max = exercise_maxes.get(set_data.reps, 0)
+            if set_data.weight <= temp_max: continue
+            exercise_maxes[set_data.reps] = set_data.weight
+
     age_tol = 0.25
     weight_tol = 0.1
     height_tol = 0.1
@@ -235,14 +265,14 @@ async def update_exercise_records(conn, user_id, exercise, user_data):
         select *
         from exercise_records
         where user_id = $1
-        and exercise_id = $2
+        and exercise_id = any($2::uuid[])
         and abs(age - $3) <= $4
         and ped_status = $5
         and abs(height - $6) <= $7
         and abs(user_weight - $8) <= $9
-        """, 
-        user_id, 
-        exercise.id,
+        """,
+        user_id,
+        list(temp_maxes.keys()),
         user_data["age"],
         age_tol,
         user_data["ped_status"],
@@ -251,48 +281,51 @@ async def update_exercise_records(conn, user_id, exercise, user_data):
         user_data["weight"],
         weight_tol
     )
-    
+
     curr_maxes = {}
     curr_row_ids = {}
     for row in rows:
-        temp_max = curr_maxes.get(row["reps"], 0)
+        key = (str(row["exercise_id"]), row["reps"])
+        temp_max = curr_maxes.get(key, 0)
         if row["weight"] <= temp_max: continue
-        curr_maxes[row["reps"]] = row["weight"]
-        curr_row_ids[row["reps"]] = row["id"]
+        curr_maxes[key] = row["weight"]
+        curr_row_ids[key] = row["id"]
 
     new_maxes = {}
     old_row_ids = []
-    for rep, weight in temp_maxes.items():
-        if rep not in curr_maxes.keys():
-            new_maxes[rep] = weight
-            continue
-        elif curr_maxes[rep] <= weight:
-            continue
+    for exercise_id, exercise_maxes in temp_maxes.items():
+        for rep, weight in exercise_maxes.items():
+            key = (exercise_id, rep)
+            if key not in curr_maxes.keys():
+                new_maxes[key] = weight
+                continue
+            elif weight <= curr_maxes[key]:
+                continue
 
-        new_maxes[rep] = weight
-        old_row_ids.append(curr_row_ids[rep])
+            new_maxes[key] = weight
+            old_row_ids.append(curr_row_ids[key])
+
+    if len(new_maxes) == 0: return
 
     try:
-        tx = conn.transaction() 
-        await tx.start()
+        await conn.execute(
+            """
+            insert into exercise_records
+            (user_id, exercise_id, reps, weight, age, ped_status, height, user_weight)
+            select $1, *, $5, $6, $7, $8
+            from unnest($2::uuid[], $3::int[], $4::real[])
+            """,
+            user_id,
+            [key[0] for key in new_maxes.keys()],
+            [key[1] for key in new_maxes.keys()],
+            list(new_maxes.values()),
+            user_data["age"],
+            user_data["ped_status"],
+            user_data["height"],
+            user_data["weight"],
+        )
 
-        for reps, weight in new_maxes.items():
-            await conn.execute(
-                """
-                insert into exercise_records
-                (user_id, exercise_id, reps, weight, age, ped_status, height, user_weight)
-                values
-                ($1, $2, $3, $4, $5, $6, $7, $8)
-                """,
-                user_id,
-                exercise.id,
-                reps,
-                weight,
-                user_data["age"],
-                user_data["ped_status"],
-                user_data["height"],
-                user_data["weight"],
-            )
+        if len(old_row_ids) == 0: return
 
         await conn.execute(
             """
@@ -302,271 +335,277 @@ async def update_exercise_records(conn, user_id, exercise, user_data):
             """, old_row_ids
         )
 
-        await tx.commit()
-
     except Exception as e:
         print(e)
-        if tx: await tx.rollback()
         raise SafeError("error updating exercise_records")
 
-async def update_workout_totals(conn, user_id, totals, req):
-    current_totals = await conn.fetchrow(
+#? best weight per rep count, overall and per day, so /exercises/history reads prs without scanning every set
+#? a tie keeps the earliest achieved_at, events are not always processed in workout order
+async def update_user_rep_maxes(conn, user_id, exercises: List[Exercise], achieved_at):
+    workout_maxes = {}
+    for exercise in exercises:
+        for set_data in exercise.set_data:
+            key = (exercise.id, set_data.reps)
+            if key in workout_maxes and set_data.weight <= workout_maxes[key]: continue
+            workout_maxes[key] = set_data.weight
+
+    if len(workout_maxes) == 0: return
+
+    columns = [
+        user_id,
+        [key[0] for key in workout_maxes.keys()],
+        [key[1] for key in workout_maxes.keys()],
+        list(workout_maxes.values()),
+        achieved_at,
+    ]
+    await conn.execute(
         """
-        select *
-        from workout_totals
-        where user_id = $1
-        """, user_id
+        insert into user_rep_maxes
+        (user_id, exercise_id, reps, weight, achieved_at)
+        select $1, *, $5
+        from unnest($2::uuid[], $3::int[], $4::real[])
+        on conflict (user_id, exercise_id, reps) do update
+        set
+            weight = excluded.weight,
+            achieved_at = excluded.achieved_at
+        where excluded.weight > user_rep_maxes.weight
+        or (excluded.weight = user_rep_maxes.weight and excluded.achieved_at < user_rep_maxes.achieved_at)
+        """, *columns
+    )
+    await conn.execute(
+        """
+        insert into user_rep_max_days
+        (user_id, exercise_id, reps, weight, achieved_at, day)
+        select $1, *, $5, ($5::timestamptz at time zone 'utc')::date
+        from unnest($2::uuid[], $3::int[], $4::real[])
+        on conflict (user_id, exercise_id, reps, day) do update
+        set
+            weight = excluded.weight,
+            achieved_at = excluded.achieved_at
+        where excluded.weight > user_rep_max_days.weight
+        or (excluded.weight = user_rep_max_days.weight and excluded.achieved_at < user_rep_max_days.achieved_at)
+        """, *columns
     )
 
-    if current_totals == None:
-        current_totals = await conn.fetchrow(
-            """
-            insert into workout_totals
-            (user_id, volume, num_sets, reps, duration, num_workouts, num_exercises)
-            values
-            ($1, 0.0, 0, 0, 0.0, 0, 0)
-            returning *
-            """, user_id
+async def update_muscle_days(conn, user_id, day_totals, started_at):
+    for key in ["group", "target"]:
+        if len(day_totals[key]) == 0: continue
+        await conn.execute(
+            f"""
+            insert into user_muscle_{key}_days
+            (user_id, day, muscle_{key}_id, volume, num_sets, reps)
+            select $1, ($2::timestamptz at time zone 'utc')::date, *
+            from unnest($3::uuid[], $4::real[], $5::int[], $6::int[])
+            on conflict (user_id, day, muscle_{key}_id) do update
+            set
+                volume = user_muscle_{key}_days.volume + excluded.volume,
+                num_sets = user_muscle_{key}_days.num_sets + excluded.num_sets,
+                reps = user_muscle_{key}_days.reps + excluded.reps
+            """,
+            user_id,
+            started_at,
+            *totals_columns(day_totals[key], ["volume", "num_sets", "reps"])
         )
 
+async def update_workout_totals(conn, user_id, totals):
     await conn.execute(
         """
-        update workout_totals
+        insert into workout_totals
+        (user_id, volume, num_sets, reps, duration, num_workouts, num_exercises)
+        values
+        ($1, $2, $3, $4, $5, $6, $7)
+        on conflict (user_id) do update
         set
-            volume = $1,
-            num_sets = $2,
-            reps = $3,
-            duration = $4,
-            num_workouts = $5,
-            num_exercises = $6
-        where user_id = $7
-        """, 
-        current_totals["volume"] + totals["workout"]["volume"],
-        current_totals["num_sets"] + totals["workout"]["num_sets"],
-        current_totals["reps"] + totals["workout"]["reps"],
-        current_totals["duration"] + req.duration / 1000,
-        current_totals["num_workouts"] + 1,
-        current_totals["num_exercises"] + len(req.exercises),
-        user_id
+            volume = workout_totals.volume + excluded.volume,
+            num_sets = workout_totals.num_sets + excluded.num_sets,
+            reps = workout_totals.reps + excluded.reps,
+            duration = workout_totals.duration + excluded.duration,
+            num_workouts = workout_totals.num_workouts + excluded.num_workouts,
+            num_exercises = workout_totals.num_exercises + excluded.num_exercises
+        """,
+        user_id,
+        totals["workout"]["volume"],
+        totals["workout"]["num_sets"],
+        totals["workout"]["reps"],
+        totals["workout"]["duration"],
+        totals["workout"]["num_workouts"],
+        totals["workout"]["num_exercises"],
     )
 
 async def update_muscle_totals(conn, user_id, totals):
     for key in ["group", "target"]:
         muscle_totals = totals["group"] if key == "group" else totals["target"]
-        for muscle_id, muscle_total in muscle_totals.items():
-            current_muscle_totals = await conn.fetchrow(
-                f"""
-                select *
-                from workout_muscle_{key}_totals
-                where user_id = $1
-                and muscle_{key}_id = $2
-                """, user_id, muscle_id
-            )
-
-            if current_muscle_totals == None:
-                current_muscle_totals = await conn.fetchrow(
-                    f"""
-                    insert into workout_muscle_{key}_totals
-                    (user_id, muscle_{key}_id, volume, num_sets, reps, counter)
-                    values
-                    ($1, $2, 0.0, 0, 0, 0)
-                    returning *
-                    """, user_id, muscle_id
-                )
-
-            await conn.execute(
-                f"""
-                update workout_muscle_{key}_totals
-                set
-                    volume = $1,
-                    num_sets = $2,
-                    reps = $3,
-                    counter = $4
-                where user_id = $5
-                and muscle_{key}_id = $6
-                """,
-                current_muscle_totals["volume"] + muscle_total["volume"],
-                current_muscle_totals["num_sets"] + muscle_total["num_sets"],
-                current_muscle_totals["reps"] + muscle_total["reps"],
-                current_muscle_totals["counter"] + muscle_total["counter"],
-                user_id,
-                muscle_id
-            )
+        if len(muscle_totals) == 0: continue
+        await conn.execute(
+            f"""
+            insert into workout_muscle_{key}_totals
+            (user_id, muscle_{key}_id, volume, num_sets, reps, counter)
+            select $1, *
+            from unnest($2::uuid[], $3::real[], $4::int[], $5::int[], $6::int[])
+            on conflict (user_id, muscle_{key}_id) do update
+            set
+                volume = workout_muscle_{key}_totals.volume + excluded.volume,
+                num_sets = workout_muscle_{key}_totals.num_sets + excluded.num_sets,
+                reps = workout_muscle_{key}_totals.reps + excluded.reps,
+                counter = workout_muscle_{key}_totals.counter + excluded.counter
+            """,
+            user_id,
+            *totals_columns(muscle_totals, ["volume", "num_sets", "reps", "counter"])
+        )
 
-async def update_previous_stats(conn, workout_id, totals, req: WorkoutSave):
+async def update_previous_stats(conn, workout_id, totals):
     await conn.execute(
         """
         insert into previous_workout_stats
         (workout_id, volume, num_sets, reps, num_exercises)
         values
         ($1, $2, $3, $4, $5)
-        """, workout_id, totals["workout"]["volume"], totals["workout"]["num_sets"], totals["workout"]["reps"], len(req.exercises)
+        """, workout_id, totals["workout"]["volume"], totals["workout"]["num_sets"], totals["workout"]["reps"], totals["workout"]["num_exercises"]
     )
 
-    for group_id, group_total in totals["group"].items():
-        await conn.execute(
-            """
-            insert into previous_workout_muscle_group_stats
-            (workout_id, muscle_group_id, volume, num_sets, reps)
-            values
-            ($1, $2, $3, $4, $5)
-            """, workout_id, group_id, group_total["volume"], group_total["num_sets"], group_total["reps"]
-        )
-
-    for target_id, target_total in totals["target"].items():
+    for key in ["group", "target"]:
+        muscle_totals = totals["group"] if key == "group" else totals["target"]
+        if len(muscle_totals) == 0: continue
         await conn.execute(
-            """
-            insert into previous_workout_muscle_target_stats
-            (workout_id, muscle_target_id, volume, num_sets, reps)
-            values
-            ($1, $2, $3, $4, $5)
-            """, workout_id, target_id, target_total["volume"], target_total["num_sets"], target_total["reps"]
+            f"""
+            insert into previous_workout_muscle_{key}_stats
+            (workout_id, muscle_{key}_id, volume, num_sets, reps)
+            select $1, *
+            from unnest($2::uuid[], $3::real[], $4::int[], $5::int[])
+            """,
+            workout_id,
+            *totals_columns(muscle_totals, ["volume", "num_sets", "reps"])
         )
 
-async def update_overall_leaderboard(conn, user_id, totals, req: WorkoutSave):
-    current = await conn.fetchrow(
+async def update_overall_leaderboard(conn, user_id, totals):
+    return await conn.fetchrow(
         """
-        select *
-        from overall_leaderboard
-        where user_id = $1
-        """, user_id
+        insert into overall_leaderboard
+        (user_id, volume, num_sets, reps, num_exercises, num_workouts, duration_mins)
+        values
+        ($1, $2, $3, $4, $5, $6, $7)
+        on conflict (user_id) do update
+        set
+            volume = overall_leaderboard.volume + excluded.volume,
+            num_sets = overall_leaderboard.num_sets + excluded.num_sets,
+            reps = overall_leaderboard.reps + excluded.reps,
+            num_exercises = overall_leaderboard.num_exercises + excluded.num_exercises,
+            num_workouts = overall_leaderboard.num_workouts + excluded.num_workouts,
+            duration_mins = overall_leaderboard.duration_mins + excluded.duration_mins,
+            last_updated = now() at time zone 'utc'
+        returning *
+        """,
+        user_id,
+        totals["workout"]["volume"],
+        totals["workout"]["num_sets"],
+        totals["workout"]["reps"],
+        totals["workout"]["num_exercises"],
+        totals["workout"]["num_workouts"],
+        totals["workout"]["duration_mins"],
     )
 
-    if current is None:
-        current = await conn.fetchrow(
-            """
-            insert into overall_leaderboard
-            (user_id, volume, num_sets, reps, num_exercises, num_workouts, duration_mins)
-            values
-            ($1, $2, $3, $4, $5, $6, $7)
-            returning *
-            """, user_id, 0.0, 0, 0, 0, 0, 0
-        )
-
-    volume = current["volume"] + totals["workout"]["volume"]
-    num_sets = current["num_sets"] + totals["workout"]["num_sets"]
-    reps = current["reps"] + totals["workout"]["reps"]
-    num_exercises = current["num_exercises"] + len(req.exercises)
-    num_workouts = current["num_workouts"] + 1
-    duration_mins = current["duration_mins"] + req.duration / 1000 / 60
-
-    await conn.execute(
+async def update_exercise_leaderboards(conn, user_id, totals):
+    #? an exercise logged twice in one workout still counts as one workout
+    return await conn.fetch(
         """
-        update overall_leaderboard
+        insert into exercises_leaderboard
+        (user_id, exercise_id, volume, num_sets, reps, num_workouts)
+        select $1, *
+        from unnest($2::uuid[], $3::real[], $4::int[], $5::int[], $6::int[])
+        on conflict (user_id, exercise_id) do update
         set
-            volume = $1,
-            num_sets = $2,
-            reps = $3,
-            num_exercises = $4,
-            num_workouts = $5,
-            duration_mins = $6,
+            volume = exercises_leaderboard.volume + excluded.volume,
+            num_sets = exercises_leaderboard.num_sets + excluded.num_sets,
+            reps = exercises_leaderboard.reps + excluded.reps,
+            num_workouts = exercises_leaderboard.num_workouts + excluded.num_workouts,
             last_updated = now() at time zone 'utc'
-        where user_id = $7
+        returning *
         """,
-        volume,
-        num_sets,
-        reps,
-        num_exercises,
-        num_workouts,
-        duration_mins,
         user_id,
+        *totals_columns(totals["exercise"], ["volume", "num_sets", "reps", "num_workouts"])
     )
 
-    r = await redis_connection()
+def leaderboard_updates(user_id, overall_row, exercise_rows, cohorts: list[str]) -> list[tuple]:
+    updates = [
+        (overall_zset_name(metric, cohort), user_id, overall_row[column])
+        for metric, column in overall_column_map.items()
+        for cohort in [None] + cohorts
+    ]
+    for row in exercise_rows:
+        for metric, column in exercise_column_map.items():
+            updates.append(
+                (exercise_zset_name(exercise_id=row["exercise_id"], metric=metric), user_id, row[column])
+            )
+    return updates
 
-    metric_map = {
-        "volume": volume,
-        "sets": num_sets,
-        "reps": reps,
-        "exercises": num_exercises,
-        "workouts": num_workouts,
-        "duration": duration_mins,
+def leaderboard_retry_settings() -> dict:
+    return {
+        "attempts": int(os.getenv("LEADERBOARD_REDIS_ATTEMPTS", 3)),
+        "backoff_secs": float(os.getenv("LEADERBOARD_REDIS_BACKOFF_SECS", 0.05)),
     }
-    for metric, value in metric_map.items():
-        await r.zadd(
-            overall_zset_name(metric),
-            {user_id: value}
-        )
 
-    # data_map = {
-    #     "overall:volume:leaderboard": volume,
-    #     "overall:sets:leaderboard": num_sets,
-    #     "overall:reps:leaderboard": reps,
-    #     "overall:exercises:leaderboard": num_exercises,
-    #     "overall:workouts:leaderboard": num_workouts,
-    #     "overall:duration:leaderboard": duration_mins,
-    # }
-    # for key, value in data_map.items():
-    #     await r.zadd(key, {
-    #         user_id: value
-    #     })
-
-    # todo add to user specific leaderboard catagories (gender, weight, etc)
-    # todo bucket ends have no overlap i.e. 18-21, 21-24, ...
-    # gender -> 3 catagories
-    # age -> <18, 18-22, 22-26, 26-30, ..., >50
-    # weight -> <40, 40-50, 50-60, ..., >150
-    # height -> <120, 120-125, 125-130, ..., >220
-    # bodyfat -> <5, 5-10, 10-15, ..., >40
-
-async def update_exercise_leaderboards(conn, user_id, exercise: Exercise, exercise_totals):
-    current = await conn.fetchrow(
-        """
-        select *
-        from exercises_leaderboard
-        where user_id = $1
-        and exercise_id = $2
-        """, user_id, exercise.id
-    )
-
-    if current is None:
-        current = await conn.fetchrow(
-            """
-            insert into exercises_leaderboard
-            (user_id, exercise_id, volume, num_sets, reps, num_workouts)
-            values
-            ($1, $2, $3, $4, $5, $6)
-            returning *
-            """, user_id, exercise.id, 0.0, 0, 0, 0
-        )
+#? overall zset -> metric, the only boards a "your rank changed" event is sent for
+rank_event_zsets = {overall_zset_name(metric): metric for metric in overall_column_map.keys()}
+
+async def apply_leaderboard_updates(r, updates: list[tuple], cohorts: dict[str, list]) -> list[tuple]:
+    """Returns (user_id, rank event) for every overall rank the updates moved."""
+    user_ids = list(cohorts.keys())
+    previous_cohorts = dict(zip(user_ids, await r.hmget(cohorts_key, user_ids))) if len(user_ids) > 0 else {}
+    ranked = list(dict.fromkeys((zset, member) for zset, member, _ in updates if zset in rank_event_zsets))
+
+    pipe = r.pipeline(transaction=True)
+    for zset, member in ranked:
+        pipe.zrevrank(zset, member)
+    for zset, member, score in updates:
+        #? totals only grow, gt keeps a slower save from writing back an older total over a newer one
+        pipe.zadd(zset, {member: score}, gt=True)
+    for user_id, new_cohorts in cohorts.items():
+        #? body stats moved the user into a new bucket, drop them from the old one
+        for cohort in set((previous_cohorts[user_id] or "").split(",")) - set(new_cohorts) - {""}:
+            for metric in overall_column_map.keys():
+                pipe.zrem(overall_zset_name(metric, cohort), user_id)
+        pipe.hset(cohorts_key, user_id, ",".join(new_cohorts))
+    for zset, member in ranked:
+        pipe.zrevrank(zset, member)
+    results = await pipe.execute()
+
+    rank_events = []
+    previous_ranks, ranks = results[:len(ranked)], results[len(results) - len(ranked):]
+    for (zset, member), previous_rank, rank in zip(ranked, previous_ranks, ranks):
+        if previous_rank == rank: continue
+        rank_events.append((member, {
+            "type": "rank",
+            "metric": rank_event_zsets[zset],
+            "rank": rank + 1,
+            "previous_rank": previous_rank + 1 if previous_rank is not None else None
+        }))
+    return rank_events
+
+#? runs after commit so a rolled back save never reaches redis
+#? if redis stays down the users are parked in leaderboard_outbox, sync_redis re-reads their rows from postgres
+async def publish_leaderboard_updates(conn, r, updates: list[tuple], exercise_ids: dict[str, list], cohorts: dict[str, list]):
+    settings = leaderboard_retry_settings()
+    for attempt in range(settings["attempts"]):
+        try:
+            rank_events = await apply_leaderboard_updates(r, updates, cohorts)
+        except RedisError as e:
+            print(f"leaderboard update attempt {attempt + 1} failed: {e}")
+            if attempt + 1 < settings["attempts"]:
+                await asyncio.sleep(settings["backoff_secs"] * 2 ** attempt)
+            continue
 
-    volume = current["volume"] + exercise_totals["volume"]
-    num_sets = current["num_sets"] + exercise_totals["num_sets"]
-    reps = current["reps"] + exercise_totals["reps"]
-    num_workouts = current["num_workouts"] + 1
+        #? the zsets are already written, a lost rank event is not worth a replay
+        try:
+            await publish_events(r, rank_events)
+        except RedisError as e:
+            print(f"rank events not published: {e}")
+        return
 
-    await conn.execute(
+    await conn.executemany(
         """
-        update exercises_leaderboard
-        set
-            volume = $1,
-            num_sets = $2,
-            reps = $3,
-            num_workouts = $4,
-            last_updated = now() at time zone 'utc'
-        where user_id = $5
-        """,
-        volume,
-        num_sets,
-        reps,
-        num_workouts,
-        user_id,
+        insert into leaderboard_outbox
+        (user_id, exercise_ids)
+        values
+        ($1, $2)
+        """, list(exercise_ids.items())
     )
-
-    r = await redis_connection()
-
-    metrics = {
-        "volume": volume, 
-        "sets": num_sets, 
-        "reps": reps, 
-        "workouts": num_workouts
-    }
-    for metric, value in metrics.items():
-        leaderboard = exercise_zset_name(
-            exercise_id=exercise.id, 
-            metric=metric
-        )
-        await r.zadd(
-            leaderboard, 
-            {user_id: value}
-        )
\ No newline at end of file
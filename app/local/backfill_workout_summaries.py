@@ -0,0 +1,73 @@
+import asyncio
+import os
+import json
+from dotenv import load_dotenv
+
+from ..api.middleware.database import setup_connection
+from ..api.middleware.exercise_muscles import load_muscle_index
+from ..api.routes.stats.history import build_workout_summary, fetch_exercise_names
+from ..api.routes.workout.events import fetch_workouts
+from ..api.routes.workout.save import build_totals
+
+load_dotenv(override=True)
+
+#? python -m app.local.backfill_workout_summaries
+#? summarises workouts that have no workout_summaries row, safe to re-run
+
+batch_size = 500
+
+async def main():
+    if input(f"Backfill workout summaries in {os.environ['ENVIRONMENT']}? [y/n] ").lower() != 'y': return
+
+    conn = None
+    try:
+        conn = await setup_connection()
+        muscle_index = await load_muscle_index(conn)
+
+        num_workouts = 0
+        while True:
+            rows = await conn.fetch(
+                """
+                select w.id, w.user_id
+                from workouts w
+                left join workout_summaries ws
+                on ws.workout_id = w.id
+                where ws.workout_id is null
+                limit $1
+                """, batch_size
+            )
+            if len(rows) == 0: break
+
+            workouts = await fetch_workouts(conn, [row["id"] for row in rows])
+            exercise_names = await fetch_exercise_names(
+                conn, {exercise.id for workout in workouts.values() for exercise in workout["exercises"]}
+            )
+
+            summaries = []
+            for row in rows:
+                workout = workouts[row["id"]]
+                totals = build_totals(workout["exercises"], muscle_index, workout["duration_secs"])
+                summaries.append((
+                    row["id"],
+                    row["user_id"],
+                    workout["started_at"],
+                    json.dumps(build_workout_summary(workout, totals, muscle_index, exercise_names)),
+                ))
+
+            await conn.executemany(
+                """
+                insert into workout_summaries
+                (workout_id, user_id, started_at, summary)
+                values
+                ($1, $2, $3, $4::jsonb)
+                on conflict (workout_id) do nothing
+                """, summaries
+            )
+            num_workouts += len(summaries)
+            print(f"summarised {num_workouts} workouts")
+
+    finally:
+        if conn: await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,274 @@
+import gc
+import random
+import time
+import uuid
+from copy import deepcopy
+from datetime import datetime, timezone, timedelta
+from statistics import median
+
+from ..api.middleware.misc import *
+from ..api.routes.exercises.history import *
+
+#? python -m app.local.benchmark_exercise_history
+#? no database needed, rows are generated in the shape the /exercises/history cursor returns
+#? the legacy_* functions are the per-row python builders the numpy columns replaced, outputs are checked equal
+#? n rep maxes are read from user_rep_maxes now, so they are not part of the comparison
+
+num_years = 5
+workouts_per_week = 4
+set_rows_per_workout = 5
+num_runs = 5
+max_points = 500
+
+def main():
+    rows = build_rows()
+    print(f"{len(rows)} set rows over {num_years} years, median of {num_runs} runs")
+
+    legacy_results, legacy_ms = time_stages(legacy_history, rows)
+    results, numpy_ms = time_stages(numpy_history, rows)
+    assert comparable(results) == comparable(legacy_results), "numpy history does not match legacy history"
+
+    for stage in legacy_ms.keys():
+        print(f"{stage:>16}: legacy {legacy_ms[stage]:>8.2f} ms, numpy {numpy_ms[stage]:>8.2f} ms ({legacy_ms[stage] / numpy_ms[stage]:.1f}x)")
+
+    aggregates = history_aggregates(rows)
+    points, downsampled_ms = time_runs(lambda: list(reps_sets_weight_points(aggregates, max_points)))
+    print(f"reps_sets_weight at max_points={max_points}: {downsampled_ms:.2f} ms, {len(points)} of {len(results['reps_sets_weight'])} points")
+
+def time_runs(func) -> tuple:
+    latencies = []
+    for _ in range(num_runs):
+        start = time.perf_counter()
+        result = func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return result, median(latencies)
+
+def time_stages(history_func, rows) -> tuple:
+    latencies = {}
+    for _ in range(num_runs):
+        result = {}
+        for stage, func in history_func(rows).items():
+            #? like timeit, keep collector pauses from whatever the other run left alive out of the numbers
+            gc.disable()
+            start = time.perf_counter()
+            result[stage] = func()
+            latencies.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+            gc.enable()
+    return result, {stage: median(stage_latencies) for stage, stage_latencies in latencies.items()}
+
+def comparable(result) -> dict:
+    #? timespan buckets are measured from now, which moves between the two runs
+    result = deepcopy(result)
+    for timespan in result["volume"]["timespan"].values():
+        for point in timespan["graph"]:
+            point.pop("x")
+    return result
+
+def build_rows() -> list[dict]:
+    rows = []
+    now = datetime.now(tz=timezone.utc).replace(microsecond=0)
+    num_workouts = num_years * 52 * workouts_per_week
+    for i in range(num_workouts):
+        started_at = now - timedelta(days=i * 7 / workouts_per_week, hours=random.randint(0, 12))
+        workout_id = uuid.uuid4()
+        for j in range(set_rows_per_workout):
+            rows.append({
+                "workout_id": workout_id,
+                "reps": random.randint(1, 15),
+                "weight": random.randint(8, 120) * 2.5,
+                "num_sets": random.randint(1, 5),
+                "set_order_index": j,
+                "started_at": started_at,
+            })
+    return rows
+
+def workouts(rows) -> list[list]:
+    workout_rows = {}
+    for row in rows:
+        workout_rows.setdefault(row["workout_id"], []).append(row)
+    return list(workout_rows.values())
+
+def history_aggregates(rows) -> HistoryAggregates:
+    aggregates = HistoryAggregates()
+    for workout in workouts(rows):
+        aggregates.add_workout(workout)
+    return aggregates
+
+def numpy_history(rows) -> dict:
+    """Stages in the order the route runs them, each workout is added to the aggregates as its history item is built."""
+    aggregates = HistoryAggregates()
+
+    def history():
+        history = []
+        for workout in workouts(rows):
+            aggregates.add_workout(workout)
+            history.append(build_history_item(workout))
+        return history
+
+    return {
+        "history": history,
+        "reps_sets_weight": lambda: list(reps_sets_weight_points(aggregates)),
+        "volume": lambda: {
+            "workout": build_volume_workout(aggregates),
+            "timespan": build_volume_timespan(aggregates)
+        },
+    }
+
+def legacy_history(rows) -> dict:
+    return {
+        "history": lambda: legacy_build_history(rows),
+        "reps_sets_weight": lambda: legacy_build_reps_sets_weight(rows),
+        "volume": lambda: {
+            "workout": legacy_build_volume_workout(rows),
+            "timespan": legacy_build_volume_timespan(rows)
+        },
+    }
+
+#####################################################
+### Legacy
+
+def legacy_build_volume_workout(rows):
+    volume_data = legacy_volume_per_workout(rows)
+
+    volume = deepcopy(emptyBaseData)
+    volume["table"]["headers"] = ["volume", "date"]
+    for data in volume_data.values():
+        volume["graph"].append({
+            "x": data["timestamp"],
+            "y": data["volume"]
+        })
+        volume["table"]["rows"].append({
+            "volume": data["volume"],
+            "date": data["timestamp"]
+        })
+
+    volume["graph"] = legacy_sort_timeseries(volume["graph"], "x")
+    volume["table"]["rows"] = legacy_sort_timeseries(volume["table"]["rows"], "date", True)
+
+    return volume
+
+def legacy_build_volume_timespan(rows):
+    volume_data = legacy_volume_per_workout(rows)
+
+    timespan_data = {}    
+    now_ms = datetime.now(tz=timezone.utc).timestamp() * 1000
+    for timespan in ["week","month","3_months","6_months","year"]:  
+        timespan_ms = timespan_to_ms(timespan)
+        bucket_data = {}
+        for workout_data in volume_data.values():
+            bucket = int((now_ms - workout_data["timestamp"]) / timespan_ms)
+            if bucket not in bucket_data:
+                bucket_data[bucket] = 0
+            bucket_data[bucket] += workout_data["volume"]
+        timespan_data[timespan] = dict(sorted(bucket_data.items()))
+
+    volume_timespan = {}
+    for timespan, bucket_data in timespan_data.items():
+        timespan_ms = timespan_to_ms(timespan)
+        temp_data = deepcopy(emptyBaseData)
+        temp_data["table"]["headers"] = ["volume", "dates"]
+        for bucket, volume in bucket_data.items():
+            upper_timestamp = now_ms - bucket * timespan_ms
+            lower_timestamp = now_ms - (bucket + 1) * timespan_ms
+
+            temp_data["graph"].append({
+                "x": upper_timestamp,
+                "y": volume
+            })
+            temp_data["table"]["rows"].append({
+                "volume": volume,
+                "dates": f"{timestamp_ms_to_date_str(lower_timestamp)}-{timestamp_ms_to_date_str(upper_timestamp)}"
+            })
+
+        volume_timespan[timespan] = temp_data
+
+    return volume_timespan
+
+def legacy_volume_per_workout(rows):
+    volume_data = {}
+    for row in rows:
+        if row["workout_id"] not in volume_data:
+            volume_data[row["workout_id"]] = {
+                "volume": 0,
+                "timestamp": datetime_to_timestamp_ms(row["started_at"])
+            }
+        volume_data[row["workout_id"]]["volume"] += row["reps"] * row["weight"] * row["num_sets"]
+    return volume_data
+
+def legacy_build_history(rows):
+    workout_rows = {}
+    for row in rows:
+        workout_rows.setdefault(row["workout_id"], []).append(row)
+    history = [legacy_build_history_item(rows) for rows in workout_rows.values()]
+    return sorted(history, key=lambda e: e["started_at"], reverse=True)
+
+def legacy_build_history_item(workout_rows):
+    """History of one workout, its rows in set order."""
+    history_item = {
+        "graph": {
+            "weight_per_set": [],
+            "volume_per_set": [],
+            "weight_per_rep": [],
+        },
+        "table": {
+            "headers": ["reps", "weight", "sets"],
+            "rows": []
+        },
+        "started_at": date_to_timestamp_ms(workout_rows[0]["started_at"]),
+    }
+
+    graph = history_item["graph"]
+    for row in workout_rows:
+        prev_set_idx = 0 if len(graph["weight_per_set"]) == 0 else graph["weight_per_set"][-1]["x"]
+        for i in range(row["num_sets"]):
+            graph["weight_per_set"].append({
+                "x": prev_set_idx + i + 1,
+                "y": row["weight"]
+            })
+
+            graph["volume_per_set"].append({
+                "x": prev_set_idx + i + 1,
+                "y": row["reps"] * row["weight"] * row["num_sets"]
+            })
+
+            prev_rep_idx = 0 if len(graph["weight_per_rep"]) == 0 else graph["weight_per_rep"][-1]["x"]
+            for j in range(row["reps"]):
+                graph["weight_per_rep"].append({
+                    "x": prev_rep_idx + j + 1,
+                    "y": row["weight"]
+                })
+        
+        history_item["table"]["rows"].append({
+            "reps": row["reps"],
+            "weight": row["weight"],
+            "sets": row["num_sets"]
+        })
+    
+    return history_item
+
+def legacy_build_reps_sets_weight(rows):
+    return list(legacy_reps_sets_weight_points(rows))
+
+def legacy_reps_sets_weight_points(rows):
+    reps = 0
+    num_sets = 0
+    for row in rows:
+        for _ in range(row["num_sets"]):
+            for _ in range(row["reps"]):
+                yield {
+                    "x": reps,
+                    "y": row["weight"],
+                    "z": num_sets
+                }
+                reps += 1
+            num_sets += 1
+
+def legacy_sort_timeseries(data, key, convert_timestamp=False):
+    series = sorted(data, key=lambda e: e[key], reverse=True)
+    if not convert_timestamp: return series
+    for elem in series:
+        elem[key] = timestamp_ms_to_date_str(elem[key])
+    return series
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import asyncio
+import os
+import random
+import time
+from statistics import median
+from dotenv import load_dotenv
+
+from ..api.middleware.database import setup_connection
+from ..api.middleware.misc import *
+from ..api.routes.users.get_data import fetch_user_data
+from ..api.routes.workout.save import *
+from ..api.middleware.exercise_muscles import load_muscle_index
+
+load_dotenv(override=True)
+
+#? python -m app.local.benchmark_workout_save
+#? every run happens inside a rolled back transaction, nothing is persisted
+#? bulk_save replays what workout_worker derives for a single workout event
+
+num_exercises = 10
+sets_per_exercise = 4
+num_runs = 20
+
+class CountingConnection:
+    """Wraps an asyncpg connection and counts statements sent to the server."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.conn, name)
+        if name not in ["execute", "executemany", "fetch", "fetchrow", "fetchval", "copy_records_to_table"]:
+            return attr
+
+        async def counted(*args, **kwargs):
+            self.round_trips += 1
+            return await attr(*args, **kwargs)
+        return counted
+
+async def main():
+    try:
+        conn = await setup_connection()
+
+        user_id = await conn.fetchval(
+            """
+            select id
+            from users
+            where is_verified
+            limit 1
+            """
+        )
+        if user_id is None: raise Exception("no verified user to benchmark with")
+        user_id = str(user_id)
+
+        exercise_rows = await conn.fetch(
+            """
+            select id
+            from exercises
+            where user_id is null
+            """
+        )
+        exercise_ids = [str(row["id"]) for row in exercise_rows]
+
+        results = {}
+        for name, save_func in [("legacy", legacy_save), ("bulk", bulk_save)]:
+            round_trips = []
+            latencies = []
+            for _ in range(num_runs):
+                req = build_request(exercise_ids)
+                counting_conn = CountingConnection(conn)
+                tx = conn.transaction()
+                await tx.start()
+                start = time.perf_counter()
+                try:
+                    await save_func(counting_conn, user_id, req)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    round_trips.append(counting_conn.round_trips)
+                finally:
+                    await tx.rollback()
+            results[name] = (median(round_trips), median(latencies))
+
+        print(f"{num_exercises} exercises x {sets_per_exercise} sets, median of {num_runs} runs ({os.environ['ENVIRONMENT']})")
+        for name, (round_trips, latency) in results.items():
+            print(f"{name:>8}: {round_trips:>5.0f} round trips, {latency:>8.2f} ms")
+
+    finally:
+        if conn: await conn.close()
+
+def build_request(exercise_ids) -> WorkoutSave:
+    return WorkoutSave(
+        exercises=[
+            Exercise(
+                id=exercise_id,
+                set_data=[
+                    SetData(
+                        reps=random.randint(3, 15),
+                        weight=random_weight(),
+                        num_sets=random.randint(1, 5),
+                        set_class="working"
+                    )
+                    for _ in range(sets_per_exercise)
+                ]
+            )
+            for exercise_id in random.sample(exercise_ids, num_exercises)
+        ],
+        start_time=now_timestamp_ms(),
+        duration=60 * 60 * 1000
+    )
+
+async def bulk_save(conn, user_id, req: WorkoutSave):
+    workout_id = await conn.fetchval(
+        """
+        insert into workouts
+        (user_id, started_at, duration_secs)
+        values
+        ($1, now(), $2)
+        returning id;
+        """, user_id, req.duration / 1000
+    )
+
+    user_data = await fetch_user_data(conn, user_id)
+    muscle_index = await load_muscle_index(conn)
+    totals = build_totals(req.exercises, muscle_index, req.duration / 1000)
+
+    await save_exercises(conn, workout_id, req.exercises)
+    await update_exercise_totals(conn, user_id, totals)
+    await update_exercise_records(conn, user_id, req.exercises, user_data)
+    await update_workout_totals(conn, user_id, totals)
+    await update_muscle_totals(conn, user_id, totals)
+    await update_previous_stats(conn, workout_id, totals)
+    #? redis is written after commit, these runs roll back so only the postgres side is measured
+    await update_exercise_leaderboards(conn, user_id, totals)
+    await update_overall_leaderboard(conn, user_id, totals)
+
+async def legacy_save(conn, user_id, req: WorkoutSave):
+    """Replays the statement pattern of the per-row save path this pipeline replaced."""
+    workout_id = await conn.fetchval(
+        """
+        insert into workouts
+        (user_id, started_at, duration_secs)
+        values
+        ($1, now(), $2)
+        returning id;
+        """, user_id, req.duration / 1000
+    )
+    user_data = await fetch_user_data(conn, user_id)
+
+    for i, exercise in enumerate(req.exercises):
+        workout_exercise_id = await conn.fetchval(
+            """
+            insert into workout_exercises
+            (workout_id, exercise_id, order_index)
+            values
+            ($1, $2, $3)
+            returning id
+            """, workout_id, exercise.id, i
+        )
+        for j, set_data in enumerate(exercise.set_data):
+            await conn.execute(
+                """
+                insert into workout_set_data
+                (workout_exercise_id, order_index, reps, weight, num_sets, set_class)
+                values
+                ($1, $2, $3, $4, $5, $6)
+                """, workout_exercise_id, j, set_data.reps, set_data.weight, set_data.num_sets, set_data.set_class
+            )
+
+        await conn.fetch(
+            """
+            select distinct on (group_id) ratio, group_id
+            from exercise_muscle_data
+            where exercise_id = $1
+            order by group_id, ratio desc
+            """, exercise.id
+        )
+        await conn.fetch(
+            """
+            select ratio, target_id
+            from exercise_muscle_data
+            where exercise_id = $1
+            """, exercise.id
+        )
+
+        for table in ["exercise_totals", "exercises_leaderboard"]:
+            await conn.fetchrow(
+                f"""
+                select *
+                from {table}
+                where user_id = $1
+                and exercise_id = $2
+                """, user_id, exercise.id
+            )
+            await conn.execute(
+                f"""
+                update {table}
+                set reps = reps
+                where user_id = $1
+                and exercise_id = $2
+                """, user_id, exercise.id
+            )
+
+        await conn.fetch(
+            """
+            select *
+            from exercise_records
+            where user_id = $1
+            and exercise_id = $2
+            and ped_status = $3
+            """, user_id, exercise.id, user_data["ped_status"]
+        )
+        await conn.execute(
+            """
+            delete
+            from exercise_records
+            where id = any($1)
+            """, []
+        )
+
+    for table in ["workout_totals", "overall_leaderboard"]:
+        await conn.fetchrow(f"select * from {table} where user_id = $1", user_id)
+        await conn.execute(f"update {table} set reps = reps where user_id = $1", user_id)
+
+    muscle_ids = await conn.fetch(
+        """
+        select distinct group_id, target_id
+        from exercise_muscle_data
+        where exercise_id = any($1::uuid[])
+        """, [exercise.id for exercise in req.exercises]
+    )
+    await conn.execute(
+        """
+        insert into previous_workout_stats
+        (workout_id, volume, num_sets, reps, num_exercises)
+        values
+        ($1, 0, 0, 0, $2)
+        """, workout_id, len(req.exercises)
+    )
+    for key in ["group", "target"]:
+        for muscle_id in {row[f"{key}_id"] for row in muscle_ids}:
+            await conn.fetchrow(
+                f"""
+                select *
+                from workout_muscle_{key}_totals
+                where user_id = $1
+                and muscle_{key}_id = $2
+                """, user_id, muscle_id
+            )
+            await conn.execute(
+                f"""
+                update workout_muscle_{key}_totals
+                set reps = reps
+                where user_id = $1
+                and muscle_{key}_id = $2
+                """, user_id, muscle_id
+            )
+            await conn.execute(
+                f"""
+                insert into previous_workout_muscle_{key}_stats
+                (workout_id, muscle_{key}_id, volume, num_sets, reps)
+                values
+                ($1, $2, 0, 0, 0)
+                """, workout_id, muscle_id
+            )
+
+if __name__ == "__main__":
+    asyncio.run(main())
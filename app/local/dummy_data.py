@@ -10,7 +10,9 @@ from datetime import datetime, timedelta
 import uuid
 
 from ..main import app
-from ..api.middleware.database import setup_connection
+from ..api.middleware.database import setup_connection, redis_connection
+from ..api.middleware.friend_graph import insert_friendship, invalidate_friend_sets
+from ..api.middleware.presence import mark_online
 from ..tests.test_workout_save import build_workouts, save_workouts
 from ..api.middleware.auth_token import generate_token
 from ..api.middleware.misc import *
@@ -24,6 +26,7 @@ async def main():
     only_test_user = input(f"Update only test user data? [y/n] ") == 'y'
     try:
         conn = await setup_connection()
+        r = await redis_connection()
 
         test_user_id = '31fbaa9c-a0f2-45f5-835b-aa2d80d68892'
         # test_user_id = 'df23687a-c71f-436d-b720-ea1ccd3ea977'
@@ -195,29 +198,10 @@ async def main():
 
         for user_id in user_ids:
             if random.random() < 0.25: continue
-            await conn.execute(
-                """
-                insert into friends
-                (user1_id, user2_id)
-                values
-                ($1, $2)
-                """,
-                test_user_id,
-                user_id
-            )
-            await conn.execute(
-                """
-                insert into online_users
-                (user_id, is_online)
-                values
-                ($1, $2)
-                on conflict (user_id) 
-                do update
-                set is_online = $2
-                """,
-                user_id,
-                random.random() < 0.5
-            )
+            await insert_friendship(conn, test_user_id, user_id)
+            await invalidate_friend_sets(r, test_user_id, user_id)
+            if random.random() < 0.5:
+                await mark_online(r, user_id)
 
 
 
@@ -5,7 +5,8 @@ from dotenv import load_dotenv
 from copy import deepcopy
 
 from ..api.middleware.database import *
-from ..api.middleware.database import setup_connection
+from ..api.middleware.database import setup_connection, redis_connection
+from ..api.middleware.exercise_muscles import bump_muscle_index_version
 from .existing_users_db import check_totals
 
 load_dotenv(override=True)
@@ -50,6 +51,7 @@ async def update(exercises):
         )
 
         await tx.commit()
+        await bump_muscle_index_version(conn, await redis_connection())
 
     except Exception as e:
         if tx: await tx.rollback()
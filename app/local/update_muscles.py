@@ -3,7 +3,8 @@ import asyncio
 import os
 from dotenv import load_dotenv
 
-from ..api.middleware.database import setup_connection
+from ..api.middleware.database import setup_connection, redis_connection
+from ..api.middleware.exercise_muscles import bump_muscle_index_version
 from .existing_users_db import check_totals
 
 load_dotenv(override=True)
@@ -69,6 +70,7 @@ async def update(muscles_json: dict):
             )
 
         await tx.commit()
+        await bump_muscle_index_version(conn, await redis_connection())
 
     except Exception as e:
         if tx: await tx.rollback()
@@ -3,21 +3,41 @@ from dotenv import load_dotenv
 
 load_dotenv(override=True)
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends
 from fastapi.responses import JSONResponse
 
 from app.api.routes.register import router as register_router
 from app.api.routes import auth
+from app.api.routes.auth import verify_token
 from app.api.routes.workout import router as workout_router
 from app.api.routes import muscles
 from app.api.routes.users import router as users_router
 from app.api.routes.exercises import router as exercises_router
 from app.api.routes.stats import router as stats_router
 from app.api.routes.home import router as home_router
+from app.api.routes import push
 
 from app.api.middleware.misc import SafeError
+from app.api.middleware.database import create_pool, close_pool, create_redis_pool, close_redis_pool, get_pool_stats, setup_connection, acquire_connection, redis_connection
+from app.api.middleware.exercise_muscles import get_muscle_index, start_muscle_index_listener, stop_muscle_index_listener
+from app.api.middleware.push import start_push_listener, stop_push_listener
 
-app = FastAPI(title="Gym Tracker API")
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await create_pool()
+    await create_redis_pool()
+    await start_muscle_index_listener(await setup_connection())
+    async with acquire_connection() as conn:
+        await get_muscle_index(conn, await redis_connection())
+    await start_push_listener(await redis_connection())
+    yield
+    await stop_push_listener()
+    await stop_muscle_index_listener()
+    await close_pool()
+    await close_redis_pool()
+
+app = FastAPI(title="Gym Tracker API", lifespan=lifespan)
 
 @app.exception_handler(SafeError)
 async def safe_error_handler(_, exc: SafeError):
@@ -41,6 +61,12 @@ async def generic_error_handler(_, exc: Exception):
 async def root():
     return JSONResponse(content={"message": "OK"}, status_code=200)
 
+@app.get("/metrics/pool")
+async def pool_metrics_route(credentials: dict = Depends(verify_token)):
+    return {
+        "pool": get_pool_stats()
+    }
+
 app.include_router(register_router.router)
 app.include_router(auth.router)
 app.include_router(exercises_router.router)
@@ -49,6 +75,7 @@ app.include_router(muscles.router)
 app.include_router(users_router.router)
 app.include_router(stats_router.router)
 app.include_router(home_router.router)
+app.include_router(push.router)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,44 @@
+import pytest
+from fastapi.testclient import TestClient
+from uuid import uuid4
+
+from ..main import app
+from ..api.middleware.auth_token import generate_token
+from ..api.middleware.database import acquire_connection, get_pool, get_pool_stats, pool_metrics, redis_connection
+
+client = TestClient(app)
+
+@pytest.mark.asyncio
+async def test_pool_acquire():
+    acquired = pool_metrics["acquired"]
+
+    async with acquire_connection() as conn:
+        assert await conn.fetchval("select 1") == 1
+        stats = get_pool_stats()
+        assert stats["in_use"] >= 1
+        assert 0 < stats["saturation"] <= 1
+
+    assert pool_metrics["acquired"] == acquired + 1
+
+    pool = await get_pool()
+    assert pool is await get_pool()
+    assert pool.get_max_size() == get_pool_stats()["max_size"]
+
+def test_pool_metrics_route():
+    response = client.get("/metrics/pool")
+    assert response.status_code in [401, 403]
+
+    headers = {
+        "Authorization": f"Bearer {generate_token('test@pytest.com', str(uuid4()), minutes=5)}"
+    }
+    response = client.get("/metrics/pool", headers=headers)
+    assert response.status_code == 200
+    for key in ["acquired", "timeouts", "wait_ms_avg", "wait_ms_max", "size", "idle", "in_use", "max_size", "saturation"]:
+        assert key in response.json()["pool"]
+
+@pytest.mark.asyncio
+async def test_redis_shared_pool():
+    r1 = await redis_connection()
+    r2 = await redis_connection()
+    assert r1.connection_pool is r2.connection_pool
+    assert await r1.ping()
@@ -0,0 +1,18 @@
+import numpy as np
+
+from ..api.middleware.downsample import lttb_indices
+
+def test_lttb_indices():
+    x = np.arange(1000)
+    y = np.sin(x / 30)
+    y[500] = 10
+
+    indices = lttb_indices(x, y, 50)
+    assert len(indices) == 50
+    assert indices[0] == 0 and indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+    assert 500 in indices
+
+    assert lttb_indices(x[:10], y[:10], 50).tolist() == list(range(10))
+    assert lttb_indices(x[:10], y[:10], None).tolist() == list(range(10))
+    assert lttb_indices(x, y, 2).tolist() == [0, 999]
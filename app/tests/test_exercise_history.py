@@ -10,7 +10,7 @@ from ..api.middleware.auth_token import decode_token
 from ..tests.test_workout_save import build_workouts, save_workouts
 from ..api.middleware.database import setup_connection
 from ..api.middleware.misc import datetime_to_timestamp_ms
-from ..api.routes.exercises.history import timespan_to_ms
+from ..api.routes.exercises.history import timespan_to_ms, HistoryAggregates, reps_sets_weight_points
 
 client = TestClient(app)
 
@@ -285,26 +285,27 @@ def check_n_rep_max_all_time_data(set_data_list, resp_all_time):
         assert resp_all_time["graph"][i]["y"] == data["weight"]
 
 def check_n_rep_max_history_data(set_data_list, resp_history):
+    #? one point per utc day, the heaviest set that day and the earliest workout on a tie
     n_rep_max_history_data = {}
     for set_data in set_data_list:
         if set_data["reps"] not in n_rep_max_history_data.keys():
             n_rep_max_history_data[set_data["reps"]] = {}
         rep_data = n_rep_max_history_data[set_data["reps"]]
-        timestamp = set_data["timestamp"]
+        day = datetime.fromtimestamp(set_data["timestamp"] / 1000, tz=timezone.utc).date()
 
-        curr_max = rep_data.get(timestamp, -math.inf)
-        if curr_max > set_data["weight"]: continue
-        rep_data[timestamp] = set_data["weight"]
+        curr = rep_data.get(day, {"weight": -math.inf, "timestamp": math.inf})
+        if (curr["weight"], -curr["timestamp"]) >= (set_data["weight"], -set_data["timestamp"]): continue
+        rep_data[day] = {
+            "weight": set_data["weight"],
+            "timestamp": set_data["timestamp"]
+        }
 
     n_rep_max_history = {}
-    for rep, weight_data in n_rep_max_history_data.items():
+    for rep, day_data in n_rep_max_history_data.items():
         if rep not in n_rep_max_history:
             n_rep_max_history[rep] = []
-        for timestamp, weight in weight_data.items():
-            n_rep_max_history[rep].append({
-                "weight": weight,
-                "timestamp": timestamp
-            })
+        for data in day_data.values():
+            n_rep_max_history[rep].append(data)
 
     for rep, weight_data in n_rep_max_history.items():
         n_rep_max_history[rep] = sorted(weight_data, key=lambda e: e["timestamp"], reverse=True)
@@ -426,3 +427,28 @@ def build_history(exercise_id, workouts):
     assert len(history) > 0
     return history
 
+
+def test_reps_sets_weight_points():
+    started_at = datetime.now(tz=timezone.utc)
+    aggregates = HistoryAggregates()
+    for i in range(40):
+        aggregates.add_workout([
+            {"reps": 8, "weight": 20.0 + i, "num_sets": 3, "started_at": started_at},
+            {"reps": 1, "weight": 100.0 + i, "num_sets": 1, "started_at": started_at},
+        ])
+
+    points = list(reps_sets_weight_points(aggregates))
+    assert len(points) == 40 * (8 * 3 + 1)
+    assert points[:2] == [{"x": 0, "y": 20.0, "z": 0}, {"x": 1, "y": 20.0, "z": 0}]
+    assert points[8] == {"x": 8, "y": 20.0, "z": 1}
+    assert points[24] == {"x": 24, "y": 100.0, "z": 3}
+
+    #? downsampled points are picked from the full series, peaks and both ends survive
+    downsampled = list(reps_sets_weight_points(aggregates, 50))
+    assert len(downsampled) == 50
+    assert all(point in points for point in downsampled)
+    assert downsampled[0] == points[0] and downsampled[-1] == points[-1]
+    assert sum(point["y"] >= 100 for point in downsampled) >= 20
+
+    assert list(reps_sets_weight_points(HistoryAggregates(), 50)) == []
+    assert aggregates.volume_per_workout()[1].tolist()[:2] == [8 * 20.0 * 3 + 100.0, 8 * 21.0 * 3 + 101.0]
@@ -4,6 +4,8 @@ from copy import deepcopy
 import json
 from datetime import datetime, timezone, timedelta
 import math
+from uuid import uuid4
+from decimal import Decimal
 
 from ..main import app
 from ..api.middleware.auth_token import decode_token
@@ -11,7 +13,7 @@ from ..tests.test_workout_save import build_workouts, save_workouts
 from ..api.middleware.database import setup_connection
 from ..api.middleware.misc import datetime_to_timestamp_ms
 from ..api.routes.exercises.history import timespan_to_ms
-from ..api.routes.exercises.list_all import get_days_past
+from ..api.routes.exercises.list_all import get_days_past, encode_with_etag
 
 client = TestClient(app)
 
@@ -103,3 +105,53 @@ def test_days_past():
     assert get_days_past(now_utc - timedelta(days=5)) == 5
     assert get_days_past(now_utc - timedelta(days=30)) == 30
 
+
+def test_exercise_list_etag(delete_users, create_user):
+    headers = {
+        "Authorization": f"Bearer {create_user}"
+    }
+
+    response = client.get("exercises/list/all", headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    response = client.get("exercises/list/all", headers=headers | {"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = client.get("exercises/list/all", headers=headers | {"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+    assert response.headers["etag"] == etag
+
+@pytest.mark.asyncio
+async def test_exercise_list_etag_with_workouts(delete_users, create_user):
+    headers = {
+        "Authorization": f"Bearer {create_user}"
+    }
+
+    try:
+        conn = await setup_connection()
+        workouts = await build_workouts(conn, 3, 5, recent=True)
+        await save_workouts(workouts, headers)
+
+        response = client.get("exercises/list/all", headers=headers)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        muscle_data = [exercise["muscle_data"] for exercise in response.json()["exercises"] if exercise["muscle_data"] != []]
+        assert muscle_data != []
+        assert isinstance(muscle_data[0][0]["group_id"], str)
+
+        response = client.get("exercises/list/all", headers=headers | {"If-None-Match": etag})
+        assert response.status_code == 304
+
+    finally:
+        if conn: await conn.close()
+
+def test_encode_with_etag():
+    group_id = uuid4()
+    content, etag = encode_with_etag({"group_id": group_id, "volume": Decimal("12.5"), "frequency": {3: Decimal("1")}})
+    assert content == {"group_id": str(group_id), "volume": 12.5, "frequency": {3: 1.0}}
+
+    same_content, same_etag = encode_with_etag({"frequency": {3: Decimal("1")}, "volume": Decimal("12.5"), "group_id": group_id})
+    assert same_etag == etag
+    assert encode_with_etag({"group_id": uuid4()})[1] != etag
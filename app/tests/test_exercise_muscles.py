@@ -0,0 +1,29 @@
+import pytest
+
+from ..api.middleware.database import acquire_connection, redis_connection
+from ..api.middleware.exercise_muscles import *
+
+@pytest.mark.asyncio
+async def test_muscle_index_reload():
+    r = await redis_connection()
+    async with acquire_connection() as conn:
+        index = await get_muscle_index(conn, r)
+        assert index is await get_muscle_index(conn, r)
+
+        exercise_id = await conn.fetchval(
+            """
+            select exercise_id
+            from exercise_muscle_data
+            limit 1
+            """
+        )
+        muscles = exercise_muscles(index, exercise_id)
+        assert len(muscles["target"]) > 0
+        group_ids = {target["group_id"] for target in muscles["target"]}
+        assert {group["group_id"] for group in muscles["group"]} == group_ids
+
+        await bump_muscle_index_version(conn, r)
+        invalidate_muscle_index()
+        assert index is not await get_muscle_index(conn, r)
+
+    assert exercise_muscles(index, "00000000-0000-0000-0000-000000000000") == {"group": [], "target": []}
@@ -0,0 +1,53 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from ..main import app
+from ..api.middleware.auth_token import decode_token
+from ..api.middleware.database import acquire_connection, redis_connection
+from ..api.middleware.friend_graph import *
+from .test_user_search import register_user
+
+client = TestClient(app)
+
+@pytest.mark.asyncio
+async def test_friend_graph(delete_users, create_user):
+    r = await redis_connection()
+    headers = {
+        "Authorization": f"Bearer {create_user}"
+    }
+    user_id = decode_token(create_user)["user_id"]
+
+    friend_headers = register_user("graphFriend", "public")
+    friend_id = decode_token(friend_headers["Authorization"].split(" ")[1])["user_id"]
+    client.post("/users/request/send", headers=headers, json={"target_id": friend_id})
+    response = client.post("/users/request/accept", headers=friend_headers, json={"requestor_id": user_id})
+    assert response.json()["status"] == "accepted"
+
+    async with acquire_connection() as conn:
+        rows = await conn.fetch("select user1_id, user2_id from friends")
+        assert [(str(row["user1_id"]), str(row["user2_id"])) for row in rows] == [tuple(sorted([user_id, friend_id]))]
+        assert await friendship_exists(conn, r, friend_id, user_id)
+
+        assert await fetch_friend_ids(conn, r, user_id) == {friend_id}
+        assert await fetch_friend_ids(conn, r, friend_id) == {user_id}
+        assert await r.ttl(friends_key(user_id)) > 0
+
+    #? a flushed or evicted set is loaded back from postgres
+    await r.delete(friends_key(user_id))
+    response = client.get("/home/online-friends", headers=headers)
+    assert response.json()["data"]["has_friends"] == True
+
+    response = client.get("/users/friends/all", headers=headers)
+    assert response.json()["friends"] == [{"user_id": friend_id, "username": "graphFriend"}]
+
+    response = client.post("/users/friends/unfriend", headers=friend_headers, json={"target_id": user_id})
+    assert response.status_code == 200
+
+    async with acquire_connection() as conn:
+        assert not await friendship_exists(conn, r, user_id, friend_id)
+        assert await fetch_friend_ids(conn, r, user_id) == set()
+        assert await fetch_friend_ids(conn, r, friend_id) == set()
+    response = client.get("/home/online-friends", headers=headers)
+    assert response.json()["data"]["has_friends"] == False
+    response = client.get("/users/friends/all", headers=headers)
+    assert response.json()["friends"] == []
@@ -1,3 +1,17 @@
+import pytest
+from fastapi.testclient import TestClient
+from uuid import uuid4
+
+from ..main import app
+from ..api.middleware.auth_token import decode_token
+from ..api.middleware.database import setup_connection, redis_connection
+from ..api.middleware.misc import *
+from ..api.routes.workout.save import apply_leaderboard_updates, leaderboard_updates
+from ..api.routes.stats.leaderboard import fetch_rank_data, rank_positions, request_cohort, record_zset_name, record_cache_ttl_secs, cache_record_zset, record_empty_key, zset_exists
+from .conftest import valid_user
+
+client = TestClient(app)
+
 # import pytest
 # from fastapi.testclient import TestClient
 # from copy import deepcopy
@@ -322,4 +336,246 @@
 #             "username": username
 #         })
 #     user_data.reverse()
-#     return user_data
\ No newline at end of file
+#     return user_data
+
+def test_rank_positions():
+    assert rank_positions(0, 5) == []
+    assert rank_positions(3, 5) == [0, 1, 2]
+    assert rank_positions(5, 5) == [0, 1, 2, 3, 4]
+    assert rank_positions(10, 0) == []
+    assert rank_positions(10, 1) == [9]
+    assert rank_positions(10, 2) == [0, 9]
+    assert rank_positions(101, 5) == [0, 25, 50, 75, 100]
+    for count in [6, 37, 1000]:
+        positions = rank_positions(count, 5)
+        assert len(positions) == 5
+        assert positions[0] == 0 and positions[-1] == count - 1
+
+@pytest.mark.asyncio
+async def test_fetch_rank_data():
+    r = await redis_connection()
+    zset = f"test:{uuid4()}:leaderboard"
+    #? "b" and "c" tie, redis orders equal scores by member
+    scores = {"a": 1, "b": 2, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7, "i": 8}
+    await r.zadd(zset, scores)
+
+    def rank_data_ids(rank_data) -> list[str]:
+        return [item["user_id"] for item in rank_data]
+
+    def marked(rank_data) -> list[str]:
+        return [item["user_id"] for item in rank_data if item["showVerticalLine"]]
+
+    async def rank_data_for(user_id, zset=zset) -> list[dict]:
+        #? the arguments leaderboard_data passes
+        return await fetch_rank_data(r, user_id, zset, 3, await r.zcard(zset), await r.zrevrank(zset, user_id))
+
+    try:
+        #? unranked, only the quantiles
+        rank_data = await rank_data_for("unranked")
+        assert rank_data_ids(rank_data) == ["a", "e", "i"]
+        assert marked(rank_data) == []
+        assert [item["value"] for item in rank_data] == [1, 4, 8]
+
+        #? tied user between quantiles is added in score order
+        rank_data = await rank_data_for("c")
+        assert rank_data_ids(rank_data) == ["a", "c", "e", "i"]
+        assert marked(rank_data) == ["c"]
+        assert rank_data[1]["value"] == 2
+
+        #? top and bottom are always quantiles, never listed twice
+        for user_id in ["i", "a"]:
+            rank_data = await rank_data_for(user_id)
+            assert rank_data_ids(rank_data) == ["a", "e", "i"]
+            assert marked(rank_data) == [user_id]
+
+        assert await rank_data_for("a", f"test:{uuid4()}:leaderboard") == []
+    finally:
+        await r.delete(zset)
+
+def test_bucket_label():
+    bounds = cohort_buckets["age"]
+    assert bucket_label(17.9, bounds) == "0-18"
+    assert bucket_label(18, bounds) == "18-22"
+    assert bucket_label(21.99, bounds) == "18-22"
+    assert bucket_label(22, bounds) == "22-26"
+    assert bucket_label(49.9, bounds) == "46-50"
+    assert bucket_label(50, bounds) == "50+"
+    assert bucket_label(0, cohort_buckets["weight"]) == "0-40"
+    assert bucket_label(150, cohort_buckets["weight"]) == "150+"
+
+def test_cohort_labels():
+    assert cohort_labels("gender") == ["male", "female", "other"]
+    for key, bounds in cohort_buckets.items():
+        labels = cohort_labels(key)
+        assert len(labels) == len(bounds) + 1
+        assert len(set(labels)) == len(labels)
+        for value in [0, *bounds, bounds[-1] + 100]:
+            assert bucket_label(value, bounds) in labels
+
+def test_user_cohorts():
+    user_data = {
+        "gender": "female",
+        "age": 25.5,
+        "weight": 60,
+        "height": 165.2,
+        "bodyfat": 22,
+    }
+    assert user_cohorts(user_data) == [
+        "gender:female",
+        "age:22-26",
+        "weight:60-70",
+        "height:165-170",
+        "bodyfat:20-25",
+        "gender:female:age:22-26",
+        "gender:female:weight:60-70",
+        "gender:female:height:165-170",
+        "gender:female:bodyfat:20-25",
+    ]
+    assert set(user_cohorts(user_data)) <= set(all_cohorts())
+
+    #? no body stats logged, only the cohorts the user has data for
+    user_data |= {"weight": None, "bodyfat": None}
+    assert user_cohorts(user_data) == [
+        "gender:female",
+        "age:22-26",
+        "height:165-170",
+        "gender:female:age:22-26",
+        "gender:female:height:165-170",
+    ]
+    assert user_cohorts({"gender": "other"}) == ["gender:other"]
+
+@pytest.mark.asyncio
+async def test_cohort_users_query(delete_users, create_user):
+    user_id = decode_token(create_user)["user_id"]
+    try:
+        conn = await setup_connection()
+        await conn.execute(
+            """
+            insert into user_weights
+            (user_id, weight, created_at)
+            values
+            ($1, 72, now() at time zone 'utc' + interval '1 minute')
+            """, user_id
+        )
+        rows = await conn.fetch(cohort_users_query, [user_id])
+        assert len(rows) == 1
+        assert rows[0]["weight"] == 72
+
+        cohorts = user_cohorts(cohort_user_data(rows[0]))
+        assert "weight:70-80" in cohorts
+        assert "gender:male:weight:70-80" in cohorts
+        assert "weight:90-100" not in cohorts
+    finally:
+        if conn: await conn.close()
+
+@pytest.mark.asyncio
+async def test_cohort_move():
+    r = await redis_connection()
+    user_id = str(uuid4())
+    overall_row = {column: 10 for column in overall_column_map.values()}
+    user_data = {"gender": "male", "age": 25, "weight": 85}
+    old_cohorts = user_cohorts(user_data)
+    new_cohorts = user_cohorts(user_data | {"weight": 92})
+    try:
+        for cohorts in [old_cohorts, new_cohorts]:
+            await apply_leaderboard_updates(
+                r,
+                leaderboard_updates(user_id, overall_row, [], cohorts),
+                {user_id: cohorts}
+            )
+
+        assert await r.hget(cohorts_key, user_id) == ",".join(new_cohorts)
+        for metric in overall_column_map.keys():
+            for cohort in ["weight:80-90", "gender:male:weight:80-90"]:
+                assert await r.zscore(overall_zset_name(metric, cohort), user_id) is None
+            for cohort in new_cohorts:
+                assert await r.zscore(overall_zset_name(metric, cohort), user_id) == 10
+    finally:
+        pipe = r.pipeline(transaction=False)
+        pipe.hdel(cohorts_key, user_id)
+        for metric in overall_column_map.keys():
+            for cohort in [None] + old_cohorts + new_cohorts:
+                pipe.zrem(overall_zset_name(metric, cohort), user_id)
+        await pipe.execute()
+
+def empty_record_filters() -> dict:
+    return {
+        "gender": None,
+        "age_min": None,
+        "age_max": None,
+        "ped_status": None,
+        "height_min": None,
+        "height_max": None,
+        "user_weight_min": None,
+        "user_weight_max": None,
+    }
+
+def test_record_zset_name():
+    exercise_id = str(uuid4())
+    filters = empty_record_filters() | {"gender": "male", "age_min": 20.0}
+    reordered = dict(reversed(list(filters.items())))
+    assert record_zset_name(exercise_id, 5, filters) == record_zset_name(exercise_id, 5, reordered)
+    #? unset filters are left out of the hash
+    assert record_zset_name(exercise_id, 5, filters) == record_zset_name(exercise_id, 5, {"age_min": 20.0, "gender": "male"})
+
+    assert record_zset_name(exercise_id, 5, filters) != record_zset_name(exercise_id, 5, filters | {"age_min": 21.0})
+    assert record_zset_name(exercise_id, 5, filters) != record_zset_name(exercise_id, 3, filters)
+    assert record_zset_name(exercise_id, 5, filters).startswith(f"record:{exercise_id}:5:")
+
+def test_request_cohort():
+    assert request_cohort(gender=None, age=None) is None
+    assert request_cohort(gender="male", age=None, weight="80-90") == "gender:male:weight:80-90"
+    assert request_cohort(age="50+") == "age:50+"
+    with pytest.raises(Exception, match="unsupported cohort"):
+        request_cohort(age="18-22", weight="80-90")
+    with pytest.raises(Exception, match="unknown age bucket"):
+        request_cohort(age="18-21")
+
+@pytest.mark.asyncio
+async def test_cache_record_zset(delete_users, create_user):
+    r = await redis_connection()
+    user_id = decode_token(create_user)["user_id"]
+    response = client.post("/register/new", json=valid_user | {"email": "recordUser@pytest.com", "username": "recordUser"})
+    assert response.status_code == 200
+    other_id = response.json()["user_id"]
+    try:
+        conn = await setup_connection()
+        exercise_id = str(await conn.fetchval("select id from exercises limit 1"))
+        await conn.execute("update users set gender = 'female' where id = $1", other_id)
+        await conn.executemany(
+            """
+            insert into exercise_records
+            (user_id, exercise_id, reps, weight, age, ped_status, height, user_weight)
+            values
+            ($1, $2, $3, $4, $5, 'natural', 180, $6)
+            """,
+            [
+                (user_id, exercise_id, 5, 100, 24, 90),
+                (user_id, exercise_id, 5, 110, 25, 92),
+                (user_id, exercise_id, 3, 130, 25, 92),
+                (other_id, exercise_id, 5, 70, 31, 60),
+            ]
+        )
+
+        async def cached(**set_filters) -> dict:
+            filters = empty_record_filters() | set_filters
+            zset = record_zset_name(exercise_id, 5, filters)
+            await cache_record_zset(conn, r, zset, exercise_id, 5, filters)
+            assert 0 < await r.ttl(zset) <= record_cache_ttl_secs()
+            return dict(await r.zrange(zset, 0, -1, withscores=True))
+
+        #? best weight per user at the requested reps
+        assert await cached() == {user_id: 110, other_id: 70}
+        assert await cached(gender="female") == {other_id: 70}
+        assert await cached(age_min=30.0) == {other_id: 70}
+        assert await cached(age_max=24.5) == {user_id: 100}
+        assert await cached(user_weight_min=91.0, age_max=30.0) == {user_id: 110}
+
+        filters = empty_record_filters() | {"gender": "other"}
+        zset = record_zset_name(exercise_id, 5, filters)
+        await cache_record_zset(conn, r, zset, exercise_id, 5, filters)
+        assert not await r.exists(zset)
+        assert await r.ttl(record_empty_key(zset)) > 0
+        assert await zset_exists(r, zset, record_empty_key(zset))
+    finally:
+        if conn: await conn.close()
@@ -0,0 +1,64 @@
+import pytest
+from fastapi.testclient import TestClient
+import math
+
+from ..main import app
+from ..api.middleware.database import setup_connection
+from ..tests.test_workout_save import build_workouts, save_workouts
+
+client = TestClient(app)
+
+@pytest.mark.asyncio
+async def test_muscles_history(delete_users, create_user):
+    headers = {
+        "Authorization": f"Bearer {create_user}"
+    }
+
+    try:
+        conn = await setup_connection()
+
+        workouts = await build_workouts(conn, 5, 10, recent=True)
+        await save_workouts(workouts, headers)
+
+        targets = {}
+        for workout in workouts:
+            for exercise in workout["exercises"]:
+                rows = await conn.fetch(
+                    """
+                    select group_name, target_name
+                    from exercise_muscle_data
+                    where exercise_id = $1
+                    """, exercise["id"]
+                )
+                for row in rows:
+                    key = (row["group_name"], row["target_name"])
+                    target = targets.setdefault(key, {"volume": 0, "sets": 0, "reps": 0})
+                    for set_data in exercise["set_data"]:
+                        target["volume"] += set_data["reps"] * set_data["weight"] * set_data["num_sets"]
+                        target["sets"] += set_data["num_sets"]
+                        target["reps"] += set_data["reps"]
+
+        response = client.get("/home/muscles-history", headers=headers)
+        assert response.status_code == 200
+        data = response.json()["data"]
+
+        resp_targets = {
+            (group_name, target_name): target_data
+            for group_name, group_data in data["all"].items()
+            for target_name, target_data in group_data["targets"].items()
+        }
+        assert resp_targets.keys() == targets.keys()
+        for key, target in targets.items():
+            assert math.isclose(target["volume"], resp_targets[key]["volume"], rel_tol=1e-4)
+            assert target["sets"] == resp_targets[key]["sets"]
+            assert target["reps"] == resp_targets[key]["reps"]
+
+        #? windows are cumulative, a shorter one never holds more than a longer one
+        spans = ["week", "month", "3_months", "6_months", "year", "all"]
+        for shorter, longer in zip(spans, spans[1:]):
+            for group_name, group_data in data[shorter].items():
+                assert group_data["sets"] <= data[longer][group_name]["sets"]
+        assert data["month"] == data["all"]
+
+    finally:
+        if conn: await conn.close()
@@ -0,0 +1,53 @@
+import pytest
+import time
+from fastapi.testclient import TestClient
+
+from ..main import app
+from ..api.middleware.auth_token import decode_token
+from ..api.middleware.database import redis_connection
+from ..api.middleware.presence import *
+from .test_user_search import register_user
+
+client = TestClient(app)
+
+@pytest.mark.asyncio
+async def test_online_friends(delete_users, create_user):
+    r = await redis_connection()
+    headers = {
+        "Authorization": f"Bearer {create_user}"
+    }
+    user_id = decode_token(create_user)["user_id"]
+
+    response = client.get("/home/online-friends", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["data"] == {"has_friends": False, "online_friends": []}
+
+    friend_headers = register_user("presenceFriend", "public")
+    friend_id = decode_token(friend_headers["Authorization"].split(" ")[1])["user_id"]
+    client.post("/users/permissions/update", headers=headers, json={"key": "searchable", "value": "public"})
+    client.post("/users/request/send", headers=friend_headers, json={"target_id": user_id})
+    response = client.post("/users/request/accept", headers=headers, json={"requestor_id": friend_id})
+    assert response.json()["status"] == "accepted"
+
+    response = client.get("/home/online-friends", headers=headers)
+    assert response.json()["data"]["online_friends"] == []
+
+    response = client.post("/users/presence/heartbeat", headers=friend_headers)
+    assert response.status_code == 200
+    response = client.get("/home/online-friends", headers=headers)
+    assert response.json()["data"] == {
+        "has_friends": True,
+        "online_friends": ["presenceFriend"],
+        "more_online_friends": False
+    }
+
+    #? a heartbeat older than the ttl counts as offline even before it is trimmed
+    await r.zadd(presence_key, {friend_id: time.time() - presence_ttl_secs() - 1})
+    response = client.get("/home/online-friends", headers=headers)
+    assert response.json()["data"]["online_friends"] == []
+
+    client.post("/users/presence/heartbeat", headers=friend_headers)
+    response = client.post("/users/presence/offline", headers=friend_headers)
+    assert response.status_code == 200
+    response = client.get("/home/online-friends", headers=headers)
+    assert response.json()["data"]["online_friends"] == []
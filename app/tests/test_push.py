@@ -0,0 +1,36 @@
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from ..main import app
+from ..api.middleware.auth_token import decode_token
+from .test_user_search import register_user
+
+def test_push_socket_rejects_bad_token():
+    client = TestClient(app)
+    with pytest.raises(WebSocketDisconnect) as e:
+        with client.websocket_connect("/ws", params={"token": "not a token"}) as websocket:
+            websocket.receive_text()
+    assert e.value.code == 1008
+
+def test_push_friend_request(delete_users, create_user):
+    headers = {
+        "Authorization": f"Bearer {create_user}"
+    }
+    user_id = decode_token(create_user)["user_id"]
+
+    #? the context manager runs the lifespan, which starts the pub/sub listener
+    with TestClient(app) as client:
+        client.post("/users/permissions/update", headers=headers, json={"key": "searchable", "value": "public"})
+        requestor_headers = register_user("pushRequestor", "public")
+        requestor_id = decode_token(requestor_headers["Authorization"].split(" ")[1])["user_id"]
+
+        with client.websocket_connect("/ws", headers=headers) as websocket:
+            response = client.post("/users/request/send", headers=requestor_headers, json={"target_id": user_id})
+            assert response.json()["status"] == "requested"
+
+            assert websocket.receive_json() == {
+                "type": "friend_request",
+                "user_id": requestor_id,
+                "status": "requested"
+            }
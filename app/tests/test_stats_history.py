@@ -0,0 +1,49 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from ..main import app
+from ..api.middleware.database import setup_connection
+from ..tests.test_workout_save import build_workouts, save_workouts
+
+client = TestClient(app)
+
+@pytest.mark.asyncio
+async def test_stats_history_pages(delete_users, create_user):
+    headers = {
+        "Authorization": f"Bearer {create_user}"
+    }
+
+    try:
+        conn = await setup_connection()
+
+        workouts = await build_workouts(conn, 5, 10)
+        await save_workouts(workouts, headers)
+
+        stats = []
+        params = {"limit": 3}
+        while True:
+            response = client.get("/stats/history", headers=headers, params=params)
+            assert response.status_code == 200
+            stats += response.json()["stats"]
+            if response.json()["next"] is None: break
+            params["before"] = response.json()["next"]
+
+        assert len(stats) == len(workouts)
+        started_ats = [item["metadata"]["started_at"] for item in stats]
+        assert started_ats == sorted(started_ats, reverse=True)
+
+        workouts.sort(key=lambda workout: workout["start_time"], reverse=True)
+        for item, workout in zip(stats, workouts):
+            assert item["workout_stats"]["num_exercises"] == len(workout["exercises"])
+            assert len(item["replay"]) == len(workout["exercises"])
+            assert len(item["metadata"]["top_groups"]) <= 3
+
+        response = client.get("/stats/history", headers=headers)
+        assert response.json()["stats"] == stats
+        assert response.json()["next"] is None
+
+        response = client.get("/stats/history", headers=headers, params={"before": "not a cursor"})
+        assert response.status_code != 200
+
+    finally:
+        if conn: await conn.close()
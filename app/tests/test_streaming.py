@@ -0,0 +1,24 @@
+import pytest
+import json
+
+from ..api.middleware.streaming import *
+
+@pytest.mark.asyncio
+async def test_json_chunks():
+    async def items():
+        for i in range(3):
+            yield {"x": i}
+
+    value = {
+        "items": items(),
+        "points": (i * 2 for i in range(4)),
+        "nested": {1: [1.5, None], "b": "c"},
+        "next": lambda: "cursor",
+    }
+    body = b"".join([chunk async for chunk in buffered_chunks(json_chunks(value))])
+    assert json.loads(body) == {
+        "items": [{"x": 0}, {"x": 1}, {"x": 2}],
+        "points": [0, 2, 4, 6],
+        "nested": {"1": [1.5, None], "b": "c"},
+        "next": "cursor",
+    }
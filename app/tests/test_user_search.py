@@ -0,0 +1,73 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from ..main import app
+from ..api.middleware.auth_token import decode_token, generate_token
+from ..api.middleware.database import redis_connection
+from ..api.middleware.user_search import *
+from .conftest import valid_user
+
+client = TestClient(app)
+
+def register_user(username: str, searchable: str) -> dict:
+    user = valid_user | {
+        "email": f"{username}@pytest.com",
+        "username": username
+    }
+    response = client.post("/register/new", json=user)
+    assert response.status_code == 200
+    user_id = response.json()["user_id"]
+
+    headers = {
+        "Authorization": f"Bearer {generate_token(user['email'], user_id, minutes=30)}"
+    }
+    response = client.post("/users/permissions/update", headers=headers, json={"key": "searchable", "value": searchable})
+    assert response.status_code == 200
+    return headers
+
+def search(headers, username) -> dict:
+    response = client.get("/users/search", headers=headers, params={"username": username})
+    assert response.status_code == 200
+    return {match["username"]: match["relation"] for match in response.json()["matches"]}
+
+@pytest.mark.asyncio
+async def test_users_search(delete_users, create_user):
+    r = await redis_connection()
+    #? users deleted by the fixture are still indexed
+    await r.delete(user_search_key, searchable_users_key)
+
+    headers = {
+        "Authorization": f"Bearer {create_user}"
+    }
+    user_id = decode_token(create_user)["user_id"]
+
+    alpha_headers = register_user("SearchAlpha", "public")
+    register_user("searchBeta", "public")
+    register_user("searchPrivate", "private")
+    register_user("other", "public")
+
+    assert search(headers, "search") == {"SearchAlpha": "none", "searchBeta": "none"}
+    assert search(headers, "SEARCHA") == {"SearchAlpha": "none"}
+    assert search(headers, "searchz") == {}
+
+    alpha_id = decode_token(alpha_headers["Authorization"].split(" ")[1])["user_id"]
+    response = client.post("/users/request/send", headers=headers, json={"target_id": alpha_id})
+    assert response.json()["status"] == "requested"
+    assert search(headers, "search")["SearchAlpha"] == "requested"
+
+    response = client.post("/users/request/accept", headers=alpha_headers, json={"requestor_id": user_id})
+    assert response.json()["status"] == "accepted"
+    assert search(headers, "search") == {"searchBeta": "none"}
+
+    response = client.post("/users/friends/block", headers=headers, json={"target_id": alpha_id})
+    assert response.status_code == 200
+    assert "SearchAlpha" not in search(headers, "search")
+
+    #? an evicted set is loaded back from postgres, never read as empty
+    await r.delete(user_set_key(user_id, "blocked"))
+    assert "SearchAlpha" not in search(headers, "search")
+    assert await r.ttl(user_set_key(user_id, "blocked")) > 0
+
+    response = client.post("/users/friends/unblock", headers=headers, json={"target_id": alpha_id})
+    assert response.status_code == 200
+    assert search(headers, "search")["SearchAlpha"] == "none"
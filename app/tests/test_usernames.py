@@ -0,0 +1,21 @@
+import pytest
+
+from ..api.middleware.auth_token import decode_token
+from ..api.middleware.database import acquire_connection, redis_connection
+from ..api.middleware.usernames import *
+
+@pytest.mark.asyncio
+async def test_fetch_usernames(delete_users, create_user):
+    user_id = decode_token(create_user)["user_id"]
+    r = await redis_connection()
+
+    async with acquire_connection() as conn:
+        username = await conn.fetchval("select username from users where id = $1", user_id)
+        assert await r.hget(usernames_key, user_id) == username
+
+        await r.hdel(usernames_key, user_id)
+        missing_id = "00000000-0000-0000-0000-000000000000"
+        usernames = await fetch_usernames(conn, r, [user_id, user_id, missing_id])
+
+    assert usernames == {user_id: username, missing_id: None}
+    assert await r.hget(usernames_key, user_id) == username
@@ -110,4 +110,36 @@ async def test_workout_overview_stats(delete_users, create_user):
         print(str(e))
         raise e
     finally:
-        if conn: await conn.close()
\ No newline at end of file
+        if conn: await conn.close()
+
+@pytest.mark.asyncio
+async def test_workout_overview_stats_pages(delete_users, create_user):
+    headers = {
+        "Authorization": f"Bearer {create_user}"
+    }
+
+    try:
+        conn = await setup_connection()
+
+        workouts = await build_workouts(conn, 5, 10)
+        await save_workouts(workouts, headers)
+
+        paged_workouts = []
+        params = {"limit": 3}
+        while True:
+            response = client.get("/workout/overview/stats", headers=headers, params=params)
+            assert response.status_code == 200
+            paged_workouts += response.json()["workouts"]
+            if response.json()["next"] is None: break
+            params["before"] = response.json()["next"]
+
+        assert len(paged_workouts) == len(workouts)
+        started_ats = [workout["started_at"] for workout in paged_workouts]
+        assert started_ats == sorted(started_ats, reverse=True)
+
+        response = client.get("/workout/overview/stats", headers=headers)
+        assert response.json()["workouts"] == paged_workouts
+        assert response.json()["next"] is None
+
+    finally:
+        if conn: await conn.close()
@@ -7,8 +7,9 @@ from copy import deepcopy
 
 from ..main import app
 from ..api.middleware.auth_token import decode_token
-from ..api.middleware.database import setup_connection
+from ..api.middleware.database import setup_connection, redis_connection
 from ..api.middleware.misc import *
+from ..api.routes.workout.events import drain_workout_events
  
 client = TestClient(app)
 
@@ -58,6 +59,142 @@ async def test_save_workout(delete_users, create_user):
     finally:
         if conn: await conn.close()
 
+@pytest.mark.asyncio
+async def test_save_workout_repeated_exercise(delete_users, create_user):
+    auth_token = create_user
+    user_id = decode_token(auth_token)["user_id"]
+    headers = {
+        "Authorization": f"Bearer {auth_token}"
+    }
+
+    try:
+        conn = await setup_connection()
+
+        exercise_id = str(await conn.fetchval("select id from exercises limit 1"))
+        set_data = [{
+            "reps": 10,
+            "weight": 50.0,
+            "num_sets": 3,
+            "set_class": "working"
+        }]
+        req_body = {
+            "exercises": [
+                {"id": exercise_id, "set_data": set_data},
+                {"id": exercise_id, "set_data": set_data},
+            ],
+            "start_time": now_timestamp_ms(),
+            "duration": 30 * 60 * 1000
+        }
+
+        for _ in range(2):
+            response = client.post("/workout/save", json=req_body, headers=headers)
+            assert response.status_code == 200
+        await run_workout_worker()
+
+        assert 0 == await conn.fetchval(
+            """
+            select count(*)
+            from workout_events
+            where user_id = $1
+            and processed_at is null
+            """, user_id
+        )
+
+        totals_row = await conn.fetchrow(
+            """
+            select *
+            from exercise_totals
+            where user_id = $1
+            and exercise_id = $2
+            """, user_id, exercise_id
+        )
+        assert totals_row["counter"] == 4
+        assert totals_row["num_sets"] == 12
+        assert math.isclose(totals_row["volume"], 4 * 10 * 50.0 * 3)
+
+        leaderboard_row = await conn.fetchrow(
+            """
+            select *
+            from exercises_leaderboard
+            where user_id = $1
+            and exercise_id = $2
+            """, user_id, exercise_id
+        )
+        assert leaderboard_row["num_workouts"] == 2
+        assert leaderboard_row["reps"] == 40
+
+        overall_row = await conn.fetchrow(
+            """
+            select *
+            from overall_leaderboard
+            where user_id = $1
+            """, user_id
+        )
+        assert overall_row["num_workouts"] == 2
+
+        r = await redis_connection()
+        assert await r.zscore(exercise_zset_name(exercise_id, "workouts"), user_id) == leaderboard_row["num_workouts"]
+        assert await r.zscore(exercise_zset_name(exercise_id, "reps"), user_id) == leaderboard_row["reps"]
+        assert math.isclose(await r.zscore(exercise_zset_name(exercise_id, "volume"), user_id), leaderboard_row["volume"], rel_tol=1e-6)
+        assert await r.zscore(overall_zset_name("workouts"), user_id) == overall_row["num_workouts"]
+
+        #? redis was reachable so nothing was parked for sync_redis
+        assert None == await conn.fetchrow(
+            """
+            select *
+            from leaderboard_outbox
+            where user_id = $1
+            """, user_id
+        )
+
+        assert 2 * 2 == await conn.fetchval(
+            """
+            select count(*)
+            from workout_exercises we
+            inner join workouts w
+            on we.workout_id = w.id
+            where w.user_id = $1
+            """, user_id
+        )
+
+    finally:
+        if conn: await conn.close()
+
+@pytest.mark.asyncio
+async def test_save_workout_missing_weight(delete_users, create_user):
+    auth_token = create_user
+    user_id = decode_token(auth_token)["user_id"]
+    headers = {
+        "Authorization": f"Bearer {auth_token}"
+    }
+
+    try:
+        conn = await setup_connection()
+
+        exercise_id = str(await conn.fetchval("select id from exercises limit 1"))
+        req_body = {
+            "exercises": [{
+                "id": exercise_id,
+                "set_data": [{
+                    "reps": 10,
+                    "weight": None,
+                    "num_sets": 3,
+                    "set_class": "working"
+                }]
+            }],
+            "start_time": now_timestamp_ms(),
+            "duration": 30 * 60 * 1000
+        }
+        response = client.post("/workout/save", json=req_body, headers=headers)
+        assert response.status_code == 400
+
+        #? rejected before the transaction, no event is left for the worker
+        assert 0 == await conn.fetchval("select count(*) from workouts where user_id = $1", user_id)
+        assert 0 == await conn.fetchval("select count(*) from workout_events where user_id = $1", user_id)
+
+    finally:
+        if conn: await conn.close()
+
 async def check_correct_save(conn, user_id, workouts):
     workout_rows = await conn.fetch(
         """
@@ -340,6 +477,15 @@ async def save_workouts(workouts, headers, skip_fail=False):
         except Exception as e:
             if skip_fail: continue
             raise e
+    await run_workout_worker()
+
+#? totals are derived by the workout worker, run it inline before checking them
+async def run_workout_worker():
+    conn = await setup_connection()
+    try:
+        await drain_workout_events(conn, await redis_connection())
+    finally:
+        await conn.close()
 
 # todo: test empty save
 # todo: test invalid saves
@@ -0,0 +1,3 @@
+-- presence moved to redis (presence:online, see app/api/middleware/presence.py)
+
+DROP TABLE public.online_users;
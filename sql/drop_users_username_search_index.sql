@@ -0,0 +1,4 @@
+-- /users/search reads the redis lex index (see app/api/middleware/user_search.py), nothing queries users by username prefix any more
+-- pg_trgm is left installed, dropping an extension is not this migration's call
+
+DROP INDEX IF EXISTS public.users_username_lower_trgm_idx;
@@ -0,0 +1,5 @@
+-- record leaderboards filter on (exercise_id, reps) and rank by weight
+CREATE INDEX exercise_records_exercise_reps_weight_idx ON public.exercise_records USING btree (exercise_id, reps, weight DESC);
+
+-- workout events look up a user's current records per exercise
+CREATE INDEX exercise_records_user_exercise_idx ON public.exercise_records USING btree (user_id, exercise_id);
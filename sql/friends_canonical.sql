@@ -0,0 +1,20 @@
+-- each friendship is stored once as (least id, greatest id), so a pair is found through the primary key either way round
+-- user2_id gets its own index for the friends of a user on the greater side
+
+DELETE FROM public.friends
+WHERE user1_id = user2_id;
+
+DELETE FROM public.friends f
+USING public.friends g
+WHERE f.user1_id = g.user2_id
+AND f.user2_id = g.user1_id
+AND f.user1_id > f.user2_id;
+
+UPDATE public.friends
+SET user1_id = user2_id, user2_id = user1_id
+WHERE user1_id > user2_id;
+
+ALTER TABLE ONLY public.friends
+    ADD CONSTRAINT friends_canonical_check CHECK (user1_id < user2_id);
+
+CREATE INDEX friends_user2_id_idx ON public.friends USING btree (user2_id);
@@ -0,0 +1,14 @@
+-- leaderboard updates that could not reach redis after a workout save, drained by sync_redis
+
+CREATE TABLE public.leaderboard_outbox (
+    id uuid DEFAULT public.uuid_generate_v4() NOT NULL,
+    user_id uuid NOT NULL,
+    exercise_ids uuid[] NOT NULL,
+    created_at timestamp without time zone DEFAULT (now() AT TIME ZONE 'utc'::text) NOT NULL
+);
+
+ALTER TABLE ONLY public.leaderboard_outbox
+    ADD CONSTRAINT leaderboard_outbox_pkey PRIMARY KEY (id);
+
+ALTER TABLE ONLY public.leaderboard_outbox
+    ADD CONSTRAINT leaderboard_outbox_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id) ON DELETE CASCADE;
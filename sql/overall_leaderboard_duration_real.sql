@@ -0,0 +1,4 @@
+-- workout saves add each workout's exact duration in minutes, an integer column would round every workout before summing
+
+ALTER TABLE public.overall_leaderboard
+    ALTER COLUMN duration_mins TYPE real;
@@ -0,0 +1,62 @@
+-- workout save upserts totals with `on conflict`, which needs a key on each table
+-- duplicate rows each hold part of the user's totals, they are merged into one row per key before the key is added
+-- every counter is additive, last_updated keeps the latest
+
+BEGIN;
+
+CREATE TEMPORARY TABLE merged_exercise_totals ON COMMIT DROP AS
+    SELECT user_id, exercise_id, sum(volume) AS volume, sum(num_sets) AS num_sets, sum(reps) AS reps, sum(counter) AS counter
+    FROM public.exercise_totals
+    GROUP BY user_id, exercise_id
+    HAVING count(*) > 1;
+
+DELETE FROM public.exercise_totals t
+    USING merged_exercise_totals m
+    WHERE t.user_id = m.user_id
+    AND t.exercise_id = m.exercise_id;
+
+INSERT INTO public.exercise_totals (user_id, exercise_id, volume, num_sets, reps, counter)
+    SELECT user_id, exercise_id, volume, num_sets, reps, counter
+    FROM merged_exercise_totals;
+
+CREATE TEMPORARY TABLE merged_exercises_leaderboard ON COMMIT DROP AS
+    SELECT user_id, exercise_id, sum(volume) AS volume, sum(num_sets) AS num_sets, sum(reps) AS reps,
+        sum(num_workouts) AS num_workouts, max(last_updated) AS last_updated
+    FROM public.exercises_leaderboard
+    GROUP BY user_id, exercise_id
+    HAVING count(*) > 1;
+
+DELETE FROM public.exercises_leaderboard t
+    USING merged_exercises_leaderboard m
+    WHERE t.user_id = m.user_id
+    AND t.exercise_id = m.exercise_id;
+
+INSERT INTO public.exercises_leaderboard (user_id, exercise_id, volume, num_sets, reps, num_workouts, last_updated)
+    SELECT user_id, exercise_id, volume, num_sets, reps, num_workouts, last_updated
+    FROM merged_exercises_leaderboard;
+
+CREATE TEMPORARY TABLE merged_overall_leaderboard ON COMMIT DROP AS
+    SELECT user_id, sum(volume) AS volume, sum(num_sets) AS num_sets, sum(reps) AS reps, sum(num_exercises) AS num_exercises,
+        sum(num_workouts) AS num_workouts, sum(duration_mins) AS duration_mins, max(last_updated) AS last_updated
+    FROM public.overall_leaderboard
+    GROUP BY user_id
+    HAVING count(*) > 1;
+
+DELETE FROM public.overall_leaderboard t
+    USING merged_overall_leaderboard m
+    WHERE t.user_id = m.user_id;
+
+INSERT INTO public.overall_leaderboard (user_id, volume, num_sets, reps, num_exercises, num_workouts, duration_mins, last_updated)
+    SELECT user_id, volume, num_sets, reps, num_exercises, num_workouts, duration_mins, last_updated
+    FROM merged_overall_leaderboard;
+
+ALTER TABLE ONLY public.exercise_totals
+    ADD CONSTRAINT exercise_totals_pkey PRIMARY KEY (user_id, exercise_id);
+
+ALTER TABLE ONLY public.exercises_leaderboard
+    ADD CONSTRAINT exercises_leaderboard_pkey PRIMARY KEY (user_id, exercise_id);
+
+ALTER TABLE ONLY public.overall_leaderboard
+    ADD CONSTRAINT overall_leaderboard_pkey PRIMARY KEY (user_id);
+
+COMMIT;
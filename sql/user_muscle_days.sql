@@ -0,0 +1,59 @@
+-- per user, per utc day volume / sets / reps for every muscle group and target, added to by workout_worker
+-- /home/muscles-history sums these instead of every set ever logged
+
+CREATE TABLE public.user_muscle_group_days (
+    user_id uuid NOT NULL,
+    day date NOT NULL,
+    muscle_group_id uuid NOT NULL,
+    volume real NOT NULL,
+    num_sets integer NOT NULL,
+    reps integer NOT NULL
+);
+
+ALTER TABLE ONLY public.user_muscle_group_days
+    ADD CONSTRAINT user_muscle_group_days_pkey PRIMARY KEY (user_id, day, muscle_group_id);
+
+ALTER TABLE ONLY public.user_muscle_group_days
+    ADD CONSTRAINT user_muscle_group_days_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id) ON DELETE CASCADE;
+
+ALTER TABLE ONLY public.user_muscle_group_days
+    ADD CONSTRAINT user_muscle_group_days_muscle_group_id_fkey FOREIGN KEY (muscle_group_id) REFERENCES public.muscle_groups(id) ON DELETE CASCADE;
+
+CREATE TABLE public.user_muscle_target_days (
+    user_id uuid NOT NULL,
+    day date NOT NULL,
+    muscle_target_id uuid NOT NULL,
+    volume real NOT NULL,
+    num_sets integer NOT NULL,
+    reps integer NOT NULL
+);
+
+ALTER TABLE ONLY public.user_muscle_target_days
+    ADD CONSTRAINT user_muscle_target_days_pkey PRIMARY KEY (user_id, day, muscle_target_id);
+
+ALTER TABLE ONLY public.user_muscle_target_days
+    ADD CONSTRAINT user_muscle_target_days_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id) ON DELETE CASCADE;
+
+ALTER TABLE ONLY public.user_muscle_target_days
+    ADD CONSTRAINT user_muscle_target_days_muscle_target_id_fkey FOREIGN KEY (muscle_target_id) REFERENCES public.muscle_targets(id) ON DELETE CASCADE;
+
+-- workouts the worker has already processed, pending ones are added when their event is applied
+INSERT INTO public.user_muscle_group_days (user_id, day, muscle_group_id, volume, num_sets, reps)
+    SELECT w.user_id, (w.started_at AT TIME ZONE 'utc')::date, emg.group_id,
+        sum(wsd.reps * wsd.weight * wsd.num_sets), sum(wsd.num_sets), sum(wsd.reps)
+    FROM public.workout_set_data wsd
+    INNER JOIN public.workout_exercises we ON we.id = wsd.workout_exercise_id
+    INNER JOIN public.workouts w ON w.id = we.workout_id
+    INNER JOIN public.workout_events e ON e.workout_id = w.id AND e.processed_at IS NOT NULL
+    INNER JOIN (SELECT DISTINCT exercise_id, group_id FROM public.exercise_muscle_data) emg ON emg.exercise_id = we.exercise_id
+    GROUP BY 1, 2, 3;
+
+INSERT INTO public.user_muscle_target_days (user_id, day, muscle_target_id, volume, num_sets, reps)
+    SELECT w.user_id, (w.started_at AT TIME ZONE 'utc')::date, emd.target_id,
+        sum(wsd.reps * wsd.weight * wsd.num_sets), sum(wsd.num_sets), sum(wsd.reps)
+    FROM public.workout_set_data wsd
+    INNER JOIN public.workout_exercises we ON we.id = wsd.workout_exercise_id
+    INNER JOIN public.workouts w ON w.id = we.workout_id
+    INNER JOIN public.workout_events e ON e.workout_id = w.id AND e.processed_at IS NOT NULL
+    INNER JOIN public.exercise_muscle_data emd ON emd.exercise_id = we.exercise_id
+    GROUP BY 1, 2, 3;
@@ -0,0 +1,51 @@
+-- best weight per user, exercise and rep count, plus the best per day, upserted by workout_worker
+-- ties keep the earliest achieved_at
+
+CREATE TABLE public.user_rep_maxes (
+    user_id uuid NOT NULL,
+    exercise_id uuid NOT NULL,
+    reps integer NOT NULL,
+    weight real NOT NULL,
+    achieved_at timestamp with time zone NOT NULL
+);
+
+ALTER TABLE ONLY public.user_rep_maxes
+    ADD CONSTRAINT user_rep_maxes_pkey PRIMARY KEY (user_id, exercise_id, reps);
+
+ALTER TABLE ONLY public.user_rep_maxes
+    ADD CONSTRAINT user_rep_maxes_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id) ON DELETE CASCADE;
+
+ALTER TABLE ONLY public.user_rep_maxes
+    ADD CONSTRAINT user_rep_maxes_exercise_id_fkey FOREIGN KEY (exercise_id) REFERENCES public.exercises(id) ON DELETE CASCADE;
+
+CREATE TABLE public.user_rep_max_days (
+    user_id uuid NOT NULL,
+    exercise_id uuid NOT NULL,
+    reps integer NOT NULL,
+    day date NOT NULL,
+    weight real NOT NULL,
+    achieved_at timestamp with time zone NOT NULL
+);
+
+ALTER TABLE ONLY public.user_rep_max_days
+    ADD CONSTRAINT user_rep_max_days_pkey PRIMARY KEY (user_id, exercise_id, reps, day);
+
+ALTER TABLE ONLY public.user_rep_max_days
+    ADD CONSTRAINT user_rep_max_days_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id) ON DELETE CASCADE;
+
+ALTER TABLE ONLY public.user_rep_max_days
+    ADD CONSTRAINT user_rep_max_days_exercise_id_fkey FOREIGN KEY (exercise_id) REFERENCES public.exercises(id) ON DELETE CASCADE;
+
+-- workouts saved before these tables existed
+INSERT INTO public.user_rep_max_days (user_id, exercise_id, reps, day, weight, achieved_at)
+    SELECT DISTINCT ON (w.user_id, we.exercise_id, wsd.reps, (w.started_at AT TIME ZONE 'utc')::date)
+        w.user_id, we.exercise_id, wsd.reps, (w.started_at AT TIME ZONE 'utc')::date, wsd.weight, w.started_at
+    FROM public.workout_set_data wsd
+    INNER JOIN public.workout_exercises we ON we.id = wsd.workout_exercise_id
+    INNER JOIN public.workouts w ON w.id = we.workout_id
+    ORDER BY w.user_id, we.exercise_id, wsd.reps, (w.started_at AT TIME ZONE 'utc')::date, wsd.weight DESC, w.started_at;
+
+INSERT INTO public.user_rep_maxes (user_id, exercise_id, reps, weight, achieved_at)
+    SELECT DISTINCT ON (user_id, exercise_id, reps) user_id, exercise_id, reps, weight, achieved_at
+    FROM public.user_rep_max_days
+    ORDER BY user_id, exercise_id, reps, weight DESC, achieved_at;
@@ -0,0 +1,7 @@
+-- prefix search of /users/search, lower(username) like 'abc%'
+-- the unique btree on lower(username) uses the default collation so it cannot serve like,
+-- a trigram index can, including from the generic plans of prepared statements
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX users_username_lower_trgm_idx ON public.users USING gin (lower(username) public.gin_trgm_ops);
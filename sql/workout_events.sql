@@ -0,0 +1,30 @@
+-- raw workouts waiting for workout_worker to derive totals, records and leaderboards
+
+CREATE TABLE public.workout_events (
+    id uuid DEFAULT public.uuid_generate_v4() NOT NULL,
+    workout_id uuid NOT NULL,
+    user_id uuid NOT NULL,
+    attempts integer DEFAULT 0 NOT NULL,
+    last_error text,
+    created_at timestamp without time zone DEFAULT (now() AT TIME ZONE 'utc'::text) NOT NULL,
+    processed_at timestamp without time zone
+);
+
+ALTER TABLE ONLY public.workout_events
+    ADD CONSTRAINT workout_events_pkey PRIMARY KEY (id);
+
+ALTER TABLE ONLY public.workout_events
+    ADD CONSTRAINT workout_events_workout_id_key UNIQUE (workout_id);
+
+ALTER TABLE ONLY public.workout_events
+    ADD CONSTRAINT workout_events_workout_id_fkey FOREIGN KEY (workout_id) REFERENCES public.workouts(id) ON DELETE CASCADE;
+
+ALTER TABLE ONLY public.workout_events
+    ADD CONSTRAINT workout_events_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id) ON DELETE CASCADE;
+
+CREATE INDEX workout_events_pending_idx ON public.workout_events USING btree (created_at) WHERE (processed_at IS NULL);
+
+-- workouts saved before the worker existed already have their totals applied
+INSERT INTO public.workout_events (workout_id, user_id, processed_at)
+    SELECT id, user_id, created_at
+    FROM public.workouts;
@@ -0,0 +1,21 @@
+-- one precomputed /stats/history item per workout, written by workout_worker
+-- run `python -m app.local.backfill_workout_summaries` afterwards for workouts saved before this table
+
+CREATE TABLE public.workout_summaries (
+    workout_id uuid NOT NULL,
+    user_id uuid NOT NULL,
+    started_at timestamp with time zone NOT NULL,
+    summary jsonb NOT NULL,
+    created_at timestamp without time zone DEFAULT (now() AT TIME ZONE 'utc'::text) NOT NULL
+);
+
+ALTER TABLE ONLY public.workout_summaries
+    ADD CONSTRAINT workout_summaries_pkey PRIMARY KEY (workout_id);
+
+ALTER TABLE ONLY public.workout_summaries
+    ADD CONSTRAINT workout_summaries_workout_id_fkey FOREIGN KEY (workout_id) REFERENCES public.workouts(id) ON DELETE CASCADE;
+
+ALTER TABLE ONLY public.workout_summaries
+    ADD CONSTRAINT workout_summaries_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(id) ON DELETE CASCADE;
+
+CREATE INDEX workout_summaries_user_started_at_idx ON public.workout_summaries USING btree (user_id, started_at DESC, workout_id DESC);
@@ -0,0 +1,3 @@
+-- keyset pages of /workout/overview/stats and /exercises/history, newest first
+
+CREATE INDEX workouts_user_started_at_id_idx ON public.workouts USING btree (user_id, started_at DESC, id DESC);
@@ -8,9 +8,9 @@ import sys
 import threading
 import asyncio
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from database import setup_connection, redis_connection
+from database import setup_connection, redis_connection, close_redis_pool
 from misc import *
 
 load_dotenv()
@@ -26,67 +26,292 @@ async def main():
 def sync_runner():
     asyncio.run(sync())
 
+watermark_key = "sync:leaderboard:watermark"
+rebuilt_at_key = "sync:leaderboard:rebuilt_at"
+
+def sync_settings() -> dict:
+    return {
+        #? rows committed slightly after their last_updated are picked up by the next run
+        "overlap_secs": float(os.getenv("SYNC_OVERLAP_SECS", 120)),
+        "full_rebuild_secs": float(os.getenv("SYNC_FULL_REBUILD_SECS", 24 * 60 * 60)),
+        "batch_size": int(os.getenv("SYNC_BATCH_SIZE", 1000)),
+    }
+
 async def sync():
     start = time.time()
+    conn = None
     try:
         r = await redis_connection()
         if not await r.ping(): 
             raise Exception("could not reach redis")
 
         conn = await setup_connection()
+        settings = sync_settings()
+
+        await flush_leaderboard_outbox(r, conn)
+
+        sync_started_at = await conn.fetchval("select now() at time zone 'utc'")
+        watermark = await r.get(watermark_key)
+        rebuilt_at = await r.get(rebuilt_at_key)
+
+        #? a missing watermark means redis was flushed, rebuild rather than trust partial zsets
+        full_rebuild = "--full" in sys.argv or watermark is None or rebuilt_at is None \
+            or time.time() - float(rebuilt_at) >= settings["full_rebuild_secs"]
+
+        if full_rebuild:
+            num_rows = await rebuild_overall(r, conn) + await rebuild_exercises(r, conn) + await rebuild_user_search(r, conn)
+            await r.set(rebuilt_at_key, time.time())
+        else:
+            since = datetime.fromisoformat(watermark)
+            num_rows = await sync_overall(r, conn, since) + await sync_exercises(r, conn, since)
 
-        await sync_overall(r, conn)
-        await sync_exercises(r, conn)
+        await r.set(watermark_key, (sync_started_at - timedelta(seconds=settings["overlap_secs"])).isoformat())
 
-        print(f"{datetime.now().isoformat()}: {(time.time() - start):.3f} secs")
+        mode = "full" if full_rebuild else "incremental"
+        print(f"{datetime.now().isoformat()}: {mode} sync of {num_rows} rows, {(time.time() - start):.3f} secs")
 
     except Exception as e:
         print(str(e))
+    finally:
+        if conn: await conn.close()
+        await close_redis_pool()
+
+#? saves that could not reach redis, the rows are re-read so a late replay never writes stale scores
+async def flush_leaderboard_outbox(r, conn):
+    tx = conn.transaction()
+    await tx.start()
+    try:
+        outbox_rows = await conn.fetch(
+            """
+            select id, user_id, exercise_ids
+            from leaderboard_outbox
+            for update skip locked
+            """
+        )
+        if len(outbox_rows) == 0:
+            await tx.commit()
+            return
+
+        user_ids = list({row["user_id"] for row in outbox_rows})
+        exercise_keys = {
+            (row["user_id"], exercise_id)
+            for row in outbox_rows
+            for exercise_id in row["exercise_ids"]
+        }
+
+        overall_rows = await conn.fetch(
+            """
+            select *
+            from overall_leaderboard
+            where user_id = any($1)
+            """, user_ids
+        )
+        exercise_rows = await conn.fetch(
+            """
+            select *
+            from exercises_leaderboard
+            where user_id = any($1)
+            """, user_ids
+        )
+
+        cohorts = await fetch_cohorts(conn, user_ids)
+        previous_cohorts = await fetch_previous_cohorts(r, cohorts)
+
+        pipe = r.pipeline(transaction=True)
+        for row in overall_rows:
+            for metric, column in overall_column_map.items():
+                for zset in overall_row_zsets(cohorts)(row, metric):
+                    pipe.zadd(zset, {str(row["user_id"]): row[column]})
+        move_cohorts(pipe, previous_cohorts, cohorts)
+        for row in exercise_rows:
+            if (row["user_id"], row["exercise_id"]) not in exercise_keys: continue
+            for metric, column in exercise_column_map.items():
+                pipe.zadd(exercise_zset_name(row["exercise_id"], metric), {str(row["user_id"]): row[column]})
+        await pipe.execute()
 
-async def sync_overall(r, conn):
+        await conn.execute(
+            """
+            delete
+            from leaderboard_outbox
+            where id = any($1)
+            """, [row["id"] for row in outbox_rows]
+        )
+        await tx.commit()
+    except Exception as e:
+        await tx.rollback()
+        raise e
+
+async def fetch_cohorts(conn, user_ids) -> dict:
+    rows = await conn.fetch(cohort_users_query, list(user_ids))
+    return {str(row["user_id"]): user_cohorts(cohort_user_data(row)) for row in rows}
+
+async def fetch_previous_cohorts(r, cohorts) -> dict:
+    user_ids = list(cohorts.keys())
+    if len(user_ids) == 0: return {}
+    return dict(zip(user_ids, await r.hmget(cohorts_key, user_ids)))
+
+def move_cohorts(pipe, previous_cohorts, cohorts):
+    for user_id, new_cohorts in cohorts.items():
+        for cohort in set((previous_cohorts[user_id] or "").split(",")) - set(new_cohorts) - {""}:
+            for metric in overall_column_map.keys():
+                pipe.zrem(overall_zset_name(metric, cohort), user_id)
+        pipe.hset(cohorts_key, user_id, ",".join(new_cohorts))
+
+async def zadd_rows(r, rows, column_map, zset_names):
+    """Pipelines one zadd per zset per metric per row, sent in chunks of SYNC_BATCH_SIZE.
+
+    Rows re-read from postgres are authoritative, so scores are overwritten even when lower (a corrected total).
+    """
+    batch_size = sync_settings()["batch_size"]
+    for i in range(0, len(rows), batch_size):
+        pipe = r.pipeline(transaction=False)
+        for row in rows[i:i + batch_size]:
+            for metric, column in column_map.items():
+                for zset in zset_names(row, metric):
+                    pipe.zadd(zset, {str(row["user_id"]): row[column]})
+        await pipe.execute()
+
+async def replace_zsets(r, rows, column_map, zset_names, zsets):
+    """Builds each zset under a temp key then renames it over the live one, readers never see a partial set."""
+    if len(zsets) == 0: return
+    temp_zset_names = lambda row, metric: [f"{zset}:rebuild" for zset in zset_names(row, metric)]
+    #? clear anything left behind by a rebuild that timed out
+    await r.delete(*[f"{zset}:rebuild" for zset in zsets])
+    await zadd_rows(r, rows, column_map, temp_zset_names)
+
+    built = {zset for row in rows for metric in column_map.keys() for zset in zset_names(row, metric)}
+    pipe = r.pipeline(transaction=False)
+    for zset in zsets:
+        if zset in built:
+            pipe.rename(f"{zset}:rebuild", zset)
+        else:
+            pipe.delete(zset)
+    await pipe.execute()
+
+def overall_row_zsets(cohorts):
+    return lambda row, metric: [
+        overall_zset_name(metric, cohort)
+        for cohort in [None] + cohorts.get(str(row["user_id"]), [])
+    ]
+
+def exercise_row_zsets(row, metric):
+    return [exercise_zset_name(row["exercise_id"], metric)]
+
+async def sync_overall(r, conn, since) -> int:
     rows = await conn.fetch(
         """
         select *
         from overall_leaderboard
-        """
+        where last_updated > $1
+        """, since
     )
+    cohorts = await fetch_cohorts(conn, {row["user_id"] for row in rows})
+    previous_cohorts = await fetch_previous_cohorts(r, cohorts)
+    await zadd_rows(r, rows, overall_column_map, overall_row_zsets(cohorts))
 
-    for metric, column in overall_column_map.items():
-        zset = overall_zset_name(metric)
-        await r.delete(zset)
-        for row in rows:
-            await r.zadd(
-                zset, 
-                {str(row["user_id"]): row[column]}
-            )
+    pipe = r.pipeline(transaction=False)
+    move_cohorts(pipe, previous_cohorts, cohorts)
+    await pipe.execute()
+    return len(rows)
 
-async def sync_exercises(r, conn):
+async def sync_exercises(r, conn, since) -> int:
     rows = await conn.fetch(
+        """
+        select *
+        from exercises_leaderboard
+        where last_updated > $1
+        """, since
+    )
+    await zadd_rows(r, rows, exercise_column_map, exercise_row_zsets)
+    return len(rows)
+
+async def rebuild_overall(r, conn) -> int:
+    rows = await conn.fetch(
+        """
+        select *
+        from overall_leaderboard
+        """
+    )
+    cohorts = await fetch_cohorts(conn, [row["user_id"] for row in rows])
+    zsets = [
+        overall_zset_name(metric, cohort)
+        for metric in overall_column_map.keys()
+        for cohort in [None] + all_cohorts()
+    ]
+    await replace_zsets(r, rows, overall_column_map, overall_row_zsets(cohorts), zsets)
+
+    pipe = r.pipeline(transaction=True)
+    pipe.delete(cohorts_key)
+    if len(cohorts) > 0:
+        pipe.hset(cohorts_key, mapping={user_id: ",".join(new_cohorts) for user_id, new_cohorts in cohorts.items()})
+    await pipe.execute()
+    return len(rows)
+
+async def rebuild_exercises(r, conn) -> int:
+    exercise_rows = await conn.fetch(
         """
         select id
         from exercises
         """
     )
-    for row in rows:
-        await sync_exercise(r, conn, row["id"])
-
-async def sync_exercise(r, conn, exercise_id):
     rows = await conn.fetch(
         """
         select *
         from exercises_leaderboard
-        where exercise_id = $1
-        """, exercise_id
+        """
+    )
+    zsets = [
+        exercise_zset_name(exercise_row["id"], metric)
+        for exercise_row in exercise_rows
+        for metric in exercise_column_map.keys()
+    ]
+    await replace_zsets(r, rows, exercise_column_map, exercise_row_zsets, zsets)
+    return len(rows)
+
+#? search keys are written live by the api, a full rebuild repairs whatever a failed redis write left behind
+async def rebuild_user_search(r, conn) -> int:
+    user_rows = await conn.fetch(
+        """
+        select id, username
+        from users
+        """
+    )
+    searchable_rows = await conn.fetch(
+        """
+        select user_id
+        from user_permissions
+        where permission_key = 'searchable'
+        and permission_value = 'public'
+        """
     )
+    batch_size = sync_settings()["batch_size"]
+    temp_search_key = f"{user_search_key}:rebuild"
+    temp_searchable_key = f"{searchable_users_key}:rebuild"
+    await r.delete(temp_search_key, temp_searchable_key)
+    for i in range(0, len(user_rows), batch_size):
+        await r.zadd(temp_search_key, {
+            user_search_member(row["id"], row["username"]): 0
+            for row in user_rows[i:i + batch_size]
+        })
+    for i in range(0, len(searchable_rows), batch_size):
+        await r.sadd(temp_searchable_key, *[str(row["user_id"]) for row in searchable_rows[i:i + batch_size]])
+
+    pipe = r.pipeline(transaction=True)
+    for temp_key, key, rows in [(temp_search_key, user_search_key, user_rows), (temp_searchable_key, searchable_users_key, searchable_rows)]:
+        if len(rows) > 0:
+            pipe.rename(temp_key, key)
+        else:
+            pipe.delete(key)
+    await pipe.execute()
+
+    #? per user sets are loaded from postgres on a miss (see store_user_set), rebuilding them here could rename a
+    #? snapshot over a newer invalidation, so they are only dropped and each reloads on its next read
+    for name in user_set_names:
+        keys = [key async for key in r.scan_iter(match=user_set_key("*", name), count=batch_size)]
+        for i in range(0, len(keys), batch_size):
+            await r.delete(*keys[i:i + batch_size])
 
-    for metric, column in exercise_column_map.items():
-        zset = exercise_zset_name(exercise_id, metric)
-        await r.delete(exercise_zset_name(exercise_id, metric))
-        for row in rows:
-            await r.zadd(
-                zset, 
-                {str(row["user_id"]): row[column]}
-            )
+    return len(user_rows)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
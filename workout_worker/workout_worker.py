@@ -0,0 +1,58 @@
+import asyncio
+import signal
+from datetime import datetime
+from dotenv import load_dotenv
+
+from app.api.middleware.database import setup_connection, redis_connection, close_redis_pool
+from app.api.routes.workout.events import process_workout_events, worker_settings
+
+load_dotenv()
+
+#? python -m workout_worker.workout_worker
+#? several workers can run side by side, skip locked keeps them on different events
+
+async def main():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(sig, stop.set)
+
+    settings = worker_settings()
+    conn = None
+    reconnect_secs = settings["poll_secs"]
+    try:
+        r = await redis_connection()
+
+        while not stop.is_set():
+            if conn is None or conn.is_closed():
+                #? setup_connection returns None while postgres is unreachable, back off until it is back
+                conn = await setup_connection()
+                if conn is None:
+                    print(f"{datetime.now().isoformat()}: no database connection, retrying in {reconnect_secs}s")
+                    await wait_for_stop(stop, reconnect_secs)
+                    reconnect_secs = min(reconnect_secs * 2, 60)
+                    continue
+                reconnect_secs = settings["poll_secs"]
+
+            try:
+                num_events = await process_workout_events(conn, r, settings["batch_size"])
+                if num_events > 0:
+                    print(f"{datetime.now().isoformat()}: processed {num_events} workout events")
+                    continue
+            except Exception as e:
+                print(str(e))
+
+            await wait_for_stop(stop, settings["poll_secs"])
+
+    finally:
+        if conn: await conn.close()
+        await close_redis_pool()
+
+async def wait_for_stop(stop: asyncio.Event, timeout: float):
+    try:
+        await asyncio.wait_for(stop.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+
+if __name__ == "__main__":
+    asyncio.run(main())